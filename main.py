@@ -10,13 +10,15 @@ from loguru import logger
 from dotenv import load_dotenv
 import os
 import uvicorn
-from tortoise import Tortoise
 
 from modules.bot import SupportBot
 from modules.database import Database, AdminUser
 from modules.config import Config
+from modules.media_retention import MediaRetentionWorker
+from modules.message_archive import MessageArchiveWorker
+from modules.settings_service import SettingsService
 from web.app import app  # Import FastAPI app
-from web.utils import get_password_hash
+from web.utils import get_password_hash_async
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -45,15 +47,28 @@ async def main():
         # Инициализация базы данных (объект-обертка)
         db = Database(config)
         
+        # Общий кэш настроек выполнения (бот, AI, веб)
+        settings = SettingsService(config, db)
+
         # Инициализация бота
-        bot = SupportBot(config, db)
+        bot = SupportBot(config, db, settings=settings)
         await bot.initialize() # Initialize handlers
         
         # Inject dependencies into FastAPI app
         app.state.bot = bot
         app.state.db = db
         app.state.config = config
+        app.state.settings = settings
         bot.ws_manager = getattr(app.state, "ws_manager", None)
+        media_retention = MediaRetentionWorker(bot.media_cache, settings=settings)
+        app.state.media_retention = media_retention
+        message_archive = MessageArchiveWorker(
+            db,
+            days=config.message_archive_days,
+            interval=config.message_archive_interval,
+            batch_size=config.message_archive_batch_size,
+        )
+        app.state.message_archive = message_archive
         
         # Setup startup/shutdown events
         @app.on_event("startup")
@@ -61,13 +76,13 @@ async def main():
             logger.info("Startup: Initializing Database...")
             await db.initialize()
             try:
-                await bot.refresh_runtime_settings(force=True)
+                await settings.start()
             except Exception as e:
-                logger.warning(f"Runtime settings refresh failed: {e}")
+                logger.warning(f"Runtime settings load failed: {e}")
             try:
                 admin = await AdminUser.get_or_none(username="admin")
                 if not admin:
-                    hashed = get_password_hash("admin123")
+                    hashed = await get_password_hash_async("admin123")
                     await AdminUser.create(username="admin", password_hash=hashed, role="admin", is_active=True)
                     logger.info("Seeded default admin: admin/admin123")
                 else:
@@ -80,15 +95,20 @@ async def main():
                 await AdminUser.filter(role="admin").update(is_active=True)
             except Exception:
                 pass
-            logger.info("Startup: Starting Bot Polling...")
-            await bot.start_polling()
+            media_retention.start()
+            message_archive.start()
+            logger.info("Startup: Starting Bot...")
+            await bot.start_receiving()
             
         @app.on_event("shutdown")
         async def shutdown_event():
+            await media_retention.stop()
+            await message_archive.stop()
+            await settings.stop()
             logger.info("Shutdown: Stopping Bot...")
             await bot.stop()
             logger.info("Shutdown: Closing Database...")
-            await Tortoise.close_connections()
+            await db.close()
             
         # Запуск сервера
         logger.info(f"Starting Web Admin on port {config.app_port}...")
@@ -0,0 +1,251 @@
+"""
+Очередь генерации ответов ИИ
+Обработчик сообщения только ставит задачу; воркеры генерируют ответ, сохраняют и отправляют его.
+Задача чата отменяется, если пришло более новое сообщение или чат забрал менеджер.
+Несколько быстрых сообщений подряд (в пределах окна burst_window) склеиваются в один вопрос.
+При наличии Redis задачи журналируются и подхватываются после перезапуска.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+# Ключ журнала задач в Redis (hash job_id -> JSON)
+REDIS_JOURNAL_KEY = "ai_jobs:pending"
+# Задачи старше этого срока после перезапуска уже неактуальны
+JOURNAL_MAX_AGE = 600.0
+# Сколько сообщений серии склеивать максимум
+MAX_BURST_PARTS = 10
+
+
+@dataclass
+class AIJob:
+    """Задача на ответ ИИ"""
+    chat_id: int
+    user_id: int
+    text: str
+    # Тексты сообщений серии, из которых склеен text
+    parts: List[str] = field(default_factory=list)
+    context_info: dict = field(default_factory=dict)
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.time)
+    generation: int = 0
+
+
+class AIJobQueue:
+    """asyncio-воркеры с отменой устаревших задач по чату"""
+
+    def __init__(self, handler: Callable[[AIJob], Awaitable[None]], workers: int = 4, redis=None,
+                 burst_window: float = 0.0):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.redis = redis
+        self.burst_window = max(0.0, float(burst_window))
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._generation: Dict[int, int] = {}
+        self._running: Dict[int, asyncio.Task] = {}
+        # Неотвеченная серия сообщений чата, последняя задача и ее таймер окна
+        self._bursts: Dict[int, List[str]] = {}
+        self._latest: Dict[int, AIJob] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        # Метрики
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.superseded = 0
+        self.cancelled = 0
+        self.coalesced = 0
+
+    async def start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._restore_journal()
+
+    async def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def is_current(self, job: AIJob) -> bool:
+        """Задача еще актуальна (не вытеснена новым сообщением и не отменена менеджером)"""
+        return self._generation.get(job.chat_id, 0) == job.generation
+
+    def enqueue(self, job: AIJob, journal: bool = True):
+        """Поставить задачу; более ранние задачи этого чата отменяются, а их тексты входят в новую"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        chat_id = job.chat_id
+        burst = self._bursts.setdefault(chat_id, [])
+        if burst:
+            self.coalesced += 1
+        burst.extend(job.parts or [job.text])
+        del burst[:-MAX_BURST_PARTS]
+        job.parts = list(burst)
+        job.text = "\n".join(burst)
+        job.generation = self._bump(chat_id)
+        if chat_id in self._latest:
+            self.superseded += 1
+        running = self._running.get(chat_id)
+        if running and not running.done():
+            running.cancel()
+        self._drop_latest(chat_id)
+        self._latest[chat_id] = job
+        if journal:
+            self._journal_put(job)
+        self.enqueued += 1
+        if self.burst_window > 0:
+            # Ждем окончания серии: каждое новое сообщение переносит срок
+            loop = asyncio.get_running_loop()
+            self._timers[chat_id] = loop.call_later(self.burst_window, self._queue.put_nowait, job)
+        else:
+            self._queue.put_nowait(job)
+
+    def begin_delivery(self, job: AIJob) -> bool:
+        """Ответ начали доставлять: серия считается отвеченной, новое сообщение начнет следующую
+
+        Возвращает False, если задача уже вытеснена и доставлять ответ не нужно.
+        """
+        if not self.is_current(job):
+            return False
+        self._bursts.pop(job.chat_id, None)
+        if self._latest.get(job.chat_id) is job:
+            self._latest.pop(job.chat_id, None)
+        return True
+
+    def cancel_chat(self, chat_id: int):
+        """Отменить ожидающие и выполняющуюся задачи чата (например, менеджер подключился)"""
+        self._bump(chat_id)
+        self._bursts.pop(chat_id, None)
+        self._drop_latest(chat_id)
+        running = self._running.get(chat_id)
+        if running and not running.done():
+            running.cancel()
+            self.cancelled += 1
+
+    def _drop_latest(self, chat_id: int):
+        """Снять таймер и журнал предыдущей задачи чата"""
+        timer = self._timers.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+        prev = self._latest.pop(chat_id, None)
+        if prev:
+            self._journal_done(prev)
+
+    def _bump(self, chat_id: int) -> int:
+        gen = self._generation.get(chat_id, 0) + 1
+        self._generation[chat_id] = gen
+        return gen
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self._queue.get()
+            try:
+                if not self.is_current(job):
+                    continue
+                self._timers.pop(job.chat_id, None)
+                task = asyncio.create_task(self.handler(job))
+                self._running[job.chat_id] = task
+                try:
+                    await task
+                    self.completed += 1
+                    if self.is_current(job):
+                        # Серия отвечена, следующее сообщение начнет новую
+                        self._bursts.pop(job.chat_id, None)
+                        self._latest.pop(job.chat_id, None)
+                except asyncio.CancelledError:
+                    # Отменена только задача чата; сам воркер продолжает работу
+                    if not task.cancelled():
+                        raise
+                except Exception as e:
+                    self.failed += 1
+                    if self.is_current(job):
+                        self._bursts.pop(job.chat_id, None)
+                        self._latest.pop(job.chat_id, None)
+                    logger.error(f"AI job {job.job_id} for chat {job.chat_id} failed: {e}")
+                finally:
+                    if self._running.get(job.chat_id) is task:
+                        self._running.pop(job.chat_id, None)
+            finally:
+                self._journal_done(job)
+                self._queue.task_done()
+
+    def _journal_put(self, job: AIJob):
+        if not self.redis:
+            return
+        try:
+            self.redis.hset(REDIS_JOURNAL_KEY, job.job_id, json.dumps(asdict(job), ensure_ascii=False))
+        except Exception as e:
+            logger.warning(f"AI job journal write failed: {e}")
+
+    def _journal_done(self, job: AIJob):
+        if not self.redis:
+            return
+        try:
+            self.redis.hdel(REDIS_JOURNAL_KEY, job.job_id)
+        except Exception as e:
+            logger.warning(f"AI job journal cleanup failed: {e}")
+
+    def _restore_journal(self):
+        """Поднять задачи, не завершенные до перезапуска"""
+        if not self.redis:
+            return
+        try:
+            raw = self.redis.hgetall(REDIS_JOURNAL_KEY) or {}
+        except Exception as e:
+            logger.warning(f"AI job journal read failed: {e}")
+            return
+        jobs = []
+        for job_id, payload in raw.items():
+            try:
+                data = json.loads(payload)
+                data.pop("generation", None)
+                jobs.append(AIJob(**data))
+            except Exception:
+                pass
+            try:
+                self.redis.hdel(REDIS_JOURNAL_KEY, job_id)
+            except Exception:
+                pass
+        now = time.time()
+        restored = 0
+        # Для каждого чата актуальна только последняя задача
+        latest: Dict[int, AIJob] = {}
+        for job in sorted(jobs, key=lambda j: j.created_at):
+            if now - job.created_at <= JOURNAL_MAX_AGE:
+                latest[job.chat_id] = job
+        for job in latest.values():
+            self.enqueue(job)
+            restored += 1
+        if restored:
+            logger.info(f"Restored {restored} AI jobs from journal")
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": sum(1 for t in self._running.values() if not t.done()),
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "superseded": self.superseded,
+            "cancelled": self.cancelled,
+            "coalesced": self.coalesced,
+            "burst_window": self.burst_window,
+            "durable": bool(self.redis),
+        }
@@ -6,14 +6,13 @@
 import os
 import logging
 import json
-import time
 import asyncpg
 import aiosqlite
 import httpx
 from typing import Optional, Dict, List
 from sqlalchemy import create_engine, text
 from modules.config import Config
-from modules.database import KnowledgeBaseEntry, SystemConfig
+from modules.database import KnowledgeBaseEntry
 
 logger = logging.getLogger(__name__)
 
@@ -57,7 +56,6 @@ class AISupport:
         # Индекс текущего ключа и модели для round-robin
         self.current_key_index = 0
         self.current_model_index = 0
-        self._runtime_settings_ts = 0.0
         self._runtime_settings = {}
         self._runtime_project_name = config.project_name or "DELTA-Support"
         self._runtime_project_description = config.project_description or ""
@@ -67,28 +65,9 @@ class AISupport:
         self._runtime_system_prompt = ""
         self._runtime_db_keywords = None
 
-    async def _refresh_runtime_settings(self):
-        now = time.monotonic()
-        if now - self._runtime_settings_ts < 3.0:
-            return
-        keys = [
-            "project_name",
-            "project_description",
-            "project_website",
-            "project_bot_link",
-            "project_owner_contacts",
-            "ai_system_prompt",
-            "ai_support_enabled",
-            "ai_support_api_type",
-            "ai_support_api_key",
-            "ai_support_api_keys",
-            "groq_models",
-            "ai_db_keywords",
-        ]
-        rows = await SystemConfig.filter(key__in=keys).all()
-        values = {r.key: (r.value or "") for r in rows}
+    def apply_runtime_settings(self, values: Dict[str, str]):
+        """Подписчик SettingsService: применить новый снимок настроек"""
         self._runtime_settings = values
-        self._runtime_settings_ts = now
 
         self._runtime_project_name = (values.get("project_name") or self.config.project_name or "DELTA-Support").strip()
         self._runtime_project_description = (values.get("project_description") or self.config.project_description or "").strip()
@@ -146,7 +125,6 @@ class AISupport:
         Returns:
             Ответ от AI или None в случае ошибки
         """
-        await self._refresh_runtime_settings()
         if not self.enabled:
             return None
         
@@ -169,7 +147,6 @@ class AISupport:
     
     async def _build_service_context(self, context: Optional[Dict] = None) -> str:
         """Построить контекст о сервисе для AI (с приоритетом БД)"""
-        await self._refresh_runtime_settings()
         service_info = []
         
         # Базовая информация о проекте
@@ -235,14 +212,10 @@ class AISupport:
             "service_faq": "faq",
             "service_support_hours": "support_hours",
         }
-        try:
-            rows = await SystemConfig.filter(key__in=list(keys.keys())).all()
-            for r in rows:
-                mapped = keys.get(r.key)
-                if mapped:
-                    info[mapped] = r.value
-        except Exception:
-            return info
+        for key, mapped in keys.items():
+            value = self._runtime_settings.get(key)
+            if value is not None:
+                info[mapped] = value
         return info
 
     async def _get_knowledge_base_text(self) -> str:
@@ -6,9 +6,9 @@ import asyncio
 import json
 import redis
 import html
-import time
+from collections import deque
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.constants import ParseMode
+from telegram.constants import ChatAction, ParseMode
 from telegram.error import BadRequest
 from telegram.ext import (
     Application,
@@ -19,19 +19,32 @@ from telegram.ext import (
     filters
 )
 from loguru import logger
-from typing import Optional
+from typing import Any, Callable, List, Optional, Tuple
 
 from modules.config import Config
-from modules.database import Database, SystemConfig
+from modules.database import Database
 from modules.ai_support import AISupport
+from modules.ai_jobs import AIJob, AIJobQueue
+from modules.media_cache import MediaCache
+from modules.outbound import OutboundRateLimiter
+from modules.settings_service import SettingsService
+from modules.update_processor import KeyedUpdateProcessor
+
+# Сколько уведомлений сотрудникам отправляется одновременно
+STAFF_NOTIFY_CONCURRENCY = 8
+
+# Webhook: путь в приложении FastAPI и сколько последних update_id помнить для отсева повторов
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_DEDUP_SIZE = 10000
 
 
 class SupportBot:
     """Класс бота поддержки"""
     
-    def __init__(self, config: Config, database: Database):
+    def __init__(self, config: Config, database: Database, settings: Optional[SettingsService] = None):
         self.config = config
         self.db = database
+        self.settings = settings or SettingsService(config, database)
         self.ai = AISupport(config)
         self.application = None
         self.redis = None
@@ -53,38 +66,36 @@ class SupportBot:
             "Просто напишите ваш вопрос, и я постараюсь помочь!\n\n"
             "{project_description}"
         )
-        self._runtime_settings_ts = 0.0
+        # Заголовки топиков: последний примененный и отложенные изменения по thread_id
+        self._topic_titles = {}
+        self._topic_pending = {}
+        self._topic_timers = {}
+        # Webhook: секрет для заголовка и недавние update_id для отсева повторов
+        # Без явного секрета он выводится из токена: у всех реплик одинаковый, и set_webhook
+        # одной реплики не ломает проверку заголовка у остальных
+        self.webhook_secret = config.get_webhook_secret()
+        self._seen_update_ids = set()
+        self._seen_update_order = deque()
+        self.media_cache = MediaCache(config.media_cache_dir, config.media_cache_max_mb * 1024 * 1024)
+        self.outbound = OutboundRateLimiter(
+            global_per_second=config.telegram_rate_global,
+            per_chat_per_second=config.telegram_rate_per_chat,
+            per_chat_burst=config.telegram_rate_per_chat_burst,
+            group_per_minute=config.telegram_rate_group_per_minute,
+            max_retries=config.telegram_max_retries,
+        )
+        self.update_processor = KeyedUpdateProcessor(config.telegram_concurrent_updates)
+        self.ai_jobs = AIJobQueue(self._run_ai_job, workers=config.ai_job_workers, burst_window=config.ai_burst_window)
         try:
             from chatgpt_md_converter import telegram_format as _md_to_html
             self._md_to_html = _md_to_html
         except Exception:
             self._md_to_html = lambda t: html.escape(t or "")
+        self.settings.subscribe(self.apply_runtime_settings)
+        self.settings.subscribe(self.ai.apply_runtime_settings)
 
-    async def refresh_runtime_settings(self, force: bool = False):
-        now = time.monotonic()
-        if not force and now - self._runtime_settings_ts < 3.0:
-            return
-        keys = [
-            "telegram_group_mode",
-            "telegram_support_group_id",
-            "telegram_topic_title_template",
-            "telegram_emoji_default",
-            "telegram_emoji_client",
-            "telegram_emoji_manager",
-            "telegram_emoji_ai",
-            "telegram_status_emoji_active",
-            "telegram_status_emoji_waiting_manager",
-            "telegram_status_emoji_closed",
-            "project_name",
-            "project_description",
-            "project_website",
-            "project_bot_link",
-            "project_owner_contacts",
-            "bot_welcome_message",
-        ]
-        rows = await SystemConfig.filter(key__in=keys).all()
-        values = {r.key: (r.value or "") for r in rows}
-
+    def apply_runtime_settings(self, values: dict):
+        """Подписчик SettingsService: применить новый снимок настроек"""
         if "telegram_group_mode" in values:
             self._group_mode_enabled = str(values.get("telegram_group_mode") or "").lower() in ["1", "true", "yes", "y", "on"]
         else:
@@ -125,11 +136,22 @@ class SupportBot:
         if not self._group_mode_enabled:
             self._group_id = None
 
-        self._runtime_settings_ts = now
+        keep_forever = (values.get("media_keep_forever") or "").lower() in ["1", "true", "yes", "y", "on"]
+        days_raw = (values.get("media_retention_days") or "").strip()
+        self.media_cache.retention_days = None if keep_forever or not days_raw.isdigit() else (int(days_raw) or None)
     
     async def initialize(self):
         """Инициализация бота"""
-        self.application = Application.builder().token(self.config.telegram_bot_token).build()
+        api_base = (self.config.telegram_api_base_url or "https://api.telegram.org").rstrip("/")
+        self.application = (
+            Application.builder()
+            .token(self.config.telegram_bot_token)
+            .base_url(f"{api_base}/bot")
+            .base_file_url(f"{api_base}/file/bot")
+            .rate_limiter(self.outbound)
+            .concurrent_updates(self.update_processor)
+            .build()
+        )
         try:
             self.redis = redis.Redis(
                 host=self.config.redis_host,
@@ -140,6 +162,8 @@ class SupportBot:
             )
             self.redis.ping()
             logger.info("Redis connected")
+            if self.config.ai_jobs_durable:
+                self.ai_jobs.redis = self.redis
         except Exception as e:
             logger.warning(f"Redis connection failed: {e}")
         if self.config.telegram_group_mode and self.config.telegram_support_group_id:
@@ -165,17 +189,57 @@ class SupportBot:
         
         logger.info("Bot handlers registered")
     
+    @property
+    def webhook_enabled(self) -> bool:
+        return bool(self.config.telegram_webhook_url)
+
+    async def start_receiving(self):
+        """Запуск получения обновлений: webhook или поллинг"""
+        if not self.webhook_enabled:
+            await self.start_polling()
+            return
+        logger.info("Bot starting in webhook mode...")
+        await self.application.initialize()
+        await self.application.start()
+        await self.ai_jobs.start()
+        url = self.config.telegram_webhook_url.rstrip("/") + WEBHOOK_PATH
+        await self.application.bot.set_webhook(
+            url=url,
+            secret_token=self.webhook_secret,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=self.config.telegram_drop_pending_updates,
+        )
+        logger.info(f"Webhook set: {url}")
+
     async def start_polling(self):
         """Запуск поллинга без блокировки"""
         logger.info("Bot starting polling...")
         await self.application.initialize()
         await self.application.start()
-        await self.application.updater.start_polling(drop_pending_updates=True)
+        await self.ai_jobs.start()
+        await self.application.updater.start_polling(drop_pending_updates=self.config.telegram_drop_pending_updates)
+
+    async def feed_webhook_update(self, data: dict) -> bool:
+        """Поставить обновление из webhook в очередь (False — дубликат)"""
+        update_id = data.get("update_id")
+        if update_id is not None:
+            if update_id in self._seen_update_ids:
+                return False
+            self._seen_update_ids.add(update_id)
+            self._seen_update_order.append(update_id)
+            if len(self._seen_update_order) > WEBHOOK_DEDUP_SIZE:
+                self._seen_update_ids.discard(self._seen_update_order.popleft())
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+        return True
     
     async def stop(self):
         """Остановка бота"""
         logger.info("Stopping bot...")
-        if self.application.updater:
+        for task in list(self._topic_timers.values()):
+            task.cancel()
+        await self.ai_jobs.stop()
+        if self.application.updater and self.application.updater.running:
             await self.application.updater.stop()
         if self.application:
             await self.application.stop()
@@ -231,7 +295,6 @@ class SupportBot:
             )
             logger.info(f"Created new chat for user {user_id}")
 
-        await self.refresh_runtime_settings()
 
         class _SafeDict(dict):
             def __missing__(self, key):
@@ -554,7 +617,7 @@ class SupportBot:
                             "chat_id": chat_id,
                             "message": {
                                 "id": sysmsg.id,
-                                "text": getattr(sysmsg, "text", None) or sysmsg.content,
+                                "text": sysmsg.display_text,
                                 "source": getattr(sysmsg, "source", None) or sysmsg.message_type,
                                 "created_at": sysmsg.created_at.isoformat() if sysmsg.created_at else None,
                                 "media_type": getattr(sysmsg, "media_type", None),
@@ -602,7 +665,7 @@ class SupportBot:
                             "chat_id": chat_id,
                             "message": {
                                 "id": sysmsg.id,
-                                "text": getattr(sysmsg, "text", None) or sysmsg.content,
+                                "text": sysmsg.display_text,
                                 "source": getattr(sysmsg, "source", None) or sysmsg.message_type,
                                 "created_at": sysmsg.created_at.isoformat() if sysmsg.created_at else None,
                                 "media_type": getattr(sysmsg, "media_type", None),
@@ -724,7 +787,7 @@ class SupportBot:
                 "manager": "👨‍💼"
             }.get(msg.message_type, "❓")
             
-            message_text += f"{role_emoji} {msg.content[:100]}\n\n"
+            message_text += f"{role_emoji} {msg.display_text[:100]}\n\n"
         
         # Кнопки управления чатом (всегда внизу)
         keyboard_buttons = []
@@ -779,6 +842,7 @@ class SupportBot:
             return
         
         await self.db.update_chat_status(chat_id, "waiting_manager", manager_id)
+        self.ai_jobs.cancel_chat(chat_id)
         try:
             chat.status = "waiting_manager"
             chat.manager_id = manager_id
@@ -801,7 +865,7 @@ class SupportBot:
                             "chat_id": chat_id,
                             "message": {
                                 "id": sysmsg.id,
-                                "text": getattr(sysmsg, "text", None) or sysmsg.content,
+                                "text": sysmsg.display_text,
                                 "source": getattr(sysmsg, "source", None) or sysmsg.message_type,
                                 "created_at": sysmsg.created_at.isoformat() if sysmsg.created_at else None,
                                 "media_type": getattr(sysmsg, "media_type", None),
@@ -906,7 +970,7 @@ class SupportBot:
         chat_history = [
             {
                 "role": "user" if msg.message_type == "user" else "assistant",
-                "message": msg.content
+                "message": msg.display_text
             }
             for msg in chat_messages
         ]
@@ -959,6 +1023,7 @@ class SupportBot:
         # Обновляем статус чата
         try:
             await self.db.update_chat_status(chat_id, "waiting_manager")
+            self.ai_jobs.cancel_chat(chat_id)
             try:
                 chat.status = "waiting_manager"
             except Exception:
@@ -974,11 +1039,11 @@ class SupportBot:
         summary = None
         try:
             messages = await self.db.get_chat_messages(chat_id, limit=10)
-            last_user = next((m.content for m in reversed(messages) if m.message_type == "user"), None)
+            last_user = next((m.display_text for m in reversed(messages) if m.message_type == "user"), None)
             if last_user and self.config.ai_support_enabled:
                 prompt = f"Кратко, одной фразой опиши, чего хочет пользователь: {last_user}"
                 ctx = {"user_id": chat.user_id, "username": chat.username, "first_name": chat.first_name, "last_name": chat.last_name}
-                hist = [{"role":"user" if m.message_type=="user" else "assistant","message":m.content} for m in messages]
+                hist = [{"role":"user" if m.message_type=="user" else "assistant","message":m.display_text} for m in messages]
                 summary = await self.ai.get_ai_answer(prompt, ctx, hist)
         except Exception as e:
             logger.warning(f"Failed to build AI summary: {e}")
@@ -1003,7 +1068,7 @@ class SupportBot:
                             "chat_id": chat_id,
                             "message": {
                                 "id": sysmsg.id,
-                                "text": getattr(sysmsg, "text", None) or sysmsg.content,
+                                "text": sysmsg.display_text,
                                 "source": getattr(sysmsg, "source", None) or "system",
                                 "created_at": sysmsg.created_at.isoformat() if sysmsg.created_at else None,
                                 "media_type": getattr(sysmsg, "media_type", None),
@@ -1019,13 +1084,16 @@ class SupportBot:
                 thread_id = await self._ensure_group_topic(chat)
                 if thread_id:
                     name = self._format_topic_title(chat, "client")
+                    # Отложенное изменение заголовка устарело — применяем текущее сразу
+                    self._topic_pending.pop(int(thread_id), None)
                     try:
-                        await self.application.bot.edit_forum_topic(chat_id=self._group_id, message_thread_id=thread_id, name=name)
+                        if self._topic_titles.get(int(thread_id)) != name:
+                            await self.application.bot.edit_forum_topic(chat_id=self._group_id, message_thread_id=thread_id, name=name)
+                            self._remember_topic_title(thread_id, name)
                     except Exception as e:
                         if any(s in str(e).lower() for s in ["topic_deleted", "thread not found", "invalid thread"]):
+                            # Новый топик создается сразу с нужным заголовком
                             thread_id = await self._recreate_group_topic(chat, "client")
-                            if thread_id:
-                                await self.application.bot.edit_forum_topic(chat_id=self._group_id, message_thread_id=thread_id, name=name)
                         else:
                             raise
                     base = f"🟡 Пользователь запросил подключение менеджера\nПользователь: @{chat.username or 'N/A'}\nID: {chat.user_id}\nЧат: #{chat.id}"
@@ -1047,48 +1115,54 @@ class SupportBot:
                 pass
             return
         
-        notification_sent = False
-        for staff_id in staff_ids:
-            try:
-                # Создаем уведомление
-                await self.db.create_manager_notification(chat_id, staff_id)
-                
-                # Отправляем уведомление
-                keyboard = [
-                    [InlineKeyboardButton("Просмотреть чат", callback_data=f"view_chat_{chat_id}")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                user_info = f"@{chat.username}" if chat.username else f"ID: {chat.user_id}"
-                notification_text = (
-                    f"🔔 Новый запрос на поддержку!\n\n"
-                    f"Чат #{chat_id}\n"
-                    f"Пользователь: {user_info}\n"
-                    f"Имя: {chat.first_name or 'N/A'}"
-                )
-                
-                await self.application.bot.send_message(
-                    chat_id=staff_id,
-                    text=notification_text,
-                    reply_markup=reply_markup
-                )
-                notification_sent = True
-                logger.info(f"Notification sent to staff {staff_id} for chat {chat_id}")
-            except Exception as e:
-                logger.error(f"Error sending notification to staff {staff_id}: {e}")
-        
-        # Уведомляем пользователя
+        # Клиент получает подтверждение сразу, рассылка сотрудникам идет следом
         try:
-            if notification_sent:
-                await query.edit_message_text(
-                    "✅ Запрос на подключение менеджера отправлен. Ожидайте, менеджер скоро подключится к чату."
-                )
-            else:
+            await query.edit_message_text(
+                "✅ Запрос на подключение менеджера отправлен. Ожидайте, менеджер скоро подключится к чату."
+            )
+        except Exception as e:
+            logger.error(f"Error editing message: {e}")
+
+        try:
+            await self.db.create_manager_notifications(chat_id, staff_ids)
+        except Exception as e:
+            logger.error(f"Error creating manager notifications for chat {chat_id}: {e}")
+
+        keyboard = [
+            [InlineKeyboardButton("Просмотреть чат", callback_data=f"view_chat_{chat_id}")]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        user_info = f"@{chat.username}" if chat.username else f"ID: {chat.user_id}"
+        notification_text = (
+            f"🔔 Новый запрос на поддержку!\n\n"
+            f"Чат #{chat_id}\n"
+            f"Пользователь: {user_info}\n"
+            f"Имя: {chat.first_name or 'N/A'}"
+        )
+        semaphore = asyncio.Semaphore(STAFF_NOTIFY_CONCURRENCY)
+
+        async def notify(staff_id: int) -> bool:
+            async with semaphore:
+                try:
+                    await self.application.bot.send_message(
+                        chat_id=staff_id,
+                        text=notification_text,
+                        reply_markup=reply_markup
+                    )
+                    logger.info(f"Notification sent to staff {staff_id} for chat {chat_id}")
+                    return True
+                except Exception as e:
+                    logger.error(f"Error sending notification to staff {staff_id}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(notify(staff_id) for staff_id in staff_ids))
+        if not any(results):
+            try:
                 await query.edit_message_text(
                     "⚠️ Запрос отправлен, но не удалось уведомить менеджеров. Попробуйте позже."
                 )
-        except Exception as e:
-            logger.error(f"Error editing message: {e}")
+            except Exception as e:
+                logger.error(f"Error editing message: {e}")
     
     async def show_user_faq(self, query):
         """Показать FAQ для пользователя"""
@@ -1235,27 +1309,17 @@ class SupportBot:
             return None
 
     async def _save_message_to_db(self, chat_id: int, user_id: int, info: dict, role: str):
-        text = info.get("text") or ""
+        # Метку типа медиа не храним: ее добавляет Message.display_text
+        content = (info.get("text") or "").strip()
         kind = info.get("kind") or "text"
-        prefix = {
-            "text": "",
-            "photo": "[photo] ",
-            "video": "[video] ",
-            "audio": "[audio] ",
-            "voice": "[voice] ",
-            "document": "[document] ",
-            "video_note": "[video_note] ",
-        }.get(kind, "")
-        content = f"{prefix}{text}".strip()
-        msg = await self.db.add_message(chat_id, user_id, content, role)
         file_id = info.get("file_id")
-        tg_message_id = info.get("message_id")
-        if file_id or kind != "text":
-            try:
-                from modules.database import Message as MessageModel
-                await MessageModel.filter(id=msg.id).update(media_type=kind, media_file_id=file_id, tg_message_id_user=tg_message_id)
-            except Exception:
-                pass
+        is_media = bool(file_id) or kind != "text"
+        msg = await self.db.add_message(
+            chat_id, user_id, content, role,
+            media_type=kind if is_media else None,
+            media_file_id=file_id if is_media else None,
+            tg_message_id_user=info.get("message_id") if is_media else None,
+        )
         if self.ws_manager:
             try:
                 await self.ws_manager.broadcast(
@@ -1264,7 +1328,7 @@ class SupportBot:
                         "chat_id": chat_id,
                         "message": {
                             "id": msg.id,
-                            "text": getattr(msg, "text", None) or msg.content,
+                            "text": msg.display_text,
                             "source": getattr(msg, "source", None) or msg.message_type,
                             "created_at": msg.created_at.isoformat() if msg.created_at else None,
                             "media_type": kind if kind != "text" else None,
@@ -1301,6 +1365,57 @@ class SupportBot:
         else:
             await self.application.bot.send_message(chat_id=client_chat_id, text=self._md_to_html(text or "Сообщение"), reply_to_message_id=header.message_id, parse_mode=ParseMode.HTML)
 
+    # media_type -> (метод Bot, имя аргумента с файлом)
+    _MEDIA_SENDERS = {
+        "photo": ("send_photo", "photo"),
+        "video": ("send_video", "video"),
+        "audio": ("send_audio", "audio"),
+        "voice": ("send_voice", "voice"),
+        "document": ("send_document", "document"),
+    }
+
+    async def _send_media(self, media_type: str, media, **kwargs):
+        method, arg = self._MEDIA_SENDERS.get(media_type, self._MEDIA_SENDERS["document"])
+        return await getattr(self.application.bot, method)(**{arg: media}, **kwargs)
+
+    def _sent_file_id(self, sent, media_type: str) -> Optional[str]:
+        if sent is None:
+            return None
+        if media_type == "photo":
+            return sent.photo[-1].file_id if sent.photo else None
+        attr = media_type if media_type in self._MEDIA_SENDERS else "document"
+        return getattr(getattr(sent, attr, None), "file_id", None)
+
+    async def send_media_once(self, media_type: str, make_input: Callable[[], Any], destinations: List[dict],
+                              caption: Optional[str] = None) -> Tuple[str, Optional[str], list]:
+        """Загрузить файл один раз (в первого получателя), остальным отправить по file_id
+
+        destinations — kwargs для send_* (chat_id, message_thread_id, reply_to_message_id, ...);
+        make_input() возвращает свежий InputFile (нужен повторно, если аудио/голос уходят документом).
+        Возвращает (фактический media_type, file_id, отправленные сообщения; None — не доставлено).
+        """
+        first, rest = destinations[0], destinations[1:]
+        try:
+            sent_first = await self._send_media(media_type, make_input(), caption=caption, **first)
+        except Exception:
+            if media_type not in ["audio", "voice"]:
+                raise
+            # Telegram не принял файл как аудио/голос — отправляем документом
+            media_type = "document"
+            sent_first = await self._send_media(media_type, make_input(), caption=caption, **first)
+        file_id = self._sent_file_id(sent_first, media_type)
+        sent = [sent_first]
+        for dest in rest:
+            if not file_id:
+                sent.append(None)
+                continue
+            try:
+                sent.append(await self._send_media(media_type, file_id, caption=caption, **dest))
+            except Exception as e:
+                logger.warning(f"Failed to resend {media_type} to {dest.get('chat_id')}: {e}")
+                sent.append(None)
+        return media_type, file_id, sent
+
     def _status_emoji(self, status: str, role_hint: Optional[str] = None) -> str:
         if role_hint and role_hint in self._emoji_by_role:
             return self._emoji_by_role.get(role_hint) or self._emoji_by_role.get("default") or "🟢"
@@ -1338,7 +1453,6 @@ class SupportBot:
             return f"{emoji} {data['first_name']} ({data['user_id']}) {data['status_label']}".strip()
 
     async def _ensure_group_topic(self, chat) -> Optional[int]:
-        await self.refresh_runtime_settings()
         if not self._group_id:
             return None
         thread_key = f"group_topic:chat:{chat.id}"
@@ -1355,6 +1469,8 @@ class SupportBot:
         except Exception as e:
             logger.error(f"Failed to create forum topic: {e}")
             thread_id = None
+        if thread_id:
+            self._remember_topic_title(thread_id, name)
         if thread_id and self.redis:
             self.redis.set(f"group_topic:chat:{chat.id}", str(thread_id))
             self.redis.set(f"group_topic:thread:{thread_id}", str(chat.id))
@@ -1367,7 +1483,6 @@ class SupportBot:
         return thread_id
     
     async def _recreate_group_topic(self, chat, role_hint: Optional[str] = None) -> Optional[int]:
-        await self.refresh_runtime_settings()
         name = self._format_topic_title(chat, role_hint)
         try:
             topic = await self.application.bot.create_forum_topic(chat_id=self._group_id, name=name)
@@ -1375,6 +1490,8 @@ class SupportBot:
         except Exception as e:
             logger.error(f"Failed to recreate forum topic: {e}")
             return None
+        if thread_id:
+            self._remember_topic_title(thread_id, name)
         if self.redis and thread_id:
             self.redis.set(f"group_topic:chat:{chat.id}", str(thread_id))
             self.redis.set(f"group_topic:thread:{thread_id}", str(chat.id))
@@ -1388,24 +1505,58 @@ class SupportBot:
         return thread_id
 
     async def _edit_group_topic_status(self, chat, role_hint: Optional[str] = None):
-        await self.refresh_runtime_settings()
+        """Запланировать обновление заголовка топика (не чаще одного раза за окно)"""
         if not self._group_id or not self.redis:
             return
         thread_id = self.redis.get(f"group_topic:chat:{chat.id}")
         if not thread_id:
             return
+        thread_id = int(thread_id)
+        name = self._format_topic_title(chat, role_hint)
+        if thread_id not in self._topic_pending and self._topic_titles.get(thread_id) == name:
+            return
+        # Последнее состояние побеждает: за окно уходит одно изменение
+        self._topic_pending[thread_id] = (chat, role_hint)
+        if self.config.telegram_topic_title_debounce <= 0:
+            await self._apply_topic_title(thread_id)
+            return
+        task = self._topic_timers.get(thread_id)
+        if task is None or task.done():
+            self._topic_timers[thread_id] = asyncio.create_task(self._debounced_topic_title(thread_id))
+
+    async def _debounced_topic_title(self, thread_id: int):
         try:
-            name = self._format_topic_title(chat, role_hint)
-            await self.application.bot.edit_forum_topic(chat_id=self._group_id, message_thread_id=int(thread_id), name=name)
+            await asyncio.sleep(self.config.telegram_topic_title_debounce)
+            await self._apply_topic_title(thread_id)
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            if any(s in str(e).lower() for s in ["topic_deleted", "thread not found", "invalid thread"]):
-                new_thread = await self._recreate_group_topic(chat, role_hint)
-                if new_thread:
-                    try:
-                        name = self._format_topic_title(chat, role_hint)
-                        await self.application.bot.edit_forum_topic(chat_id=self._group_id, message_thread_id=int(new_thread), name=name)
-                    except Exception as e2:
-                        logger.warning(f"Failed to edit recreated forum topic: {e2}")
+            logger.warning(f"Failed to apply topic title: {e}")
+        finally:
+            self._topic_timers.pop(thread_id, None)
+
+    def _remember_topic_title(self, thread_id: int, name: str):
+        if len(self._topic_titles) > 10000:
+            self._topic_titles.clear()
+        self._topic_titles[int(thread_id)] = name
+
+    async def _apply_topic_title(self, thread_id: int):
+        pending = self._topic_pending.pop(thread_id, None)
+        if not pending:
+            return
+        chat, role_hint = pending
+        name = self._format_topic_title(chat, role_hint)
+        if self._topic_titles.get(thread_id) == name:
+            return
+        try:
+            await self.application.bot.edit_forum_topic(chat_id=self._group_id, message_thread_id=thread_id, name=name)
+            self._remember_topic_title(thread_id, name)
+        except Exception as e:
+            if "not_modified" in str(e).lower() or "not modified" in str(e).lower():
+                self._remember_topic_title(thread_id, name)
+            elif any(s in str(e).lower() for s in ["topic_deleted", "thread not found", "invalid thread"]):
+                # Новый топик создается сразу с актуальным заголовком
+                await self._recreate_group_topic(chat, role_hint)
             else:
                 logger.warning(f"Failed to edit forum topic: {e}")
 
@@ -1512,6 +1663,59 @@ class SupportBot:
             pass
         return True
 
+    async def _keep_typing(self, user_id: int, interval: float = 4.5):
+        """Поддерживать индикатор "печатает..." пока идет генерация"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.application.bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
+            except Exception:
+                pass
+
+    async def _run_ai_job(self, job: AIJob):
+        """Задача очереди ИИ: генерация, сохранение, отправка клиенту и дубль в группу"""
+        typing = asyncio.create_task(self._keep_typing(job.user_id))
+        try:
+            chat_messages = await self.db.get_chat_messages(job.chat_id, limit=20)
+            # Сообщения серии уже сохранены и передаются отдельно одним вопросом
+            parts = list(job.parts or [job.text])
+            while chat_messages and parts and chat_messages[-1].message_type == "user" and chat_messages[-1].content == parts[-1]:
+                chat_messages.pop()
+                parts.pop()
+            chat_history = [{"role": "user" if msg.message_type == "user" else "assistant", "message": msg.display_text} for msg in chat_messages]
+            ai_response = await self.ai.get_ai_answer(job.text, job.context_info, chat_history)
+        finally:
+            typing.cancel()
+        chat = await self.db.get_chat_by_id(job.chat_id)
+        # Пока шла генерация, клиент мог написать еще или чат забрал менеджер
+        if not chat or chat.status == "waiting_manager" or not self.ai_jobs.begin_delivery(job):
+            return
+        # Доставку не прерываем на середине: сохраненный ответ должен дойти до клиента.
+        # Серия уже снята с очереди, поэтому сообщение во время доставки начнет новую, а не повторит вопросы
+        await asyncio.shield(self._deliver_ai_answer(chat, job, ai_response))
+
+    async def _deliver_ai_answer(self, chat, job: AIJob, ai_response: Optional[str]):
+        if not ai_response:
+            keyboard = [[InlineKeyboardButton("Пригласить менеджера", callback_data=f"request_manager_{chat.id}")]]
+            await self.application.bot.send_message(chat_id=job.user_id, text="Извините, я не смог обработать ваш вопрос. Хотите пригласить менеджера в чат?", reply_markup=InlineKeyboardMarkup(keyboard))
+            return
+        await self._save_message_to_db(chat.id, job.user_id, {"kind": "text", "text": ai_response}, "ai")
+        reply_markup = None
+        if any(keyword in ai_response.lower() for keyword in ["менеджер", "пригласить", "подключить"]):
+            keyboard = [[InlineKeyboardButton("Да, пригласите менеджера", callback_data=f"request_manager_{chat.id}")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+        await self.application.bot.send_message(chat_id=job.user_id, text=self._md_to_html(ai_response), reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        if self._group_id:
+            try:
+                thread_id = await self._ensure_group_topic(chat)
+                if thread_id:
+                    mute = chat.status != "waiting_manager"
+                    header = await self.application.bot.send_message(chat_id=self._group_id, text="🤖 Ответ ИИ", message_thread_id=thread_id, disable_notification=mute)
+                    await self.application.bot.send_message(chat_id=self._group_id, text=self._md_to_html(ai_response), message_thread_id=thread_id, reply_to_message_id=header.message_id, disable_notification=mute, parse_mode=ParseMode.HTML)
+                    await self._edit_group_topic_status(chat, role_hint="ai")
+            except Exception as e:
+                logger.error(f"Failed to duplicate AI response to group: {e}")
+
     async def handle_any_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         user_id = user.id
@@ -1623,32 +1827,13 @@ class SupportBot:
             except Exception as e:
                 logger.error(f"Failed to duplicate client message to group: {e}")
         if info["kind"] == "text":
-            chat_messages = await self.db.get_chat_messages(chat.id, limit=20)
-            chat_history = [{"role": "user" if msg.message_type == "user" else "assistant", "message": msg.content} for msg in chat_messages]
+            # Ответ ИИ готовится воркером очереди, обработчик сразу освобождается
+            try:
+                await self.application.bot.send_chat_action(chat_id=user_id, action=ChatAction.TYPING)
+            except Exception:
+                pass
             context_info = {"user_id": user_id, "username": user.username, "first_name": user.first_name, "last_name": user.last_name}
-            ai_response = await self.ai.get_ai_answer(info["text"], context_info, chat_history)
-            if ai_response:
-                await self._save_message_to_db(chat.id, user_id, {"kind": "text", "text": ai_response}, "ai")
-                if any(keyword in ai_response.lower() for keyword in ["менеджер", "пригласить", "подключить"]):
-                    keyboard = [[InlineKeyboardButton("Да, пригласите менеджера", callback_data=f"request_manager_{chat.id}")]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(self._md_to_html(ai_response), reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-                else:
-                    await update.message.reply_text(self._md_to_html(ai_response), parse_mode=ParseMode.HTML)
-                if self._group_id:
-                    try:
-                        thread_id = await self._ensure_group_topic(chat)
-                        if thread_id:
-                            mute = chat.status != "waiting_manager"
-                            header = await self.application.bot.send_message(chat_id=self._group_id, text="🤖 Ответ ИИ", message_thread_id=thread_id, disable_notification=mute)
-                            await self.application.bot.send_message(chat_id=self._group_id, text=self._md_to_html(ai_response), message_thread_id=thread_id, reply_to_message_id=header.message_id, disable_notification=mute, parse_mode=ParseMode.HTML)
-                            await self._edit_group_topic_status(chat, role_hint="ai")
-                    except Exception as e:
-                        logger.error(f"Failed to duplicate AI response to group: {e}")
-            else:
-                keyboard = [[InlineKeyboardButton("Пригласить менеджера", callback_data=f"request_manager_{chat.id}")]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text("Извините, я не смог обработать ваш вопрос. Хотите пригласить менеджера в чат?", reply_markup=reply_markup)
+            self.ai_jobs.enqueue(AIJob(chat_id=chat.id, user_id=user_id, text=info["text"], context_info=context_info))
         else:
             keyboard = [[InlineKeyboardButton("Пригласить менеджера", callback_data=f"request_manager_{chat.id}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -2,12 +2,19 @@
 Модуль конфигурации приложения
 """
 
+import hashlib
+import hmac
 import os
 from typing import List, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, field_validator
 
 
+def derive_webhook_secret(bot_token: str) -> str:
+    """Секрет webhook из токена бота: одинаковый на всех репликах (HMAC-SHA256, hex подходит Telegram)"""
+    return hmac.new(bot_token.encode(), b"telegram-webhook-secret", hashlib.sha256).hexdigest()
+
+
 class Config(BaseSettings):
     """Класс конфигурации приложения"""
 
@@ -49,6 +56,11 @@ class Config(BaseSettings):
         default="llama-3.1-8b-instant,qwen/qwen3-32b,moonshotai/kimi-k2-instruct,meta-llama/llama-4-scout-17b-16e-instruct,llama-3.3-70b-versatile,openai/gpt-oss-120b,openai/gpt-oss-20b",
         alias="GROQ_MODELS"
     )
+    # Очередь ответов ИИ: число воркеров и журнал задач в Redis (переживает перезапуск)
+    ai_job_workers: int = Field(default=4, alias="AI_JOB_WORKERS")
+    ai_jobs_durable: bool = Field(default=True, alias="AI_JOBS_DURABLE")
+    # Окно (сек), в котором подряд идущие сообщения клиента склеиваются в один вопрос к ИИ (0 — без склейки)
+    ai_burst_window: float = Field(default=2.0, alias="AI_BURST_WINDOW")
     
     # Database
     database_url: str = Field(
@@ -58,6 +70,24 @@ class Config(BaseSettings):
     postgres_user: str = Field(default="delta_support", alias="POSTGRES_USER")
     postgres_password: str = Field(default="delta_support_password", alias="POSTGRES_PASSWORD")
     postgres_db: str = Field(default="delta_support", alias="POSTGRES_DB")
+    # PostgreSQL (asyncpg): пул подключений, кэш подготовленных выражений, таймаут запроса (сек, 0 — без)
+    db_pool_min: int = Field(default=2, alias="DB_POOL_MIN")
+    db_pool_max: int = Field(default=20, alias="DB_POOL_MAX")
+    db_statement_cache_size: int = Field(default=512, alias="DB_STATEMENT_CACHE_SIZE")
+    db_command_timeout: float = Field(default=30.0, alias="DB_COMMAND_TIMEOUT")
+    # Реплика только для чтения: на нее уходят тяжелые чтения админки (список чатов, поиск, дашборд)
+    database_replica_url: str = Field(default="", alias="DATABASE_REPLICA_URL")
+    # Групповая запись сообщений: пачка коммитится раз в DB_WRITE_BUFFER_DELAY_MS (для пиков нагрузки)
+    db_write_buffer: bool = Field(default=False, alias="DB_WRITE_BUFFER")
+    db_write_buffer_delay_ms: float = Field(default=5.0, alias="DB_WRITE_BUFFER_DELAY_MS")
+    db_write_buffer_max_batch: int = Field(default=256, alias="DB_WRITE_BUFFER_MAX_BATCH")
+    # SQLite: профиль PRAGMA (WAL, synchronous=NORMAL, mmap, кэш) и период optimize/checkpoint (сек, 0 — выкл.)
+    sqlite_tuning: bool = Field(default=True, alias="SQLITE_TUNING")
+    sqlite_maintenance_interval: float = Field(default=600.0, alias="SQLITE_MAINTENANCE_INTERVAL")
+    # Архив: сообщения чатов, закрытых больше N дней назад, переносятся в messages_archive (0 — выкл.)
+    message_archive_days: int = Field(default=0, alias="MESSAGE_ARCHIVE_DAYS")
+    message_archive_interval: float = Field(default=3600.0, alias="MESSAGE_ARCHIVE_INTERVAL")
+    message_archive_batch_size: int = Field(default=500, alias="MESSAGE_ARCHIVE_BATCH_SIZE")
     
     # Telegram Bot
     telegram_bot_token: str = Field(default="", alias="TELEGRAM_BOT_TOKEN")
@@ -65,6 +95,23 @@ class Config(BaseSettings):
     telegram_manager_ids: str = Field(default="", alias="TELEGRAM_MANAGER_IDS")
     telegram_group_mode: bool = Field(default=False, alias="TELEGRAM_GROUP_MODE")
     telegram_support_group_id: Optional[int] = Field(default=None, alias="TELEGRAM_SUPPORT_GROUP_ID")
+    # Получение обновлений: webhook (если задан публичный URL) или long polling
+    telegram_webhook_url: str = Field(default="", alias="TELEGRAM_WEBHOOK_URL")  # https://support.example.com
+    telegram_webhook_secret: str = Field(default="", alias="TELEGRAM_WEBHOOK_SECRET")
+    telegram_drop_pending_updates: bool = Field(default=False, alias="TELEGRAM_DROP_PENDING_UPDATES")
+    # Адрес Bot API (для локального сервера или заглушки scripts/fake_bot_api.py)
+    telegram_api_base_url: str = Field(default="https://api.telegram.org", alias="TELEGRAM_API_BASE_URL")
+    # Лимиты исходящих запросов (Telegram: ~30 сообщений/с всего, 1/с в чат, 20/мин в группу)
+    telegram_rate_global: float = Field(default=30.0, alias="TELEGRAM_RATE_GLOBAL")
+    telegram_rate_per_chat: float = Field(default=1.0, alias="TELEGRAM_RATE_PER_CHAT")
+    # Сколько сообщений подряд можно отправить в личный чат без ожидания (затем — TELEGRAM_RATE_PER_CHAT)
+    telegram_rate_per_chat_burst: float = Field(default=3.0, alias="TELEGRAM_RATE_PER_CHAT_BURST")
+    telegram_rate_group_per_minute: float = Field(default=20.0, alias="TELEGRAM_RATE_GROUP_PER_MINUTE")
+    telegram_max_retries: int = Field(default=3, alias="TELEGRAM_MAX_RETRIES")
+    # Сколько обновлений обрабатывается параллельно (в пределах одного чата — всегда по очереди)
+    telegram_concurrent_updates: int = Field(default=16, alias="TELEGRAM_CONCURRENT_UPDATES")
+    # Окно (сек), за которое изменения заголовка топика схлопываются в одно (0 — без задержки)
+    telegram_topic_title_debounce: float = Field(default=3.0, alias="TELEGRAM_TOPIC_TITLE_DEBOUNCE")
     
     # Project Databases
     project_db_1: Optional[str] = Field(default=None, alias="PROJECT_DB_1")
@@ -81,6 +128,10 @@ class Config(BaseSettings):
     debug: bool = Field(default=False, alias="DEBUG")
     log_level: str = Field(default="INFO", alias="LOG_LEVEL")
     
+    # Media cache (скачанные из Telegram файлы для админ-панели)
+    media_cache_dir: str = Field(default="data/media_cache", alias="MEDIA_CACHE_DIR")
+    media_cache_max_mb: int = Field(default=1024, alias="MEDIA_CACHE_MAX_MB")
+    
     # JWT
     jwt_secret_key: str = Field(default="", alias="JWT_SECRET_KEY")
     
@@ -109,6 +160,10 @@ class Config(BaseSettings):
         """Получить список всех сотрудников (админы + менеджеры)"""
         return list(set(self.get_admin_ids() + self.get_manager_ids()))
     
+    def get_webhook_secret(self) -> str:
+        """Секрет заголовка X-Telegram-Bot-Api-Secret-Token (без TELEGRAM_WEBHOOK_SECRET — из токена бота)"""
+        return self.telegram_webhook_secret or derive_webhook_secret(self.telegram_bot_token)
+    
     def get_project_databases(self) -> List[str]:
         """Получить список баз данных проектов"""
         dbs = []
@@ -3,15 +3,70 @@
 Поддерживает PostgreSQL и SQLite
 """
 
+import asyncio
 import logging
-from typing import Optional, List
-from tortoise import Tortoise, fields
+from typing import Dict, Optional, List, Tuple
+from urllib.parse import parse_qsl, urlencode
+from tortoise import Tortoise, fields, timezone
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.utils import generate_schema_for_client
 from tortoise.models import Model
-from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+from tortoise.expressions import Q, F, RawSQL
+from tortoise.filters import escape_like
+from pypika_tortoise import Query
+from pypika_tortoise.enums import Comparator, Matching
+from pypika_tortoise.terms import BasicCriterion, Bracket, Field as SqlField, Term, ValueWrapper
 from modules.config import Config
 
 logger = logging.getLogger(__name__)
 
+# Выражение, по которому строится trigram-индекс поиска чатов в PostgreSQL
+CHAT_SEARCH_EXPR = (
+    "(coalesce(username, '') || ' ' || coalesce(first_name, '') || ' ' || "
+    "coalesce(last_name, '') || ' ' || user_id::text)"
+)
+
+# tsvector сообщений в PostgreSQL: русская и английская морфология одновременно
+# ({col} — content в запросах, NEW.content в триггере)
+MESSAGE_TSV_EXPR = (
+    "(to_tsvector('russian', coalesce({col}, '')) || to_tsvector('english', coalesce({col}, '')))"
+)
+
+# Маркеры начала/конца совпадения в сниппетах поиска (заменяются на <mark> после экранирования)
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+
+# Профиль SQLite для продакшена: Tortoise применяет параметры URL как PRAGMA при подключении.
+# Значения, уже указанные в DATABASE_URL, не переопределяются.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # в WAL безопасно: при сбое питания теряется только последний коммит
+    "busy_timeout": 5000,  # мс ожидания блокировки вместо мгновенного "database is locked"
+    "cache_size": -65536,  # 64 МБ страничного кэша
+    "mmap_size": 268435456,  # 256 МБ чтения через mmap
+    "temp_store": "MEMORY",
+}
+
+# Типы медиа, которые в интерфейсе и истории ИИ показываются с меткой: "[photo] подпись"
+MEDIA_LABEL_TYPES = ("photo", "video", "audio", "voice", "document", "video_note")
+
+
+class _FtsMatching(Comparator):
+    match = " MATCH "
+
+def message_display_text(content: Optional[str], media_type: Optional[str]) -> str:
+    """Текст сообщения для показа: к подписи медиа добавляется метка типа"""
+    content = content or ""
+    if media_type not in MEDIA_LABEL_TYPES:
+        return content
+    label = f"[{media_type}]"
+    # Строки, записанные до компактизации, уже содержат метку
+    if content.startswith(label):
+        return content
+    return f"{label} {content}".strip()
+
+
 class Chat(Model):
     """Модель чата"""
     id = fields.IntField(pk=True)
@@ -27,25 +82,43 @@ class Chat(Model):
     assigned_admin_id = fields.IntField(null=True)
     last_message_at = fields.DatetimeField(null=True)
     topic_id = fields.BigIntField(null=True)
+    # Денормализованные поля для списка чатов (обновляются при добавлении сообщения)
+    last_message_preview = fields.CharField(max_length=255, null=True)
+    user_message_count = fields.IntField(default=0)
     
     # Reverse relations
     messages: fields.ReverseRelation["Message"]
     notifications: fields.ReverseRelation["ManagerNotification"]
+    read_markers: fields.ReverseRelation["ChatReadMarker"]
 
     class Meta:
         table = "chats"
 
-class Message(Model):
+class MessageTextMixin:
+    """Общие accessors текста для Message и ArchivedMessage"""
+
+    @property
+    def display_text(self) -> str:
+        """Текст для интерфейса и истории ИИ: "[photo] подпись" для медиа"""
+        return message_display_text(self.content, self.media_type)
+
+    @property
+    def text(self) -> str:
+        """Совместимость со старой колонкой text (дублировала content вместе с меткой медиа)"""
+        return self.display_text
+
+
+class Message(MessageTextMixin, Model):
     """Модель сообщения"""
     id = fields.IntField(pk=True)
     chat = fields.ForeignKeyField('models.Chat', related_name='messages', index=True)
     user_id = fields.BigIntField()
     message_type = fields.CharField(max_length=50, default="user")  # user, ai, manager
+    # Единственная колонка текста: текст сообщения или подпись медиа без метки типа
     content = fields.TextField()
     created_at = fields.DatetimeField(auto_now_add=True, index=True)
     # Новые поля по ТЗ
     source = fields.CharField(max_length=50, null=True)  # user | manager_web | manager_group | ai | system
-    text = fields.TextField(null=True)
     media_type = fields.CharField(max_length=20, null=True)  # photo | video | document | audio | voice | sticker | none
     media_file_id = fields.CharField(max_length=255, null=True)
     tg_message_id_user = fields.BigIntField(null=True)
@@ -56,6 +129,36 @@ class Message(Model):
     class Meta:
         table = "messages"
 
+
+class ArchivedMessage(MessageTextMixin, Model):
+    """Сообщение закрытого чата, перенесенное из messages (id сохраняется)"""
+    id = fields.IntField(pk=True, generated=False)
+    chat = fields.ForeignKeyField('models.Chat', related_name='archived_messages', index=True)
+    user_id = fields.BigIntField()
+    message_type = fields.CharField(max_length=50, default="user")
+    content = fields.TextField()
+    created_at = fields.DatetimeField(index=True)
+    source = fields.CharField(max_length=50, null=True)
+    media_type = fields.CharField(max_length=20, null=True)
+    media_file_id = fields.CharField(max_length=255, null=True)
+    tg_message_id_user = fields.BigIntField(null=True)
+    tg_message_id_group = fields.BigIntField(null=True)
+    admin_user_id = fields.IntField(null=True)
+    client_event_id = fields.CharField(max_length=64, null=True)
+    archived_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "messages_archive"
+
+# Таблицы сообщений, по которым идет полнотекстовый поиск
+MESSAGE_TABLES = ("messages", "messages_archive")
+
+# Поля, переносимые из messages в messages_archive
+ARCHIVE_FIELDS = (
+    "id", "chat_id", "user_id", "message_type", "content", "created_at", "source", "media_type",
+    "media_file_id", "tg_message_id_user", "tg_message_id_group", "admin_user_id", "client_event_id",
+)
+
 class ManagerNotification(Model):
     """Модель уведомления менеджера"""
     id = fields.IntField(pk=True)
@@ -67,6 +170,19 @@ class ManagerNotification(Model):
     class Meta:
         table = "manager_notifications"
 
+class ChatReadMarker(Model):
+    """Отметка прочтения чата пользователем админ-панели"""
+    id = fields.IntField(pk=True)
+    admin_user_id = fields.IntField(index=True)
+    chat = fields.ForeignKeyField('models.Chat', related_name='read_markers', index=True)
+    read_user_count = fields.IntField(default=0)  # значение chat.user_message_count на момент прочтения
+    last_read_message_id = fields.IntField(null=True)
+    updated_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "chat_read_markers"
+        unique_together = (("admin_user_id", "chat"),)
+
 class AdminUser(Model):
     """Модель пользователя админ-панели"""
     id = fields.IntField(pk=True)
@@ -119,6 +235,113 @@ class Database:
     
     def __init__(self, config: Optional[Config] = None):
         self.config = config or Config()
+        self._chat_search_mode = None  # fts (SQLite FTS5) | trgm (PostgreSQL pg_trgm) | None
+        self._message_search_mode = None  # fts (SQLite FTS5) | tsv (PostgreSQL tsvector) | None
+        self.write_buffer = None
+        self._maintenance_task: Optional[asyncio.Task] = None
+        if self.config.db_write_buffer:
+            from modules.write_buffer import MessageWriteBuffer
+            self.write_buffer = MessageWriteBuffer(
+                self.write_messages,
+                max_delay=self.config.db_write_buffer_delay_ms / 1000.0,
+                max_batch=self.config.db_write_buffer_max_batch,
+            )
+
+    @staticmethod
+    def _with_sqlite_pragmas(db_url: str) -> str:
+        """Добавить к sqlite:// URL параметры профиля SQLITE_PRAGMAS"""
+        base, _, query = db_url.partition("?")
+        params = dict(parse_qsl(query))
+        for key, value in SQLITE_PRAGMAS.items():
+            params.setdefault(key, str(value))
+        return f"{base}?{urlencode(params)}"
+
+    async def _sqlite_maintenance_loop(self, interval: float):
+        """Периодически обновлять статистику планировщика и сбрасывать WAL в основной файл"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sqlite_maintenance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"SQLite maintenance failed: {e}")
+
+    async def sqlite_maintenance(self) -> dict:
+        """PRAGMA optimize и пассивный checkpoint WAL (не блокирует читателей и писателей)"""
+        conn = Tortoise.get_connection("default")
+        await conn.execute_script("PRAGMA optimize")
+        rows = await conn.execute_query_dict("PRAGMA wal_checkpoint(PASSIVE)")
+        return rows[0] if rows else {}
+
+    def _connection_config(self, db_url: str) -> dict:
+        """Параметры подключения Tortoise; для PostgreSQL — размеры пула и настройки asyncpg.
+
+        Параметры, указанные в самом URL (?maxsize=...), имеют приоритет.
+        """
+        if db_url.startswith("postgresql://"):
+            db_url = db_url.replace("postgresql://", "postgres://", 1)
+        if db_url.startswith("sqlite") and self.config.sqlite_tuning:
+            db_url = self._with_sqlite_pragmas(db_url)
+        conn = expand_db_url(db_url)
+        if conn["engine"] == "tortoise.backends.asyncpg":
+            credentials = conn["credentials"]
+            credentials.setdefault("minsize", self.config.db_pool_min)
+            credentials.setdefault("maxsize", self.config.db_pool_max)
+            credentials.setdefault("statement_cache_size", self.config.db_statement_cache_size)
+            if self.config.db_command_timeout > 0:
+                credentials.setdefault("command_timeout", self.config.db_command_timeout)
+            credentials.setdefault("max_inactive_connection_lifetime", 300.0)
+        return conn
+
+    @property
+    def read_db(self):
+        """Подключение для тяжелых чтений админки: реплика, если задана, иначе None (основное)"""
+        if not self.config.database_replica_url:
+            return None
+        try:
+            return Tortoise.get_connection("replica")
+        except Exception:
+            return None
+
+    def pool_metrics(self) -> dict:
+        """Загрузка пулов подключений asyncpg (для SQLite — одно соединение без пула)"""
+        out = {}
+        for name in ("default", "replica"):
+            try:
+                conn = Tortoise.get_connection(name)
+            except Exception:
+                continue
+            # Публичного доступа к пулу у клиента Tortoise нет: берем asyncpg.Pool осторожно
+            pool = getattr(conn, "_pool", None)
+            if pool is None or not hasattr(pool, "get_idle_size"):
+                out[name] = {"dialect": conn.capabilities.dialect, "pool": False}
+                continue
+            try:
+                size = pool.get_size()
+                idle = pool.get_idle_size()
+                max_size = pool.get_max_size()
+                out[name] = {
+                    "dialect": conn.capabilities.dialect,
+                    "pool": True,
+                    "min_size": pool.get_min_size(),
+                    "max_size": max_size,
+                    "size": size,
+                    "idle": idle,
+                    "in_use": size - idle,
+                    "utilisation": round((size - idle) / max_size, 3) if max_size else 0.0,
+                }
+            except Exception as e:
+                out[name] = {"dialect": conn.capabilities.dialect, "pool": True, "error": str(e)}
+        return out
+
+    @property
+    def dialect(self) -> str:
+        """Диалект основного подключения: sqlite | postgres"""
+        try:
+            return Tortoise.get_connection("default").capabilities.dialect
+        except Exception:
+            return ""
     
     async def initialize(self):
         """Инициализация подключения к базе данных"""
@@ -133,13 +356,17 @@ class Database:
         
         logger.info(f"Initializing Database with URL type: {db_url.split(':')[0]}")
         
-        await Tortoise.init(
-            db_url=db_url,
-            modules={'models': ['modules.database']}
-        )
+        connections = {"default": self._connection_config(db_url)}
+        if self.config.database_replica_url:
+            connections["replica"] = self._connection_config(self.config.database_replica_url)
+            logger.info("Read replica configured for admin read endpoints")
+        await Tortoise.init(config={
+            "connections": connections,
+            "apps": {"models": {"models": ["modules.database"], "default_connection": "default"}},
+        })
         
-        # Генерируем схему (создаем таблицы)
-        await Tortoise.generate_schemas()
+        # Генерируем схему (создаем таблицы) только на основном подключении: реплика только для чтения
+        await generate_schema_for_client(Tortoise.get_connection("default"), safe=True)
         logger.info("Database initialized and schemas generated")
         
         # Пытаться апгрейдить схему для существующих таблиц (SQLite без мигратора)
@@ -160,7 +387,6 @@ class Database:
                 # Message доп. колонки
                 for ddl in [
                     "ALTER TABLE messages ADD COLUMN source TEXT",
-                    "ALTER TABLE messages ADD COLUMN text TEXT",
                     "ALTER TABLE messages ADD COLUMN media_type TEXT",
                     "ALTER TABLE messages ADD COLUMN media_file_id TEXT",
                     "ALTER TABLE messages ADD COLUMN tg_message_id_user INTEGER",
@@ -182,6 +408,339 @@ class Database:
                         pass
         except Exception:
             pass
+
+        try:
+            added = await self._add_missing_columns("chats", [
+                ("last_message_preview", "VARCHAR(255)"),
+                ("user_message_count", "INTEGER NOT NULL DEFAULT 0"),
+            ])
+            if added:
+                await self._backfill_chat_summary()
+        except Exception as e:
+            logger.warning(f"Failed to upgrade chats table: {e}")
+
+        await self._ensure_search_indexes()
+        await self._ensure_message_search_index()
+
+        if self.dialect == "sqlite" and self.config.sqlite_tuning:
+            try:
+                # Для долгоживущего соединения: собрать статистику по таблицам без нее
+                await Tortoise.get_connection("default").execute_script("PRAGMA optimize=0x10002")
+            except Exception as e:
+                logger.warning(f"PRAGMA optimize failed: {e}")
+            interval = self.config.sqlite_maintenance_interval
+            if interval > 0 and (self._maintenance_task is None or self._maintenance_task.done()):
+                self._maintenance_task = asyncio.create_task(self._sqlite_maintenance_loop(interval))
+
+    async def _add_missing_columns(self, table: str, columns: List[tuple]) -> List[str]:
+        """Добавить отсутствующие колонки (SQLite/PostgreSQL), вернуть список добавленных"""
+        conn = Tortoise.get_connection("default")
+        if self.dialect == "sqlite":
+            rows = await conn.execute_query_dict(f"PRAGMA table_info({table})")
+            existing = {r["name"] for r in rows}
+        else:
+            rows = await conn.execute_query_dict(
+                "SELECT column_name FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = $1",
+                [table],
+            )
+            existing = {r["column_name"] for r in rows}
+        added = []
+        for name, ddl_type in columns:
+            if name in existing:
+                continue
+            await conn.execute_script(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}")
+            added.append(name)
+        return added
+
+    async def _backfill_chat_summary(self):
+        """Заполнить превью и счетчики сообщений для существующих чатов"""
+        conn = Tortoise.get_connection("default")
+        await conn.execute_script(
+            "UPDATE chats SET "
+            "user_message_count = (SELECT COUNT(*) FROM messages m WHERE m.chat_id = chats.id AND m.message_type = 'user'), "
+            "last_message_preview = (SELECT substr(m.content, 1, 255) FROM messages m WHERE m.chat_id = chats.id ORDER BY m.id DESC LIMIT 1)"
+        )
+        logger.info("Chat summary columns backfilled")
+
+    async def _ensure_search_indexes(self):
+        """Индексы поиска по чатам: FTS5 (trigram) в SQLite, pg_trgm в PostgreSQL"""
+        conn = Tortoise.get_connection("default")
+        dialect = self.dialect
+        self._chat_search_mode = None
+        try:
+            # Keyset-пагинация списка чатов идет по (last_message_at, id)
+            await conn.execute_script("CREATE INDEX IF NOT EXISTS idx_chats_last_message ON chats (last_message_at, id)")
+        except Exception as e:
+            logger.warning(f"Failed to create chat list index: {e}")
+        try:
+            if dialect == "sqlite":
+                rows = await conn.execute_query_dict("SELECT name FROM sqlite_master WHERE type='table' AND name='chats_fts'")
+                exists = bool(rows)
+                await conn.execute_script(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5("
+                    "username, first_name, last_name, user_id, "
+                    "content='chats', content_rowid='id', tokenize='trigram')"
+                )
+                await conn.execute_script("""
+                    CREATE TRIGGER IF NOT EXISTS chats_fts_ai AFTER INSERT ON chats BEGIN
+                        INSERT INTO chats_fts(rowid, username, first_name, last_name, user_id)
+                        VALUES (new.id, new.username, new.first_name, new.last_name, new.user_id);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS chats_fts_ad AFTER DELETE ON chats BEGIN
+                        INSERT INTO chats_fts(chats_fts, rowid, username, first_name, last_name, user_id)
+                        VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.user_id);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS chats_fts_au AFTER UPDATE OF username, first_name, last_name, user_id ON chats BEGIN
+                        INSERT INTO chats_fts(chats_fts, rowid, username, first_name, last_name, user_id)
+                        VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.user_id);
+                        INSERT INTO chats_fts(rowid, username, first_name, last_name, user_id)
+                        VALUES (new.id, new.username, new.first_name, new.last_name, new.user_id);
+                    END;
+                """)
+                if not exists:
+                    await conn.execute_script("INSERT INTO chats_fts(chats_fts) VALUES('rebuild')")
+                self._chat_search_mode = "fts"
+            elif dialect == "postgres":
+                await conn.execute_script("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                await conn.execute_script(
+                    f"CREATE INDEX IF NOT EXISTS idx_chats_search_trgm ON chats USING gin ({CHAT_SEARCH_EXPR} gin_trgm_ops)"
+                )
+                self._chat_search_mode = "trgm"
+        except Exception as e:
+            logger.warning(f"Chat search index unavailable, falling back to LIKE scans: {e}")
+
+    def chat_search_filter(self, query: str) -> Optional[Term]:
+        """Условие поиска чатов по индексу для annotate/filter (None — индекс не применим)
+
+        Подзапрос вместо списка ID: счетчики и keyset-пагинация видят все совпадения.
+        Строка поиска передается параметром запроса, а не подставляется в SQL.
+        """
+        q = (query or "").strip()
+        # trigram-индексы работают от трёх символов
+        if not self._chat_search_mode or len(q) < 3:
+            return None
+        if self._chat_search_mode == "fts":
+            match = '"' + q.replace('"', '""') + '"'
+            matched = Query.from_("chats_fts").select(SqlField("rowid")).where(
+                BasicCriterion(_FtsMatching.match, SqlField("chats_fts"), ValueWrapper(match))
+            )
+            return Bracket(SqlField("id").isin(matched))
+        # Экранирование обратным слэшем — стандартный ESCAPE у LIKE, он живет только в значении параметра
+        pattern = ValueWrapper(f"%{escape_like(q)}%")
+        return Bracket(BasicCriterion(Matching.ilike, RawSQL(CHAT_SEARCH_EXPR), pattern))
+    
+    async def _ensure_message_search_index(self):
+        """Полнотекстовый индекс сообщений (живых и архивных): FTS5 в SQLite, tsvector + GIN в PostgreSQL"""
+        self._message_search_mode = None
+        try:
+            if self.dialect == "sqlite":
+                for table in MESSAGE_TABLES:
+                    await self._ensure_fts_table(table)
+                self._message_search_mode = "fts"
+            elif self.dialect == "postgres":
+                ready = [await self._ensure_tsv_column(table) for table in MESSAGE_TABLES]
+                if all(ready):
+                    self._message_search_mode = "tsv"
+                else:
+                    logger.warning(
+                        "Message search index is not built yet, falling back to LIKE scans; "
+                        "run scripts/build_search_index.py and restart"
+                    )
+        except Exception as e:
+            logger.warning(f"Message search index unavailable, falling back to LIKE scans: {e}")
+
+    async def _ensure_fts_table(self, table: str):
+        """FTS5-индекс {table}_fts по content с триггерами синхронизации (SQLite)"""
+        conn = Tortoise.get_connection("default")
+        fts = f"{table}_fts"
+        rows = await conn.execute_query_dict("SELECT name FROM sqlite_master WHERE type='table' AND name=?", [fts])
+        await conn.execute_script(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"content, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+        )
+        # Триггеры держат индекс в синхронизации для всех путей вставки (бот, API, шаблоны, архивация)
+        await conn.execute_script(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF content ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content);
+            END;
+        """)
+        if not rows:
+            await conn.execute_script(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")
+            logger.info(f"Full-text index {fts} built")
+
+    async def _ensure_tsv_column(self, table: str) -> bool:
+        """tsvector-колонка search_tsv, которую заполняет триггер, и GIN-индекс по ней (PostgreSQL)
+
+        Колонка без значения по умолчанию добавляется без перезаписи таблицы. Заполнение старых
+        строк и CREATE INDEX CONCURRENTLY на непустой таблице — в build_message_search_index,
+        чтобы старт приложения не держал блокировку. Возвращает True, если индекс готов.
+        """
+        conn = Tortoise.get_connection("default")
+        rows = await conn.execute_query_dict(
+            "SELECT is_generated FROM information_schema.columns WHERE table_name = $1 AND column_name = 'search_tsv'",
+            [table],
+        )
+        if not rows:
+            await conn.execute_script(f"ALTER TABLE {table} ADD COLUMN search_tsv tsvector")
+        # Колонку, созданную раньше как GENERATED ALWAYS, пересчитывает сама БД — триггер не нужен
+        if not rows or rows[0]["is_generated"] != "ALWAYS":
+            trigger = await conn.execute_query_dict("SELECT 1 FROM pg_trigger WHERE tgname = $1", [f"{table}_search_tsv"])
+            if not trigger:
+                await conn.execute_script(f"""
+                    CREATE OR REPLACE FUNCTION {table}_search_tsv_update() RETURNS trigger AS $$
+                    BEGIN
+                        NEW.search_tsv := {MESSAGE_TSV_EXPR.format(col="NEW.content")};
+                        RETURN NEW;
+                    END
+                    $$ LANGUAGE plpgsql;
+                    CREATE TRIGGER {table}_search_tsv BEFORE INSERT OR UPDATE OF content ON {table}
+                        FOR EACH ROW EXECUTE FUNCTION {table}_search_tsv_update();
+                """)
+        index = await conn.execute_query_dict(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = $1",
+            [f"idx_{table}_search_tsv"],
+        )
+        if index:
+            return bool(index[0]["indisvalid"])
+        if await conn.execute_query_dict(f"SELECT 1 FROM {table} LIMIT 1"):
+            return False
+        # Пустая таблица (новая установка): индекс строится мгновенно
+        await conn.execute_script(f"CREATE INDEX IF NOT EXISTS idx_{table}_search_tsv ON {table} USING gin (search_tsv)")
+        return True
+
+    async def build_message_search_index(self, table: str = "messages", batch_size: int = 5000,
+                                         pause: float = 0.05) -> dict:
+        """Заполнить search_tsv старых строк пачками и построить индекс CONCURRENTLY (PostgreSQL)
+
+        Не блокирует запись: каждая пачка — короткий UPDATE, индекс строится без ACCESS EXCLUSIVE.
+        """
+        if self.dialect != "postgres":
+            return {"table": table, "skipped": "not postgres"}
+        conn = Tortoise.get_connection("default")
+        await self._ensure_tsv_column(table)
+        filled = 0
+        last_id = 0
+        while True:
+            rows = await conn.execute_query_dict(
+                f"WITH batch AS (SELECT id FROM {table} WHERE id > $1 AND search_tsv IS NULL ORDER BY id LIMIT $2) "
+                f"UPDATE {table} t SET search_tsv = {MESSAGE_TSV_EXPR.format(col='t.content')} "
+                "FROM batch WHERE t.id = batch.id RETURNING t.id",
+                [last_id, batch_size],
+            )
+            if not rows:
+                break
+            filled += len(rows)
+            last_id = max(r["id"] for r in rows)
+            logger.info(f"{table}: search_tsv filled for {filled} rows (id <= {last_id})")
+            await asyncio.sleep(pause)
+        index = f"idx_{table}_search_tsv"
+        # Недостроенный (invalid) индекс после прерванного CONCURRENTLY нужно пересоздать
+        await conn.execute_script(
+            f"DO $$ BEGIN IF EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            f"WHERE c.relname = '{index}' AND NOT i.indisvalid) THEN EXECUTE 'DROP INDEX {index}'; END IF; END $$"
+        )
+        await conn.execute_script(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index} ON {table} USING gin (search_tsv)")
+        return {"table": table, "rows_filled": filled, "index": index}
+
+    @staticmethod
+    def _fts_match_query(query: str) -> str:
+        """Запрос FTS5 из пользовательской строки: все слова обязательны, поиск по префиксу"""
+        terms = [t.replace('"', '""') for t in query.split() if t.strip('"')]
+        return " ".join(f'"{t}"*' for t in terms)
+
+    @staticmethod
+    def _like_snippet(content: str, query: str, width: int = 60) -> str:
+        """Сниппет вокруг первого вхождения (для поиска без индекса)"""
+        text = content or ""
+        pos = text.lower().find(query.lower())
+        if pos < 0:
+            return text[: width * 2]
+        start = max(0, pos - width)
+        end = min(len(text), pos + len(query) + width)
+        return (
+            ("…" if start > 0 else "")
+            + text[start:pos] + SNIPPET_START + text[pos:pos + len(query)] + SNIPPET_END + text[pos + len(query):end]
+            + ("…" if end < len(text) else "")
+        )
+
+    async def search_messages(self, query: str, before_id: Optional[int] = None, limit: int = 50,
+                              chat_id: Optional[int] = None) -> List[dict]:
+        """Полнотекстовый поиск по сообщениям, включая архив (новые сверху, keyset по id)
+
+        Каждая таблица отдает не больше limit совпадений, общий результат сливается по id.
+        """
+        q = (query or "").strip()
+        if not q:
+            return []
+        conn = self.read_db or Tortoise.get_connection("default")
+        if self._message_search_mode == "fts":
+            match = self._fts_match_query(q)
+            if not match:
+                return []
+            parts = []
+            values: list = []
+            for table in MESSAGE_TABLES:
+                fts = f"{table}_fts"
+                sql = (
+                    "SELECT m.id, m.chat_id, m.source, m.message_type, m.created_at, "
+                    f"snippet({fts}, 0, ?, ?, '…', 16) AS snippet "
+                    f"FROM {fts} JOIN {table} m ON m.id = {fts}.rowid "
+                    f"WHERE {fts} MATCH ?"
+                )
+                values += [SNIPPET_START, SNIPPET_END, match]
+                if before_id is not None:
+                    sql += f" AND {fts}.rowid < ?"
+                    values.append(before_id)
+                if chat_id is not None:
+                    sql += " AND m.chat_id = ?"
+                    values.append(chat_id)
+                sql += f" ORDER BY {fts}.rowid DESC LIMIT ?"
+                values.append(limit)
+                parts.append(f"SELECT * FROM ({sql})")
+            values.append(limit)
+            return await conn.execute_query_dict(" UNION ALL ".join(parts) + " ORDER BY id DESC LIMIT ?", values)
+        if self._message_search_mode == "tsv":
+            tsq = "(websearch_to_tsquery('russian', $1) || websearch_to_tsquery('english', $1))"
+            values = [q]
+            conditions = ""
+            if before_id is not None:
+                values.append(before_id)
+                conditions += f" AND m.id < ${len(values)}"
+            if chat_id is not None:
+                values.append(chat_id)
+                conditions += f" AND m.chat_id = ${len(values)}"
+            values.append(limit)
+            parts = [
+                "(SELECT m.id, m.chat_id, m.source, m.message_type, m.created_at, "
+                f"ts_headline('russian', m.content, {tsq}, "
+                "'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords=30, MinWords=10, MaxFragments=2') AS snippet "
+                f"FROM {table} m WHERE m.search_tsv @@ {tsq}{conditions} ORDER BY m.id DESC LIMIT ${len(values)})"
+                for table in MESSAGE_TABLES
+            ]
+            sql = " UNION ALL ".join(parts) + f" ORDER BY id DESC LIMIT ${len(values)}"
+            return await conn.execute_query_dict(sql, values)
+        # Без индекса — последовательный просмотр
+        rows = []
+        for model in (Message, ArchivedMessage):
+            qs = model.filter(content__icontains=q).using_db(self.read_db)
+            if before_id is not None:
+                qs = qs.filter(id__lt=before_id)
+            if chat_id is not None:
+                qs = qs.filter(chat_id=chat_id)
+            rows += await qs.order_by("-id").limit(limit).values(
+                "id", "chat_id", "source", "message_type", "created_at", "content"
+            )
+        rows = sorted(rows, key=lambda r: r["id"], reverse=True)[:limit]
+        for r in rows:
+            r["snippet"] = self._like_snippet(r.pop("content"), q)
+        return rows
     
     async def create_chat(self, user_id: int, username: str = None, 
                          first_name: str = None, last_name: str = None) -> Chat:
@@ -207,30 +766,224 @@ class Database:
         """Получить чат по ID"""
         return await Chat.get_or_none(id=chat_id)
     
-    async def add_message(self, chat_id: int, user_id: int, 
-                         content: str, message_type: str = "user") -> Message:
-        """Добавить сообщение в чат"""
-        # Маппинг старой схемы в новую
-        source = {
-            "user": "user",
-            "ai": "ai",
-            "manager": "manager_web"
-        }.get(message_type, "system")
-        message = await Message.create(
+    async def add_message(self, chat_id: int, user_id: int,
+                         content: str, message_type: str = "user", *,
+                         source: Optional[str] = None,
+                         media_type: Optional[str] = None, media_file_id: Optional[str] = None,
+                         tg_message_id_user: Optional[int] = None, tg_message_id_group: Optional[int] = None,
+                         admin_user_id: Optional[int] = None) -> Message:
+        """Добавить сообщение в чат со всеми полями и обновить сводку чата одной транзакцией
+
+        content — текст или подпись медиа без метки типа (метку добавляет Message.display_text).
+        При включенном DB_WRITE_BUFFER запись уходит в групповой коммит;
+        метод возвращается после коммита пачки.
+        """
+        if source is None:
+            # Маппинг старой схемы в новую
+            source = {
+                "user": "user",
+                "ai": "ai",
+                "manager": "manager_web"
+            }.get(message_type, "system")
+        row = dict(
             chat_id=chat_id,
             user_id=user_id,
             message_type=message_type,
             content=content,
             source=source,
-            text=content
+            media_type=media_type,
+            media_file_id=media_file_id,
+            tg_message_id_user=tg_message_id_user,
+            tg_message_id_group=tg_message_id_group,
+            admin_user_id=admin_user_id,
+        )
+        if self.write_buffer is not None:
+            return await self.write_buffer.submit(row)
+        return (await self.write_messages([row]))[0]
+
+    async def write_messages(self, rows: List[dict]) -> List[Message]:
+        """Вставить пачку сообщений и обновить сводки их чатов одной транзакцией"""
+        async with in_transaction("default") as conn:
+            messages = [await Message.create(using_db=conn, **row) for row in rows]
+            last = {}
+            user_counts = {}
+            for message in messages:
+                last[message.chat_id] = message
+                if message.message_type == "user":
+                    user_counts[message.chat_id] = user_counts.get(message.chat_id, 0) + 1
+            for chat_id, message in last.items():
+                await self.touch_chat(chat_id, message, using_db=conn, user_messages=user_counts.get(chat_id, 0))
+        return messages
+
+    async def _messages_has_text_column(self) -> bool:
+        conn = Tortoise.get_connection("default")
+        if self.dialect == "sqlite":
+            rows = await conn.execute_query_dict("PRAGMA table_info(messages)")
+            return any(r["name"] == "text" for r in rows)
+        rows = await conn.execute_query_dict(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = 'messages' AND column_name = 'text'"
+        )
+        return bool(rows)
+
+    async def message_storage_size(self) -> dict:
+        """Размер хранилища сообщений: файл SQLite (без свободных страниц) или таблица messages в PostgreSQL"""
+        conn = Tortoise.get_connection("default")
+        out = {"text_column": await self._messages_has_text_column()}
+        if self.dialect == "sqlite":
+            page_size = (await conn.execute_query_dict("PRAGMA page_size"))[0]["page_size"]
+            pages = (await conn.execute_query_dict("PRAGMA page_count"))[0]["page_count"]
+            free = (await conn.execute_query_dict("PRAGMA freelist_count"))[0]["freelist_count"]
+            out.update(file_bytes=pages * page_size, used_bytes=(pages - free) * page_size, free_bytes=free * page_size)
+            length = "length(CAST({} AS BLOB))"
+        else:
+            rows = await conn.execute_query_dict("SELECT pg_total_relation_size('messages') AS size")
+            out["table_bytes"] = int(rows[0]["size"])
+            length = "octet_length({})"
+        payload = length.format("content")
+        if out["text_column"]:
+            payload += " + coalesce(" + length.format("text") + ", 0)"
+        rows = await conn.execute_query_dict(f"SELECT count(*) AS n, coalesce(sum({payload}), 0) AS payload FROM messages")
+        out.update(messages=int(rows[0]["n"]), text_payload_bytes=int(rows[0]["payload"]))
+        return out
+
+    async def compact_message_storage(self, batch_size: int = 1000, drop_text_column: bool = False) -> dict:
+        """Перевести сообщения на одну колонку текста
+
+        Метки "[photo] " из content убираются (их добавляет Message.display_text),
+        дубликат в колонке text очищается. Идет пачками по id, каждая пачка — своя транзакция,
+        так что прерванный запуск можно просто повторить.
+        """
+        has_text = await self._messages_has_text_column()
+        pg = self.dialect == "postgres"
+        select = "SELECT id, content, media_type" + (", text" if has_text else "") + " FROM messages WHERE id > {} ORDER BY id LIMIT {}"
+        select = select.format(*(("$1", "$2") if pg else ("?", "?")))
+        update = "UPDATE messages SET content = {}" + (", text = NULL" if has_text else "") + " WHERE id = {}"
+        update = update.format(*(("$1", "$2") if pg else ("?", "?")))
+        stats = {"scanned": 0, "updated": 0, "labels_stripped": 0, "text_cleared": 0, "text_column_dropped": False}
+        last_id = 0
+        while True:
+            async with in_transaction("default") as conn:
+                rows = await conn.execute_query_dict(select, [last_id, batch_size])
+                if not rows:
+                    break
+                changes = []
+                for row in rows:
+                    content = row["content"] or ""
+                    label = f"[{row['media_type']}]"
+                    if row["media_type"] in MEDIA_LABEL_TYPES and content.startswith(label):
+                        content = content[len(label):].strip()
+                        stats["labels_stripped"] += 1
+                    if has_text and row.get("text") is not None:
+                        stats["text_cleared"] += 1
+                    elif content == row["content"]:
+                        continue
+                    changes.append([content, row["id"]])
+                if changes:
+                    await conn.execute_many(update, changes)
+                stats["scanned"] += len(rows)
+                stats["updated"] += len(changes)
+                last_id = rows[-1]["id"]
+            logger.info(f"Message compaction: {stats['scanned']} scanned, {stats['updated']} updated (id <= {last_id})")
+        if drop_text_column and has_text:
+            # DROP COLUMN в SQLite доступен с 3.35
+            await Tortoise.get_connection("default").execute_script("ALTER TABLE messages DROP COLUMN text")
+            stats["text_column_dropped"] = True
+        return stats
+
+    @staticmethod
+    def message_preview(content: Optional[str]) -> str:
+        """Короткое однострочное превью сообщения для списка чатов"""
+        return " ".join((content or "").split())[:255]
+
+    async def touch_chat(self, chat_id: int, message: Message, using_db=None, user_messages: Optional[int] = None):
+        """Обновить денормализованные поля чата после нового сообщения
+
+        user_messages — сколько сообщений клиента добавилось (по умолчанию по типу message)
+        """
+        update_data = {
+            "last_message_at": message.created_at,
+            "last_message_preview": self.message_preview(message.display_text),
+        }
+        if user_messages is None:
+            user_messages = 1 if message.message_type == "user" else 0
+        if user_messages:
+            update_data["user_message_count"] = F("user_message_count") + user_messages
+        await Chat.filter(id=chat_id).using_db(using_db).update(**update_data)
+
+    async def mark_chat_read(self, chat: Chat, admin_user_id: int):
+        """Отметить чат прочитанным для пользователя админ-панели"""
+        last = await Message.filter(chat_id=chat.id).order_by("-id").first().values_list("id", flat=True)
+        await ChatReadMarker.update_or_create(
+            admin_user_id=admin_user_id,
+            chat_id=chat.id,
+            defaults={"read_user_count": chat.user_message_count or 0, "last_read_message_id": last},
         )
-        # Обновляем last_message_at
-        await Chat.filter(id=chat_id).update(last_message_at=message.created_at)
-        return message
+
+    async def get_unread_counts(self, chats: List[Chat], admin_user_id: int) -> dict:
+        """Непрочитанные сообщения клиентов по чатам для пользователя (один запрос)"""
+        if not chats:
+            return {}
+        rows = await ChatReadMarker.filter(
+            admin_user_id=admin_user_id, chat_id__in=[c.id for c in chats]
+        ).values("chat_id", "read_user_count")
+        read = {r["chat_id"]: r["read_user_count"] or 0 for r in rows}
+        return {c.id: max(0, (c.user_message_count or 0) - read.get(c.id, 0)) for c in chats}
     
     async def get_chat_messages(self, chat_id: int, limit: int = 50) -> List[Message]:
-        """Получить сообщения чата"""
-        return await Message.filter(chat_id=chat_id).order_by("created_at").limit(limit).all()
+        """Получить последние сообщения чата (в хронологическом порядке)"""
+        return await self.get_chat_history(chat_id, limit=limit)
+
+    async def get_chat_history(self, chat_id: int, before_id: Optional[int] = None,
+                               limit: Optional[int] = 50) -> List[Message]:
+        """Сообщения чата до before_id в хронологическом порядке, с дочитыванием из архива
+
+        Архивные сообщения чата всегда старше живых, поэтому архив читается только
+        если живых не хватило до limit (limit=None — вся история).
+        """
+        qs = Message.filter(chat_id=chat_id)
+        if before_id:
+            qs = qs.filter(id__lt=before_id)
+        qs = qs.order_by("-id")
+        rows = list(await (qs.limit(limit) if limit else qs))
+        if limit is None or len(rows) < limit:
+            archived = ArchivedMessage.filter(chat_id=chat_id)
+            bound = rows[-1].id if rows else before_id
+            if bound:
+                archived = archived.filter(id__lt=bound)
+            archived = archived.order_by("-id")
+            rows += list(await (archived.limit(limit - len(rows)) if limit else archived))
+        return list(reversed(rows))
+
+    async def estimate_rows(self, table: str) -> Optional[int]:
+        """Оценка числа строк по статистике планировщика (без сканирования таблицы); None — статистики нет"""
+        conn = self.read_db or Tortoise.get_connection("default")
+        try:
+            if self.dialect == "sqlite":
+                # sqlite_stat1 заполняют ANALYZE и PRAGMA optimize; первое число в stat — строки таблицы
+                rows = await conn.execute_query_dict("SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", [table])
+                return int(rows[0]["stat"].split()[0]) if rows else None
+            rows = await conn.execute_query_dict("SELECT reltuples::bigint AS n FROM pg_class WHERE relname = $1", [table])
+            # -1 — таблица еще ни разу не анализировалась
+            return int(rows[0]["n"]) if rows and rows[0]["n"] >= 0 else None
+        except Exception:
+            return None
+
+    async def archive_messages(self, chat_ids: List[int], before, batch_size: int = 500) -> int:
+        """Перенести до batch_size сообщений (созданных раньше before) указанных чатов в архив
+
+        Вставка в архив и удаление из messages — одна короткая транзакция.
+        Возвращает число перенесенных сообщений (0 — переносить больше нечего).
+        """
+        async with in_transaction("default") as conn:
+            rows = await (
+                Message.filter(chat_id__in=chat_ids, created_at__lt=before)
+                .using_db(conn).order_by("id").limit(batch_size).values(*ARCHIVE_FIELDS)
+            )
+            if not rows:
+                return 0
+            await ArchivedMessage.bulk_create([ArchivedMessage(**row) for row in rows], using_db=conn)
+            await Message.filter(id__in=[row["id"] for row in rows]).using_db(conn).delete()
+        return len(rows)
     
     async def update_chat_status(self, chat_id: int, status: str, manager_id: int = None):
         """Обновить статус чата"""
@@ -240,6 +993,44 @@ class Database:
         
         await Chat.filter(id=chat_id).update(**update_data)
     
+    async def put_system_settings(self, updates: Dict[str, Optional[Tuple[str, Optional[str]]]]):
+        """Записать несколько настроек одной транзакцией
+
+        updates: ключ -> (значение, описание) или None для удаления.
+        Описание None сохраняет уже записанное.
+        """
+        upserts = [(k, v) for k, v in updates.items() if v is not None]
+        deletes = [k for k, v in updates.items() if v is None]
+        async with in_transaction("default") as conn:
+            if deletes:
+                await SystemConfig.filter(key__in=deletes).using_db(conn).delete()
+            if not upserts:
+                return
+            now = timezone.now()
+            values: list = []
+            rows = []
+            for key, (value, description) in upserts:
+                if self.dialect == "postgres":
+                    n = len(values)
+                    rows.append(f"(${n + 1}, ${n + 2}, ${n + 3}, ${n + 4})")
+                else:
+                    rows.append("(?, ?, ?, ?)")
+                values.extend([key, str(value), description, now])
+            await conn.execute_query(
+                "INSERT INTO system_config (key, value, description, updated_at) VALUES "
+                + ", ".join(rows)
+                + " ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+                "description = COALESCE(excluded.description, system_config.description), "
+                "updated_at = excluded.updated_at",
+                values,
+            )
+
+    async def create_manager_notifications(self, chat_id: int, manager_ids: List[int]):
+        """Создать уведомления для нескольких менеджеров одним запросом"""
+        await ManagerNotification.bulk_create(
+            [ManagerNotification(chat_id=chat_id, manager_id=mid, status="pending") for mid in manager_ids]
+        )
+
     async def create_manager_notification(self, chat_id: int, manager_id: int) -> ManagerNotification:
         """Создать уведомление для менеджера"""
         return await ManagerNotification.create(
@@ -256,5 +1047,14 @@ class Database:
         return await query
     
     async def close(self):
-        """Закрыть подключение к базе данных"""
+        """Закрыть подключение к базе данных (сначала дописать буфер сообщений)"""
+        if self._maintenance_task:
+            self._maintenance_task.cancel()
+            try:
+                await self._maintenance_task
+            except asyncio.CancelledError:
+                pass
+            self._maintenance_task = None
+        if self.write_buffer is not None:
+            await self.write_buffer.close()
         await Tortoise.close_connections()
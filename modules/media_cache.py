@@ -0,0 +1,247 @@
+"""
+Дисковый кэш медиафайлов Telegram
+Файлы хранятся по file_unique_id (он не меняется между ботами и отправками),
+вытеснение — LRU по размеру каталога плюс срок хранения media_retention_days
+"""
+
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from loguru import logger
+
+# Уточнение типа по media_type сообщения, если по расширению не определился
+_DEFAULT_CONTENT_TYPES = {
+    "photo": "image/jpeg",
+    "video": "video/mp4",
+    "voice": "audio/ogg",
+    "audio": "audio/mpeg",
+    "sticker": "image/webp",
+}
+
+# Максимум запомненных соответствий file_id -> file_unique_id
+_ALIASES_MAX = 10000
+
+
+@dataclass
+class CachedMedia:
+    """Запись кэша"""
+    unique_id: str
+    path: str
+    size: int
+    content_type: str
+    created_at: float
+    accessed_at: float
+
+    @property
+    def etag(self) -> str:
+        # Содержимое адресуется file_unique_id, поэтому ETag неизменен
+        return f'"{self.unique_id}"'
+
+
+class MediaCache:
+    """LRU-кэш медиа на диске"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max(0, int(max_bytes))
+        self.retention_days: Optional[int] = None  # None — хранить, пока хватает места
+        self._entries: "OrderedDict[str, CachedMedia]" = OrderedDict()
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}  # держатель и ожидающие блокировки по unique_id
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total
+
+    def _data_path(self, unique_id: str) -> str:
+        return os.path.join(self.root, unique_id)
+
+    def _meta_path(self, unique_id: str) -> str:
+        return os.path.join(self.root, unique_id + ".json")
+
+    def _load(self):
+        """Восстановить индекс из каталога (порядок LRU — по времени доступа)"""
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith(".part"):
+                # Недокачанный файл после перезапуска
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except Exception:
+                    pass
+                continue
+            if not name.endswith(".json"):
+                continue
+            unique_id = name[:-5]
+            path = self._data_path(unique_id)
+            try:
+                with open(self._meta_path(unique_id), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                st = os.stat(path)
+            except Exception:
+                self._unlink(unique_id)
+                continue
+            entries.append(CachedMedia(
+                unique_id=unique_id,
+                path=path,
+                size=st.st_size,
+                content_type=meta.get("content_type") or "application/octet-stream",
+                created_at=float(meta.get("created_at") or st.st_mtime),
+                accessed_at=st.st_atime,
+            ))
+            if meta.get("file_id"):
+                self._remember_alias(meta["file_id"], unique_id)
+        for e in sorted(entries, key=lambda x: x.accessed_at):
+            self._entries[e.unique_id] = e
+            self._total += e.size
+        if entries:
+            logger.info(f"Media cache: {len(entries)} files, {self._total // 1024} KiB in {self.root}")
+
+    def _unlink(self, unique_id: str):
+        for p in (self._data_path(unique_id), self._meta_path(unique_id)):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Media cache: failed to remove {p}: {e}")
+
+    def _remember_alias(self, file_id: str, unique_id: str):
+        self._aliases[file_id] = unique_id
+        self._aliases.move_to_end(file_id)
+        while len(self._aliases) > _ALIASES_MAX:
+            self._aliases.popitem(last=False)
+
+    def lookup(self, file_id: Optional[str] = None, unique_id: Optional[str] = None) -> Optional[CachedMedia]:
+        """Найти файл в кэше без обращения к Telegram"""
+        unique_id = unique_id or (self._aliases.get(file_id) if file_id else None)
+        if not unique_id:
+            return None
+        entry = self._entries.get(unique_id)
+        if entry is None:
+            return None
+        if not os.path.exists(entry.path):
+            self.discard(unique_id)
+            return None
+        entry.accessed_at = time.time()
+        self._entries.move_to_end(unique_id)
+        return entry
+
+    async def get(self, bot, file_id: str, media_type: Optional[str] = None,
+                  unique_id: Optional[str] = None) -> CachedMedia:
+        """Вернуть файл из кэша, при промахе — скачать с Telegram прямо на диск"""
+        entry = self.lookup(file_id=file_id, unique_id=unique_id)
+        if entry:
+            self.hits += 1
+            return entry
+        tg_file = await bot.get_file(file_id)
+        unique_id = tg_file.file_unique_id
+        self._remember_alias(file_id, unique_id)
+        lock = self._locks.setdefault(unique_id, asyncio.Lock())
+        self._lock_users[unique_id] = self._lock_users.get(unique_id, 0) + 1
+        try:
+            async with lock:
+                # Пока ждали блокировку, файл мог скачать параллельный запрос
+                entry = self.lookup(unique_id=unique_id)
+                if entry:
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+                return await self._download(tg_file, unique_id, media_type, file_id)
+        finally:
+            # Блокировку убираем только за последним: иначе новый запрос создаст вторую
+            # и два скачивания пойдут в один .part одновременно
+            left = self._lock_users.get(unique_id, 1) - 1
+            if left > 0:
+                self._lock_users[unique_id] = left
+            else:
+                self._lock_users.pop(unique_id, None)
+                self._locks.pop(unique_id, None)
+
+    async def _download(self, tg_file, unique_id: str, media_type: Optional[str], file_id: str) -> CachedMedia:
+        path = self._data_path(unique_id)
+        tmp = path + ".part"
+        try:
+            await tg_file.download_to_drive(custom_path=tmp)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        file_path = (getattr(tg_file, "file_path", "") or "").lower()
+        content_type = mimetypes.guess_type(file_path)[0] if file_path else None
+        if not content_type or (media_type == "voice" and not content_type.startswith("audio/")):
+            content_type = _DEFAULT_CONTENT_TYPES.get(media_type or "", "application/octet-stream")
+        now = time.time()
+        with open(self._meta_path(unique_id), "w", encoding="utf-8") as f:
+            json.dump({"content_type": content_type, "created_at": now, "file_path": file_path, "file_id": file_id}, f)
+        entry = CachedMedia(
+            unique_id=unique_id,
+            path=path,
+            size=os.path.getsize(path),
+            content_type=content_type,
+            created_at=now,
+            accessed_at=now,
+        )
+        self._entries[unique_id] = entry
+        self._total += entry.size
+        self.evict()
+        return entry
+
+    def discard(self, unique_id: str) -> int:
+        """Удалить файл из кэша, вернуть освобожденные байты"""
+        entry = self._entries.pop(unique_id, None)
+        self._unlink(unique_id)
+        if entry is None:
+            return 0
+        self._total -= entry.size
+        return entry.size
+
+    def discard_file_id(self, file_id: str) -> int:
+        """Удалить файл по file_id (если его file_unique_id известен)"""
+        unique_id = self._aliases.pop(file_id, None)
+        return self.discard(unique_id) if unique_id else 0
+
+    def prune_expired(self, now: Optional[float] = None) -> int:
+        """Удалить файлы старше срока хранения, вернуть освобожденные байты"""
+        if not self.retention_days:
+            return 0
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        freed = 0
+        for unique_id, entry in list(self._entries.items()):
+            if entry.created_at < cutoff:
+                freed += self.discard(unique_id)
+        return freed
+
+    def evict(self) -> int:
+        """Применить срок хранения и ограничение по размеру (LRU)"""
+        freed = self.prune_expired()
+        # Самый свежий файл оставляем, даже если он один больше лимита — его сейчас отдают
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            unique_id = next(iter(self._entries))
+            freed += self.discard(unique_id)
+        return freed
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._entries),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "retention_days": self.retention_days,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
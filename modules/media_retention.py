@@ -0,0 +1,150 @@
+"""
+Фоновая очистка медиа по сроку хранения (media_retention_days)
+Старые сообщения теряют ссылку на файл Telegram, кэшированные копии удаляются с диска
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from loguru import logger
+from tortoise.transactions import in_transaction
+
+from modules.database import ArchivedMessage, Message, SystemConfig
+from modules.media_cache import MediaCache
+from modules.settings_service import SettingsService
+
+
+class MediaRetentionWorker:
+    """Периодически удаляет медиа старше срока хранения небольшими пачками"""
+
+    def __init__(self, media_cache: MediaCache, interval: float = 3600.0, batch_size: int = 500,
+                 batch_pause: float = 0.2, settings: Optional[SettingsService] = None):
+        self.media_cache = media_cache
+        self.settings = settings
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause  # пауза между пачками, чтобы не держать БД
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.running = False
+        self.last_started_at: Optional[datetime] = None
+        self.last_finished_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_cutoff: Optional[datetime] = None
+        self.messages_processed = 0  # за последний проход
+        self.bytes_reclaimed = 0  # за последний проход
+        self.total_messages_processed = 0
+        self.total_bytes_reclaimed = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def trigger(self):
+        """Запустить проход вне расписания (например, после смены настроек)"""
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Media retention pass failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _retention_days(self) -> Optional[int]:
+        if self.settings is not None:
+            values = self.settings.overrides(["media_keep_forever", "media_retention_days"])
+        else:
+            rows = await SystemConfig.filter(key__in=["media_keep_forever", "media_retention_days"]).all()
+            values = {r.key: (r.value or "") for r in rows}
+        if values.get("media_keep_forever", "").lower() in ["1", "true", "yes", "y", "on"]:
+            return None
+        days_raw = values.get("media_retention_days", "").strip()
+        return int(days_raw) if days_raw.isdigit() and int(days_raw) > 0 else None
+
+    async def run_once(self):
+        """Один проход очистки"""
+        days = await self._retention_days()
+        self.media_cache.retention_days = days
+        if not days:
+            return
+        self.running = True
+        self.last_started_at = datetime.now(timezone.utc)
+        self.last_cutoff = self.last_started_at - timedelta(days=days)
+        self.last_error = None
+        self.messages_processed = 0
+        self.bytes_reclaimed = 0
+        started = time.monotonic()
+        try:
+            for model in (Message, ArchivedMessage):
+                await self._clear_model(model)
+            freed = self.media_cache.prune_expired()
+            self.bytes_reclaimed += freed
+            self.total_bytes_reclaimed += freed
+        finally:
+            self.running = False
+            self.last_finished_at = datetime.now(timezone.utc)
+        if self.messages_processed or self.bytes_reclaimed:
+            logger.info(
+                f"Media retention: {self.messages_processed} messages cleared, "
+                f"{self.bytes_reclaimed // 1024} KiB reclaimed in {time.monotonic() - started:.1f}s"
+            )
+
+    async def _clear_model(self, model):
+        last_id = 0
+        while True:
+            rows = await (
+                model.filter(id__gt=last_id, created_at__lt=self.last_cutoff, media_file_id__not_isnull=True)
+                .order_by("id")
+                .limit(self.batch_size)
+                .values_list("id", "media_file_id")
+            )
+            if not rows:
+                break
+            ids = [r[0] for r in rows]
+            last_id = ids[-1]
+            # Короткая транзакция на пачку — без долгих блокировок таблицы
+            async with in_transaction("default"):
+                await model.filter(id__in=ids).update(media_file_id=None)
+            freed = sum(self.media_cache.discard_file_id(r[1]) for r in rows if r[1])
+            self.messages_processed += len(ids)
+            self.bytes_reclaimed += freed
+            self.total_messages_processed += len(ids)
+            self.total_bytes_reclaimed += freed
+            await asyncio.sleep(self.batch_pause)
+
+    def status(self) -> dict:
+        def iso(dt: Optional[datetime]):
+            return dt.isoformat() if dt else None
+
+        return {
+            "running": self.running,
+            "last_started_at": iso(self.last_started_at),
+            "last_finished_at": iso(self.last_finished_at),
+            "last_cutoff": iso(self.last_cutoff),
+            "last_error": self.last_error,
+            "messages_processed": self.messages_processed,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "total_messages_processed": self.total_messages_processed,
+            "total_bytes_reclaimed": self.total_bytes_reclaimed,
+            "cache": self.media_cache.stats(),
+        }
@@ -0,0 +1,132 @@
+"""
+Фоновая архивация сообщений закрытых чатов (message_archive_days)
+Сообщения чатов, закрытых больше N дней назад, переносятся из messages в messages_archive
+небольшими пачками; история чата дочитывается из архива прозрачно (Database.get_chat_history)
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from loguru import logger
+from tortoise.expressions import Q
+
+from modules.database import Chat, Database
+
+# Сколько чатов обрабатывать за один запрос к messages
+CHAT_CHUNK = 200
+
+
+class MessageArchiveWorker:
+    """Периодически переносит сообщения давно закрытых чатов в архив"""
+
+    def __init__(self, db: Database, days: int, interval: float = 3600.0, batch_size: int = 500,
+                 batch_pause: float = 0.2):
+        self.db = db
+        self.days = days
+        self.interval = interval
+        self.batch_size = max(1, int(batch_size))
+        self.batch_pause = batch_pause  # пауза между пачками, чтобы не держать БД
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.running = False
+        self.last_started_at: Optional[datetime] = None
+        self.last_finished_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.last_cutoff: Optional[datetime] = None
+        self.chats_processed = 0  # за последний проход
+        self.messages_archived = 0  # за последний проход
+        self.total_messages_archived = 0
+
+    def start(self):
+        if self.days <= 0:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def trigger(self):
+        """Запустить проход вне расписания"""
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Message archive pass failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_once(self):
+        """Один проход архивации"""
+        if self.days <= 0:
+            return
+        self.running = True
+        self.last_started_at = datetime.now(timezone.utc)
+        self.last_cutoff = self.last_started_at - timedelta(days=self.days)
+        self.last_error = None
+        self.chats_processed = 0
+        self.messages_archived = 0
+        started = time.monotonic()
+        try:
+            # Закрытые чаты без активности с cutoff (статус меняется через update, поэтому смотрим и на сообщения)
+            chat_ids = await Chat.filter(
+                Q(last_message_at__lt=self.last_cutoff)
+                | Q(last_message_at__isnull=True, updated_at__lt=self.last_cutoff),
+                status="closed",
+            ).order_by("id").values_list("id", flat=True)
+            for i in range(0, len(chat_ids), CHAT_CHUNK):
+                chunk = list(chat_ids[i:i + CHAT_CHUNK])
+                while True:
+                    # Только сообщения старше cutoff: если чат переоткрыли, новые сообщения остаются
+                    moved = await self.db.archive_messages(chunk, self.last_cutoff, self.batch_size)
+                    if not moved:
+                        break
+                    self.messages_archived += moved
+                    self.total_messages_archived += moved
+                    await asyncio.sleep(self.batch_pause)
+                self.chats_processed += len(chunk)
+        finally:
+            self.running = False
+            self.last_finished_at = datetime.now(timezone.utc)
+        if self.messages_archived:
+            logger.info(
+                f"Message archive: {self.messages_archived} messages from {self.chats_processed} closed chats "
+                f"archived in {time.monotonic() - started:.1f}s"
+            )
+
+    async def status(self) -> dict:
+        def iso(dt: Optional[datetime]):
+            return dt.isoformat() if dt else None
+
+        return {
+            "enabled": self.days > 0,
+            "days": self.days,
+            "running": self.running,
+            "last_started_at": iso(self.last_started_at),
+            "last_finished_at": iso(self.last_finished_at),
+            "last_cutoff": iso(self.last_cutoff),
+            "last_error": self.last_error,
+            "chats_processed": self.chats_processed,
+            "messages_archived": self.messages_archived,
+            "total_messages_archived": self.total_messages_archived,
+            # Оценки из статистики планировщика: count() по большим таблицам на каждый опрос метрик слишком дорог
+            "live_messages_estimate": await self.db.estimate_rows("messages"),
+            "archived_messages_estimate": await self.db.estimate_rows("messages_archive"),
+        }
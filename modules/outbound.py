@@ -0,0 +1,268 @@
+"""
+Центральный ограничитель исходящих запросов к Telegram Bot API
+Подключается к Application как rate_limiter, поэтому через него проходят все отправки
+(обработчики бота и роуты админ-панели): token bucket глобально, на чат и на группу,
+приоритеты и повтор после RetryAfter
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+PRIORITY_HIGH = 0  # ответы клиентам в личке
+PRIORITY_NORMAL = 1  # сообщения в группу и сотрудникам
+PRIORITY_LOW = 2  # служебные: заголовки топиков, "печатает...", закрепы
+
+# Методы, которые тратят лимиты отправки
+_LIMITED_PREFIXES = ("send", "copyMessage", "forwardMessage", "editMessage", "editForumTopic",
+                     "createForumTopic", "pinChatMessage")
+_LOW_PRIORITY = {"editForumTopic", "sendChatAction", "pinChatMessage", "unpinChatMessage"}
+# Не расходуют лимит конкретного чата (Telegram считает только сообщения)
+_NO_CHAT_BUCKET = {"sendChatAction", "editForumTopic", "pinChatMessage"}
+
+_PRIORITY_NAMES = {PRIORITY_HIGH: "high", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, запас до capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до появления токена"""
+        if now < self.updated:
+            # Пауза после RetryAfter
+            return self.updated - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+class OutboundRateLimiter(BaseRateLimiter[int]):
+    """Ограничитель для Application.builder().rate_limiter(...)
+
+    rate_limit_args — число повторов после RetryAfter для конкретного вызова.
+    """
+
+    def __init__(self, global_per_second: float = 30.0, per_chat_per_second: float = 1.0,
+                 group_per_minute: float = 20.0, max_retries: int = 3, per_chat_burst: float = 3.0):
+        self.global_per_second = global_per_second
+        self.per_chat_per_second = per_chat_per_second
+        # Запас корзины чата: пара "заголовок + ответ" и короткие серии уходят без ожидания,
+        # средняя скорость остается per_chat_per_second
+        self.per_chat_burst = max(1.0, per_chat_burst)
+        self.group_per_minute = group_per_minute
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_per_second, global_per_second)
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._chat_locks: Dict[Any, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Any, int] = {}
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._queue_event: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Метрики
+        self._waiting_chat = 0
+        self._in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.retry_after_count = 0
+        self.retry_after_seconds = 0.0
+        self._waits = deque(maxlen=1000)
+        self._sent_by_priority = {name: 0 for name in _PRIORITY_NAMES.values()}
+
+    async def initialize(self) -> None:
+        if self._queue_event is None:
+            self._queue_event = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def shutdown(self) -> None:
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, fut in self._queue:
+            if not fut.done():
+                fut.cancel()
+        self._queue.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._prune_chats()
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            if is_group:
+                rate = self.group_per_minute / 60.0
+                bucket = TokenBucket(rate, max(1.0, self.group_per_minute))
+            else:
+                bucket = TokenBucket(self.per_chat_per_second, self.per_chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune_chats(self):
+        # Полные (давно не использованные) корзины ничем не отличаются от новых
+        now = time.monotonic()
+        for key, bucket in list(self._chats.items()):
+            if key not in self._chat_locks and bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity:
+                self._chats.pop(key, None)
+
+    async def _acquire_chat(self, chat_id):
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+        self._waiting_chat += 1
+        try:
+            async with lock:
+                bucket = self._chat_bucket(chat_id)
+                while True:
+                    d = bucket.delay(time.monotonic())
+                    if d <= 0:
+                        bucket.take()
+                        return
+                    await asyncio.sleep(d)
+        finally:
+            self._waiting_chat -= 1
+            left = self._chat_waiters.get(chat_id, 1) - 1
+            if left > 0:
+                self._chat_waiters[chat_id] = left
+            else:
+                self._chat_waiters.pop(chat_id, None)
+                self._chat_locks.pop(chat_id, None)
+
+    async def _acquire_global(self, priority: int):
+        if self._queue_event is None:
+            await self.initialize()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), fut))
+        self._queue_event.set()
+        await fut
+
+    async def _dispatch_loop(self):
+        """Выдает глобальные токены ожидающим запросам в порядке приоритета"""
+        while True:
+            if not self._queue:
+                self._queue_event.clear()
+                await self._queue_event.wait()
+                continue
+            d = self._global.delay(time.monotonic())
+            if d > 0:
+                await asyncio.sleep(d)
+                continue
+            _, _, fut = heapq.heappop(self._queue)
+            if fut.done():
+                continue
+            self._global.take()
+            fut.set_result(None)
+
+    @staticmethod
+    def _retry_seconds(error: RetryAfter) -> float:
+        value = getattr(error, "_retry_after", None)
+        if value is None:
+            value = error.retry_after
+        if isinstance(value, timedelta):
+            return value.total_seconds()
+        return float(value)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(_LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+        chat_id = data.get("chat_id")
+        if endpoint in _LOW_PRIORITY:
+            priority = PRIORITY_LOW
+        elif isinstance(chat_id, int) and chat_id > 0 and not endpoint.startswith("edit"):
+            priority = PRIORITY_HIGH
+        else:
+            priority = PRIORITY_NORMAL
+        max_retries = self.max_retries if rate_limit_args is None else int(rate_limit_args)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            chat_bucketed = chat_id is not None and endpoint not in _NO_CHAT_BUCKET
+            if chat_bucketed:
+                await self._acquire_chat(chat_id)
+            await self._acquire_global(priority)
+            self._waits.append(time.monotonic() - started)
+            self._in_flight += 1
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                self._sent_by_priority[_PRIORITY_NAMES[priority]] += 1
+                return result
+            except RetryAfter as e:
+                delay = self._retry_seconds(e)
+                self.retry_after_count += 1
+                self.retry_after_seconds += delay
+                if chat_id is not None:
+                    # Остальные отправки в этот чат тоже подождут
+                    self._chat_bucket(chat_id).pause(delay)
+                if attempt >= max_retries:
+                    self.failed += 1
+                    logger.warning(f"{endpoint} to {chat_id}: RetryAfter {delay}s, giving up after {attempt} retries")
+                    raise
+                attempt += 1
+                logger.info(f"{endpoint} to {chat_id}: RetryAfter {delay}s (retry {attempt}/{max_retries})")
+                if not chat_bucketed:
+                    await asyncio.sleep(delay)
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self._in_flight -= 1
+
+    def metrics(self) -> dict:
+        waits = list(self._waits)
+        by_priority = {name: 0 for name in _PRIORITY_NAMES.values()}
+        for priority, _, fut in self._queue:
+            if not fut.done():
+                by_priority[_PRIORITY_NAMES[priority]] += 1
+        return {
+            "queue_depth": sum(by_priority.values()),
+            "queue_by_priority": by_priority,
+            "waiting_for_chat": self._waiting_chat,
+            "in_flight": self._in_flight,
+            "sent": self.sent,
+            "sent_by_priority": dict(self._sent_by_priority),
+            "failed": self.failed,
+            "retry_after_count": self.retry_after_count,
+            "retry_after_seconds": round(self.retry_after_seconds, 2),
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(max(waits) * 1000, 1) if waits else 0.0,
+            "tracked_chats": len(self._chats),
+            "limits": {
+                "global_per_second": self.global_per_second,
+                "per_chat_per_second": self.per_chat_per_second,
+                "per_chat_burst": self.per_chat_burst,
+                "group_per_minute": self.group_per_minute,
+            },
+        }
@@ -0,0 +1,156 @@
+"""
+Единый кэш настроек выполнения (таблица SystemConfig поверх значений Config)
+Снимок хранится в памяти; после записи настроек версия увеличивается, подписчики
+(бот, AI) получают новый снимок сразу, другие реплики узнают об изменении через Redis
+"""
+
+import asyncio
+import json
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from modules.config import Config
+from modules.database import Database, SystemConfig
+
+try:
+    import redis.asyncio as aioredis
+except Exception:  # pragma: no cover
+    aioredis = None
+
+# Канал Redis для оповещения других реплик
+REDIS_CHANNEL = "settings:changed"
+
+
+class SettingsService:
+    """Снимок SystemConfig + версия + подписчики"""
+
+    def __init__(self, config: Config, db: Optional[Database] = None):
+        self.config = config
+        self.db = db or Database(config)
+        self.version = 0
+        self.instance_id = uuid.uuid4().hex
+        self._values: Dict[str, str] = {}
+        self._subscribers: List[Callable[[Dict[str, str]], Any]] = []
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def values(self) -> Dict[str, str]:
+        """Текущий снимок переопределений из SystemConfig (только чтение)"""
+        return self._values
+
+    def raw(self, key: str) -> Optional[str]:
+        """Переопределение из SystemConfig или None"""
+        return self._values.get(key)
+
+    def overrides(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Переопределения для набора ключей (только заданные)"""
+        return {k: self._values[k] for k in keys if k in self._values}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Значение с учетом SystemConfig, иначе из Config, иначе default"""
+        value = self._values.get(key)
+        if value is not None:
+            return value
+        return getattr(self.config, key, default)
+
+    def subscribe(self, callback: Callable[[Dict[str, str]], Any]):
+        """Подписаться на новые снимки; если снимок уже загружен, callback вызывается сразу"""
+        self._subscribers.append(callback)
+        if self.version:
+            self._notify_one(callback)
+
+    def _notify_one(self, callback):
+        try:
+            callback(self._values)
+        except Exception as e:
+            logger.error(f"Settings subscriber failed: {e}")
+
+    async def reload(self):
+        """Перечитать SystemConfig и разослать новый снимок подписчикам"""
+        rows = await SystemConfig.all()
+        self._values = {r.key: (r.value or "") for r in rows}
+        self.version += 1
+        for callback in list(self._subscribers):
+            self._notify_one(callback)
+
+    async def write(self, updates: Dict[str, Optional[Tuple[str, Optional[str]]]]):
+        """Записать форму настроек одной транзакцией и один раз сменить версию
+
+        updates: ключ -> (значение, описание) или None для удаления
+        """
+        if not updates:
+            return
+        await self.db.put_system_settings(updates)
+        await self.changed()
+
+    async def changed(self):
+        """Вызывается после записи настроек: обновить снимок локально и у других реплик"""
+        await self.reload()
+        await self._publish()
+
+    async def _publish(self):
+        if not self._redis:
+            return
+        try:
+            await self._redis.publish(REDIS_CHANNEL, json.dumps({"origin": self.instance_id, "version": self.version}))
+        except Exception as e:
+            logger.warning(f"Settings change publish failed: {e}")
+
+    async def start(self):
+        await self.reload()
+        if aioredis is None:
+            return
+        try:
+            self._redis = aioredis.Redis(
+                host=self.config.redis_host,
+                port=self.config.redis_port,
+                password=self.config.redis_password,
+                decode_responses=True,
+            )
+            await self._redis.ping()
+        except Exception as e:
+            logger.warning(f"Settings: Redis unavailable, changes stay local: {e}")
+            self._redis = None
+            return
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis:
+            try:
+                await self._redis.aclose()
+            except Exception:
+                pass
+            self._redis = None
+
+    async def _listen(self):
+        """Слушать изменения от других реплик (с переподключением)"""
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.subscribe(REDIS_CHANNEL)
+                # Пока не слушали, изменения могли пройти мимо
+                await self.reload()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        origin = json.loads(message.get("data") or "{}").get("origin")
+                    except Exception:
+                        origin = None
+                    if origin != self.instance_id:
+                        await self.reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Settings listener error: {e}")
+                await asyncio.sleep(5)
@@ -0,0 +1,114 @@
+"""
+Параллельная обработка обновлений Telegram с сохранением порядка внутри чата
+Обновления одного пользователя (или одного топика группы) идут строго по очереди,
+разные чаты обрабатываются параллельно в пределах общего лимита
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько обновлений может ждать своей очереди одновременно (защита от разрастания задач)
+MAX_PENDING_UPDATES = 4096
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """Ключ упорядочивания: топик форума, затем пользователь, затем чат"""
+    if not isinstance(update, Update):
+        return None
+    msg = update.effective_message
+    chat = update.effective_chat
+    if msg is not None and chat is not None and getattr(msg, "is_topic_message", False) and msg.message_thread_id:
+        return ("thread", chat.id, msg.message_thread_id)
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if chat is not None:
+        return ("chat", chat.id)
+    return None
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик для Application.builder().concurrent_updates(...)
+
+    Базовый семафор PTB занимается до нашего кода, поэтому он широкий (MAX_PENDING_UPDATES),
+    а реальный лимит параллельности — собственный семафор, который берется уже после
+    очереди чата: ожидающие своей очереди обновления не занимают рабочие слоты.
+    """
+
+    def __init__(self, max_concurrent: int = 16):
+        super().__init__(max_concurrent_updates=MAX_PENDING_UPDATES)
+        self.max_concurrent = max(1, int(max_concurrent))
+        self._workers = asyncio.Semaphore(self.max_concurrent)
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._lock_users: Dict[Hashable, int] = {}
+        # Метрики
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self._waits = deque(maxlen=1000)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def _run(self, coroutine: Awaitable[Any], enqueued: float, state: dict):
+        async with self._workers:
+            state["started"] = True
+            self.waiting -= 1
+            self._waits.append(time.monotonic() - enqueued)
+            self.in_flight += 1
+            try:
+                await coroutine
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        enqueued = time.monotonic()
+        state = {"started": False}
+        self.waiting += 1
+        key = update_key(update)
+        try:
+            if key is None:
+                await self._run(coroutine, enqueued, state)
+                return
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            self._lock_users[key] = self._lock_users.get(key, 0) + 1
+            try:
+                async with lock:
+                    await self._run(coroutine, enqueued, state)
+            finally:
+                left = self._lock_users.get(key, 1) - 1
+                if left > 0:
+                    self._lock_users[key] = left
+                else:
+                    self._lock_users.pop(key, None)
+                    self._locks.pop(key, None)
+        finally:
+            # Отмена до получения слота: обновление так и не начало выполняться
+            if not state["started"]:
+                self.waiting -= 1
+
+    def metrics(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "active_keys": len(self._locks),
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
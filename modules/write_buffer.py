@@ -0,0 +1,122 @@
+"""
+Буфер групповой записи сообщений (write-behind с подтверждением)
+Сообщения, пришедшие за несколько миллисекунд, записываются одной транзакцией:
+на SQLite это один fsync на пачку вместо одного на строку.
+Вызывающий получает результат только после коммита своей пачки.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteBuffer:
+    """Копит строки и отдает их write_batch пачками не реже, чем раз в max_delay секунд"""
+
+    def __init__(self, write_batch: Callable[[List[dict]], Awaitable[List[Any]]],
+                 max_delay: float = 0.005, max_batch: int = 256):
+        self.write_batch = write_batch
+        self.max_delay = max(0.0, float(max_delay))
+        self.max_batch = max(1, int(max_batch))
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._has_items: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        # Метрики
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_seen = 0
+        self.failed = 0
+
+    def _ensure_running(self):
+        if self._has_items is None:
+            self._has_items = asyncio.Event()
+            self._full = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, row: dict) -> Any:
+        """Поставить строку в очередь и дождаться коммита (результат write_batch для строки)"""
+        if self._closed:
+            raise RuntimeError("Message write buffer is closed")
+        self._ensure_running()
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((row, fut))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        # shield: отмена вызывающего не должна терять уже поставленную запись
+        return await asyncio.shield(fut)
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._closed and len(self._pending) < self.max_batch and self.max_delay:
+                # Окно группового коммита: ждем попутчиков
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            if not self._pending:
+                self._has_items.clear()
+            if batch:
+                await self._flush(batch)
+            if self._closed and not self._pending:
+                return
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            results = await self.write_batch([row for row, _ in batch])
+        except Exception as e:
+            # Одна плохая строка не должна валить всю пачку: повторяем по одной
+            logger.warning(f"Group commit of {len(batch)} messages failed, retrying one by one: {e}")
+            for row, fut in batch:
+                try:
+                    result = (await self.write_batch([row]))[0]
+                except Exception as e1:
+                    self.failed += 1
+                    if not fut.done():
+                        fut.set_exception(e1)
+                else:
+                    self._count(1)
+                    if not fut.done():
+                        fut.set_result(result)
+            return
+        self._count(len(batch))
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    def _count(self, n: int):
+        self.batches += 1
+        self.rows += n
+        self.max_batch_seen = max(self.max_batch_seen, n)
+
+    async def close(self):
+        """Остановить прием и записать все, что уже поставлено в очередь"""
+        self._closed = True
+        if self._task is None or self._task.done():
+            if self._pending:
+                batch, self._pending = self._pending, []
+                await self._flush(batch)
+            return
+        self._has_items.set()
+        self._full.set()
+        await self._task
+
+    def metrics(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch_seen,
+            "failed": self.failed,
+            "max_delay_ms": round(self.max_delay * 1000, 2),
+        }
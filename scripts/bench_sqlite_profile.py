@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Сравнение задержек пути сообщений на SQLite без профиля PRAGMA и с ним (SQLITE_TUNING)
+
+    python scripts/bench_sqlite_profile.py --messages 2000 --reads 2000 --chats 200
+
+Каждый режим работает на своей временной базе: запись add_message по одному сообщению,
+затем чтение истории чата (get_chat_messages) и списка чатов.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tortoise import Tortoise  # noqa: E402
+
+from modules.config import Config  # noqa: E402
+from modules.database import Database  # noqa: E402
+
+
+def _stats(latencies):
+    values = sorted(latencies)
+    if not values:
+        return "n/a"
+    p50 = values[len(values) // 2] * 1000
+    p99 = values[min(len(values) - 1, int(len(values) * 0.99))] * 1000
+    avg = sum(values) / len(values) * 1000
+    return f"avg={avg:.2f}ms p50={p50:.2f}ms p99={p99:.2f}ms"
+
+
+async def run(tuned: bool, args, tmpdir: str):
+    path = os.path.join(tmpdir, f"{'tuned' if tuned else 'baseline'}.sqlite3")
+    config = Config(DATABASE_URL=f"sqlite://{path}", SQLITE_TUNING=tuned, SQLITE_MAINTENANCE_INTERVAL=0,
+                    DB_WRITE_BUFFER=False)
+    db = Database(config)
+    await db.initialize()
+    conn = Tortoise.get_connection("default")
+    pragmas = {}
+    for name in ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "busy_timeout"):
+        row = await conn.execute_query_dict(f"PRAGMA {name}")
+        pragmas[name] = list(row[0].values())[0] if row else None
+
+    chats = [await db.create_chat(user_id=800000 + i, first_name=f"Bench{i}") for i in range(args.chats)]
+
+    writes = []
+    for i in range(args.messages):
+        chat = chats[i % len(chats)]
+        t = time.perf_counter()
+        await db.add_message(chat.id, chat.user_id, f"bench message {i} " + "x" * random.randint(10, 200), "user")
+        writes.append(time.perf_counter() - t)
+
+    history = []
+    for _ in range(args.reads):
+        chat = random.choice(chats)
+        t = time.perf_counter()
+        await db.get_chat_messages(chat.id, limit=20)
+        history.append(time.perf_counter() - t)
+
+    listing = []
+    for _ in range(max(1, args.reads // 20)):
+        t = time.perf_counter()
+        await db.get_all_chats()
+        listing.append(time.perf_counter() - t)
+
+    await db.close()
+    return pragmas, writes, history, listing
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--dir", default="", help="Каталог для временных баз (по умолчанию /tmp)")
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp(prefix="bench_sqlite_", dir=args.dir or None)
+
+    for tuned in (False, True):
+        pragmas, writes, history, listing = await run(tuned, args, tmpdir)
+        print(f"== {'tuned' if tuned else 'baseline'}: " + ", ".join(f"{k}={v}" for k, v in pragmas.items()))
+        print(f"   add_message       {_stats(writes)}  ({len(writes) / sum(writes):.0f} msg/s)")
+        print(f"   get_chat_messages {_stats(history)}")
+        print(f"   get_all_chats     {_stats(listing)}")
+    print(f"SQLite files: {tmpdir}")
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Построение полнотекстового индекса сообщений (messages и messages_archive) в PostgreSQL без остановки сервиса
+
+    python scripts/build_search_index.py
+    python scripts/build_search_index.py --batch-size 2000 --pause 0.1
+
+Заполняет search_tsv у существующих строк короткими пачками и строит GIN-индекс
+через CREATE INDEX CONCURRENTLY. Новые строки заполняет триггер, поэтому запуск можно
+прервать и повторить. После завершения перезапустите приложение, чтобы поиск перешел на индекс.
+На SQLite ничего не делает: FTS5 строится при старте.
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.config import Config  # noqa: E402
+from modules.database import MESSAGE_TABLES, Database  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="", help="По умолчанию DATABASE_URL из окружения")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--pause", type=float, default=0.05, help="Пауза между пачками, сек")
+    args = parser.parse_args()
+
+    overrides = {"DB_WRITE_BUFFER": False, "SQLITE_MAINTENANCE_INTERVAL": 0}
+    if args.database_url:
+        overrides["DATABASE_URL"] = args.database_url
+    db = Database(Config(**overrides))
+    await db.initialize()
+    for table in MESSAGE_TABLES:
+        print(await db.build_message_search_index(table, batch_size=args.batch_size, pause=args.pause))
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Компактизация хранения сообщений: одна колонка текста вместо content + text
+
+    python scripts/compact_messages.py                      # БД из DATABASE_URL
+    python scripts/compact_messages.py --drop-column --vacuum
+    python scripts/compact_messages.py --demo 20000         # временная SQLite-база со старой схемой
+
+Убирает метки "[photo] " из content, очищает дублирующую колонку text (по желанию удаляет ее),
+печатает размер до/после и скорость чтения истории чата до/после.
+Запуск идемпотентен: прерванную компактизацию можно запустить повторно.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from tortoise import Tortoise  # noqa: E402
+
+from modules.config import Config  # noqa: E402
+from modules.database import Chat, Database  # noqa: E402
+
+
+def _size_line(size: dict) -> str:
+    parts = [f"messages={size['messages']}", f"text payload={size['text_payload_bytes'] / 1024:.0f} KiB"]
+    if "used_bytes" in size:
+        parts.append(f"file={size['file_bytes'] / 1024:.0f} KiB (used {size['used_bytes'] / 1024:.0f} KiB)")
+    if "table_bytes" in size:
+        parts.append(f"table={size['table_bytes'] / 1024:.0f} KiB")
+    parts.append(f"text column={'yes' if size['text_column'] else 'no'}")
+    return ", ".join(parts)
+
+
+async def bench_history(db: Database, reads: int, limit: int = 50) -> str:
+    chat_ids = await Chat.all().values_list("id", flat=True)
+    if not chat_ids or reads <= 0:
+        return "n/a"
+    latencies = []
+    for _ in range(reads):
+        chat_id = random.choice(chat_ids)
+        t = time.perf_counter()
+        messages = await db.get_chat_messages(chat_id, limit=limit)
+        _ = [m.display_text for m in messages]
+        latencies.append(time.perf_counter() - t)
+    latencies.sort()
+    avg = sum(latencies) / len(latencies) * 1000
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    return f"avg={avg:.2f}ms p50={p50:.2f}ms p99={p99:.2f}ms"
+
+
+async def seed_legacy(db: Database, messages: int, chats: int):
+    """Заполнить базу строками в старом формате: метка медиа в content и копия в text"""
+    conn = Tortoise.get_connection("default")
+    await conn.execute_script("ALTER TABLE messages ADD COLUMN text TEXT")
+    chat_list = [await db.create_chat(user_id=700000 + i, first_name=f"Demo{i}") for i in range(chats)]
+    rows = []
+    for i in range(messages):
+        chat = chat_list[i % len(chat_list)]
+        media_type = random.choice([None, None, None, "photo", "document", "voice"])
+        body = f"demo message {i} " + "x" * random.randint(20, 300)
+        content = f"[{media_type}] {body}" if media_type else body
+        rows.append((chat.id, chat.user_id, "user", content, content, media_type))
+    await conn.execute_many(
+        "INSERT INTO messages (chat_id, user_id, message_type, content, text, media_type, source, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, 'user', datetime('now'))",
+        [list(r) for r in rows],
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="", help="По умолчанию DATABASE_URL из окружения")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop-column", action="store_true", help="Удалить колонку text после очистки")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM после компактизации (вернуть место ОС)")
+    parser.add_argument("--reads", type=int, default=500, help="Чтений истории для замера до/после (0 — без замера)")
+    parser.add_argument("--demo", type=int, default=0, help="Создать временную SQLite-базу со старой схемой на N сообщений")
+    parser.add_argument("--demo-chats", type=int, default=200)
+    args = parser.parse_args()
+
+    overrides = {"DB_WRITE_BUFFER": False, "SQLITE_MAINTENANCE_INTERVAL": 0}
+    if args.demo:
+        tmpdir = tempfile.mkdtemp(prefix="compact_messages_")
+        overrides["DATABASE_URL"] = f"sqlite://{os.path.join(tmpdir, 'demo.sqlite3')}"
+    elif args.database_url:
+        overrides["DATABASE_URL"] = args.database_url
+    db = Database(Config(**overrides))
+    await db.initialize()
+    if args.demo:
+        await seed_legacy(db, args.demo, args.demo_chats)
+        print(f"Demo database: {overrides['DATABASE_URL']}")
+
+    before = await db.message_storage_size()
+    print(f"before:  {_size_line(before)}")
+    print(f"         history read {await bench_history(db, args.reads)}")
+
+    started = time.perf_counter()
+    stats = await db.compact_message_storage(batch_size=args.batch_size, drop_text_column=args.drop_column)
+    print(f"compacted in {time.perf_counter() - started:.2f}s: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+    if args.vacuum:
+        conn = Tortoise.get_connection("default")
+        await conn.execute_script("VACUUM" if db.dialect == "sqlite" else "VACUUM ANALYZE messages")
+
+    after = await db.message_storage_size()
+    print(f"after:   {_size_line(after)}")
+    print(f"         history read {await bench_history(db, args.reads)}")
+    saved = before["text_payload_bytes"] - after["text_payload_bytes"]
+    print(f"text payload reclaimed: {saved / 1024:.0f} KiB ({saved / max(1, before['text_payload_bytes']) * 100:.1f}%)")
+    if "used_bytes" in before:
+        print(f"SQLite file: {before['file_bytes'] / 1024:.0f} KiB -> {after['file_bytes'] / 1024:.0f} KiB")
+    if "table_bytes" in before:
+        print(f"messages table: {before['table_bytes'] / 1024:.0f} KiB -> {after['table_bytes'] / 1024:.0f} KiB")
+    await db.close()
+    await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
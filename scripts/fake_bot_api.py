@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Локальная заглушка Telegram Bot API и нагрузочный тест приема обновлений
+
+Сервер:
+    python scripts/fake_bot_api.py serve --port 8081
+    # в .env приложения: TELEGRAM_API_BASE_URL=http://localhost:8081
+    #                    TELEGRAM_WEBHOOK_URL=http://localhost:8080 (или пусто для поллинга)
+
+Нагрузка на webhook приложения:
+    python scripts/fake_bot_api.py bench --webhook http://localhost:8080/telegram/webhook \\
+        --count 5000 --concurrency 50 --stats http://localhost:8081
+
+Секрет webhook берется из --secret, иначе выводится из --token (как в боте при пустом
+TELEGRAM_WEBHOOK_SECRET), иначе читается из /_stats заглушки, куда его передал setWebhook.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from modules.config import derive_webhook_secret  # noqa: E402
+
+FAKE_FILE = b"\x89PNG\r\n\x1a\n" + b"\x00" * 1024
+
+
+class FakeBotApi:
+    """Минимальная реализация методов Bot API, которые использует бот"""
+
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+        self.thread_ids = itertools.count(1000)
+        self.update_ids = itertools.count(1)
+        self.calls = Counter()
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.webhook = {"url": "", "secret": ""}
+        self.started = time.monotonic()
+
+    def _chat(self, chat_id):
+        chat_id = int(chat_id) if str(chat_id).lstrip("-").isdigit() else 1
+        return {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup", "is_forum": chat_id < 0}
+
+    def _message(self, params: dict, **extra) -> dict:
+        msg = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(params.get("chat_id", 1)),
+            "from": {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"},
+        }
+        if params.get("text"):
+            msg["text"] = params["text"]
+        if params.get("caption"):
+            msg["caption"] = params["caption"]
+        if params.get("message_thread_id"):
+            msg["message_thread_id"] = int(params["message_thread_id"])
+        msg.update(extra)
+        return msg
+
+    def _file(self, prefix: str) -> dict:
+        n = next(self.message_ids)
+        return {"file_id": f"{prefix}-{n}", "file_unique_id": f"u{prefix}{n}", "file_size": len(FAKE_FILE)}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            else:
+                form = await request.post()
+                for k, v in form.items():
+                    params[k] = v if isinstance(v, str) else "<file>"
+        self.calls[method] += 1
+        result = await self.dispatch(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def dispatch(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": True, "supports_inline_queries": False}
+        if method == "getUpdates":
+            timeout = float(params.get("timeout") or 0)
+            batch = []
+            try:
+                batch.append(await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01)))
+            except asyncio.TimeoutError:
+                return []
+            while not self.updates.empty() and len(batch) < 100:
+                batch.append(self.updates.get_nowait())
+            return batch
+        if method == "setWebhook":
+            self.webhook = {"url": params.get("url", ""), "secret": params.get("secret_token", "")}
+            return True
+        if method == "deleteWebhook":
+            self.webhook = {"url": "", "secret": ""}
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook["url"], "has_custom_certificate": False, "pending_update_count": self.updates.qsize()}
+        if method == "createForumTopic":
+            return {"message_thread_id": next(self.thread_ids), "name": params.get("name", ""), "icon_color": 7322096}
+        if method == "getFile":
+            return {"file_id": params.get("file_id"), "file_unique_id": "u" + str(params.get("file_id")),
+                    "file_size": len(FAKE_FILE), "file_path": "photos/file.png"}
+        if method == "getUserProfilePhotos":
+            return {"total_count": 0, "photos": []}
+        if method == "sendPhoto":
+            photo = self._file("photo")
+            return self._message(params, photo=[{**photo, "width": 1, "height": 1}])
+        for kind in ("video", "audio", "voice", "document"):
+            if method == "send" + kind.capitalize():
+                extra = {"duration": 1} if kind in ("video", "audio", "voice") else {}
+                if kind == "video":
+                    extra.update({"width": 1, "height": 1})
+                return self._message(params, **{kind: {**self._file(kind), **extra}})
+        if method == "copyMessage":
+            return {"message_id": next(self.message_ids)}
+        if method.startswith("send") or method == "forwardMessage":
+            return self._message(params)
+        if method.startswith("editMessage"):
+            return self._message(params)
+        # editForumTopic, pinChatMessage, sendChatAction, answerCallbackQuery и т.п.
+        return True
+
+    def make_update(self, user_id: int, text: str) -> dict:
+        return {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+                "text": text,
+            },
+        }
+
+    async def inject(self, request: web.Request) -> web.Response:
+        """Положить N обновлений в очередь getUpdates"""
+        count = int(request.query.get("count", "1"))
+        users = int(request.query.get("users", "100"))
+        for i in range(count):
+            await self.updates.put(self.make_update(100000 + random.randrange(users), f"message {i}"))
+        return web.json_response({"ok": True, "queued": self.updates.qsize()})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "uptime": round(time.monotonic() - self.started, 1),
+            "calls": dict(self.calls),
+            "sent": sum(v for k, v in self.calls.items() if k.startswith("send") or k == "copyMessage"),
+            "pending_updates": self.updates.qsize(),
+            "webhook": self.webhook["url"],
+            "webhook_secret": self.webhook["secret"],
+        })
+
+    async def file(self, request: web.Request) -> web.Response:
+        return web.Response(body=FAKE_FILE, content_type="application/octet-stream")
+
+
+def serve(args):
+    api = FakeBotApi()
+    app = web.Application(client_max_size=100 * 1024 * 1024)
+    app.router.add_route("*", "/bot{token}/{method}", api.handle)
+    app.router.add_get("/file/bot{token}/{path:.*}", api.file)
+    app.router.add_post("/_inject", api.inject)
+    app.router.add_get("/_stats", api.stats)
+    print(f"Fake Bot API on http://{args.host}:{args.port} (stats: /_stats)")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def bench(args):
+    api = FakeBotApi()
+    updates = [api.make_update(100000 + random.randrange(args.users), f"bench {i}") for i in range(args.count)]
+    if args.duplicates:
+        updates += random.sample(updates, min(args.duplicates, len(updates)))
+        random.shuffle(updates)
+    latencies, statuses = [], Counter()
+    queue: asyncio.Queue = asyncio.Queue()
+    for u in updates:
+        queue.put_nowait(u)
+
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        sent_before = 0
+        secret = args.secret or (derive_webhook_secret(args.token) if args.token else "")
+        if args.stats:
+            async with session.get(args.stats.rstrip("/") + "/_stats") as r:
+                stats = await r.json()
+            sent_before = stats["sent"]
+            secret = secret or stats.get("webhook_secret", "")
+        if not secret:
+            raise SystemExit("Webhook secret unknown: pass --secret, --token or --stats of the stub the bot registered with")
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret, "Content-Type": "application/json"}
+
+        async def worker():
+            while not queue.empty():
+                u = queue.get_nowait()
+                t = time.perf_counter()
+                try:
+                    async with session.post(args.webhook, data=json.dumps(u), headers=headers) as r:
+                        statuses[r.status] += 1
+                        await r.read()
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - t)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        accepted = time.perf_counter() - started
+
+        print(f"Webhook: {len(updates)} requests in {accepted:.2f}s -> {len(updates) / accepted:.0f} req/s")
+        print(f"Latency: p50={_percentile(latencies, 0.5) * 1000:.1f}ms p99={_percentile(latencies, 0.99) * 1000:.1f}ms")
+        print(f"Statuses: {dict(statuses)}")
+
+        if args.stats:
+            # Ждем, пока бот отправит ответы (изменение счетчика send* на заглушке)
+            last, idle_since = sent_before, time.perf_counter()
+            while time.perf_counter() - idle_since < args.settle:
+                await asyncio.sleep(0.5)
+                async with session.get(args.stats.rstrip("/") + "/_stats") as r:
+                    sent = (await r.json())["sent"]
+                if sent != last:
+                    last, idle_since = sent, time.perf_counter()
+            total = time.perf_counter() - started - args.settle
+            print(f"Bot API sends: {last - sent_before} in {total:.2f}s -> {(last - sent_before) / max(total, 1e-9):.0f}/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="Запустить заглушку Bot API")
+    p_serve.add_argument("--host", default="127.0.0.1")
+    p_serve.add_argument("--port", type=int, default=8081)
+    p_bench = sub.add_parser("bench", help="Нагрузить webhook приложения")
+    p_bench.add_argument("--webhook", default="http://127.0.0.1:8080/telegram/webhook")
+    p_bench.add_argument("--secret", default="", help="TELEGRAM_WEBHOOK_SECRET приложения")
+    p_bench.add_argument("--token", default="", help="Токен бота, если секрет не задан и выводится из него")
+    p_bench.add_argument("--count", type=int, default=1000)
+    p_bench.add_argument("--users", type=int, default=100)
+    p_bench.add_argument("--duplicates", type=int, default=0, help="Сколько update_id отправить повторно")
+    p_bench.add_argument("--concurrency", type=int, default=20)
+    p_bench.add_argument("--stats", default="", help="Адрес заглушки для подсчета ответов бота")
+    p_bench.add_argument("--settle", type=float, default=3.0, help="Сколько секунд без новых отправок считать завершением")
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""Очередь ИИ: сообщение во время доставки ответа начинает новую серию"""
+
+import asyncio
+import unittest
+
+from modules.ai_jobs import AIJob, AIJobQueue
+
+
+class DeliveryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.answered = []
+        self.delivering = asyncio.Event()
+        self.queue = AIJobQueue(self._handler, workers=2)
+        await self.queue.start()
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+
+    async def _handler(self, job: AIJob):
+        # Как SupportBot._run_ai_job: генерация, проверка актуальности и неотменяемая доставка
+        await asyncio.sleep(0.01)
+        if not self.queue.begin_delivery(job):
+            return
+        await asyncio.shield(self._deliver(job))
+
+    async def _deliver(self, job: AIJob):
+        self.delivering.set()
+        await asyncio.sleep(0.05)
+        self.answered.append(job.parts)
+
+    async def test_enqueue_during_delivery_starts_new_series(self):
+        self.queue.enqueue(AIJob(chat_id=1, user_id=1, text="first"))
+        await asyncio.wait_for(self.delivering.wait(), 1)
+        self.queue.enqueue(AIJob(chat_id=1, user_id=1, text="second"))
+        await asyncio.wait_for(self.queue._queue.join(), 1)
+        await asyncio.sleep(0.1)
+        self.assertEqual(sorted(self.answered), [["first"], ["second"]])
+
+    async def test_enqueue_before_delivery_coalesces(self):
+        self.queue.enqueue(AIJob(chat_id=1, user_id=1, text="first"))
+        self.queue.enqueue(AIJob(chat_id=1, user_id=1, text="second"))
+        await asyncio.wait_for(self.queue._queue.join(), 1)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.answered, [["first", "second"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -34,7 +34,7 @@ SPA_DIR = STATIC_DIR / "spa"
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
 # Подключение роутеров
-from web.routers import auth, dashboard, chats, ws, api_auth, api_chats, api_users, api_settings, api_branding, api_kb
+from web.routers import auth, dashboard, chats, ws, api_auth, api_chats, api_users, api_settings, api_branding, api_kb, api_search, api_metrics, telegram_webhook
 app.include_router(auth.router)
 app.include_router(dashboard.router)
 app.include_router(chats.router)
@@ -45,6 +45,9 @@ app.include_router(api_users.router)
 app.include_router(api_settings.router)
 app.include_router(api_branding.router)
 app.include_router(api_kb.router)
+app.include_router(api_search.router)
+app.include_router(api_metrics.router)
+app.include_router(telegram_webhook.router)
 
 if SPA_DIR.exists():
     app.mount("/", StaticFiles(directory=str(SPA_DIR), html=True), name="spa")
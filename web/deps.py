@@ -1,24 +1,83 @@
+import hashlib
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
 from fastapi import Request, HTTPException, status, Depends
 from jose import jwt, JWTError
 from web.utils import SECRET_KEY, ALGORITHM
 from modules.database import AdminUser
+from modules.settings_service import SettingsService
 from datetime import datetime
 
+# Кэш принципалов: ключ — ID токена (jti), значение — (истекает_в, пользователь)
+PRINCIPAL_CACHE_TTL = 30.0
+PRINCIPAL_CACHE_MAX = 1024
+_principal_cache: Dict[str, Tuple[float, AdminUser]] = {}
+
+# Ограничение одновременных попыток входа (на IP и на имя пользователя)
+LOGIN_MAX_CONCURRENT_PER_KEY = 2
+_login_inflight: Dict[str, int] = {}
+
+
+def _token_key(payload: dict, raw_token: str) -> str:
+    # Старые токены выпущены без jti — используем хэш самого токена
+    jti = payload.get("jti")
+    if jti:
+        return f"jti:{jti}"
+    return "sha:" + hashlib.sha256(raw_token.encode("utf-8")).hexdigest()
+
+
+def invalidate_principal(user_id: Optional[int] = None):
+    """Сбросить кэш принципалов (всех или одного пользователя)"""
+    if user_id is None:
+        _principal_cache.clear()
+        return
+    for key, (_, cached) in list(_principal_cache.items()):
+        if cached.id == user_id:
+            _principal_cache.pop(key, None)
+
+
+async def resolve_token_user(token: str) -> Optional[AdminUser]:
+    """Декодировать JWT из cookie и вернуть пользователя (с коротким кэшем)"""
+    scheme, _, param = token.partition(" ")
+    payload = jwt.decode(param, SECRET_KEY, algorithms=[ALGORITHM])
+    username = payload.get("sub")
+    if not username:
+        raise JWTError("Token has no subject")
+    key = _token_key(payload, param)
+    now = time.monotonic()
+    cached = _principal_cache.get(key)
+    if cached and cached[0] > now and cached[1].username == username:
+        return cached[1]
+    user = await AdminUser.get_or_none(username=username)
+    if user is None:
+        _principal_cache.pop(key, None)
+        return None
+    if len(_principal_cache) >= PRINCIPAL_CACHE_MAX:
+        for k, (expires, _) in list(_principal_cache.items()):
+            if expires <= now:
+                _principal_cache.pop(k, None)
+        if len(_principal_cache) >= PRINCIPAL_CACHE_MAX:
+            _principal_cache.clear()
+    _principal_cache[key] = (now + PRINCIPAL_CACHE_TTL, user)
+    return user
+
+
+def get_settings(request: Request) -> SettingsService:
+    """Общий кэш настроек выполнения (создается в main.py)"""
+    return request.app.state.settings
+
+
 async def get_current_user(request: Request):
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    
+
     try:
-        scheme, _, param = token.partition(" ")
-        payload = jwt.decode(param, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+        user = await resolve_token_user(token)
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    
-    user = await AdminUser.get_or_none(username=username)
+
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
@@ -38,5 +97,25 @@ async def get_current_user(request: Request):
             allowed = now_h >= start or now_h < end
         if not allowed:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Access time restricted")
-    
+
     return user
+
+
+@asynccontextmanager
+async def login_slot(request: Request, username: str):
+    """Слот для попытки входа; 429, если с этого IP/для этого логина уже идут проверки"""
+    ip = request.client.host if request.client else "unknown"
+    keys = [f"ip:{ip}", f"user:{(username or '').lower()}"]
+    if any(_login_inflight.get(k, 0) >= LOGIN_MAX_CONCURRENT_PER_KEY for k in keys):
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many login attempts")
+    for k in keys:
+        _login_inflight[k] = _login_inflight.get(k, 0) + 1
+    try:
+        yield
+    finally:
+        for k in keys:
+            left = _login_inflight.get(k, 1) - 1
+            if left > 0:
+                _login_inflight[k] = left
+            else:
+                _login_inflight.pop(k, None)
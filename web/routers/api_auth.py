@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Request, status, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from modules.database import AdminUser
-from web.utils import verify_password, create_access_token, get_password_hash
-from web.deps import get_current_user
+from web.utils import verify_password_async, create_access_token, get_password_hash_async
+from web.deps import get_current_user, invalidate_principal, login_slot
 from datetime import datetime
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
@@ -14,9 +14,10 @@ async def api_login(request: Request):
     password = body.get("password")
     if not username or not password:
         raise HTTPException(status_code=400, detail="username/password required")
-    user = await AdminUser.get_or_none(username=username)
-    if not user or not verify_password(password, user.password_hash):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+    async with login_slot(request, username):
+        user = await AdminUser.get_or_none(username=username)
+        if not user or not await verify_password_async(password, user.password_hash):
+            raise HTTPException(status_code=401, detail="Invalid credentials")
     if not user.is_active:
         raise HTTPException(status_code=403, detail="User blocked")
     start = getattr(user, "access_start_hour", None)
@@ -67,12 +68,13 @@ async def api_change_password(request: Request, user: AdminUser = Depends(get_cu
     new_password = body.get("new_password")
     if not old_password or not new_password:
         raise HTTPException(status_code=400, detail="old_password/new_password required")
-    if not verify_password(old_password, user.password_hash):
+    if not await verify_password_async(old_password, user.password_hash):
         raise HTTPException(status_code=400, detail="Invalid old password")
     if len(new_password) < 8:
         raise HTTPException(status_code=400, detail="Password too short")
-    user.password_hash = get_password_hash(new_password)
+    user.password_hash = await get_password_hash_async(new_password)
     await user.save()
+    invalidate_principal(user.id)
     return {"ok": True}
 
 
@@ -91,6 +93,7 @@ async def api_change_username(request: Request, user: AdminUser = Depends(get_cu
         raise HTTPException(status_code=400, detail="Username already taken")
     user.username = new_username
     await user.save()
+    invalidate_principal(user.id)
     token = create_access_token(data={"sub": user.username, "role": user.role})
     resp = JSONResponse({"ok": True})
     resp.set_cookie(
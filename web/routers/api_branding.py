@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File
 from fastapi.responses import FileResponse
-from modules.config import Config
-from modules.database import AdminUser, SystemConfig
-from web.deps import get_current_user
+from modules.database import AdminUser
+from modules.settings_service import SettingsService
+from web.deps import get_current_user, get_settings
 from pathlib import Path
 import time
 
@@ -15,11 +15,9 @@ def _require_admin(user: AdminUser):
 
 
 @router.get("")
-async def get_branding(request: Request):
-    config = Config()
-    keys = ["brand_name", "brand_tagline", "brand_logo_url"]
-    rows = await SystemConfig.filter(key__in=keys).all()
-    values = {r.key: r.value for r in rows}
+async def get_branding(request: Request, settings: SettingsService = Depends(get_settings)):
+    config = settings.config
+    values = settings.overrides(["brand_name", "brand_tagline", "brand_logo_url"])
     logo_url = (values.get("brand_logo_url") or "").strip()
     if logo_url.startswith("/static/uploads/branding/"):
         logo_url = f"/api/branding/logo/{Path(logo_url).name}"
@@ -31,7 +29,7 @@ async def get_branding(request: Request):
 
 
 @router.put("")
-async def update_branding(request: Request, user: AdminUser = Depends(get_current_user)):
+async def update_branding(request: Request, user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     body = await request.json()
     name = (body.get("name") or "").strip()
@@ -39,14 +37,16 @@ async def update_branding(request: Request, user: AdminUser = Depends(get_curren
     logo_url = (body.get("logo_url") or "").strip()
     if not name:
         raise HTTPException(status_code=400, detail="name required")
-    await SystemConfig.update_or_create(key="brand_name", defaults={"value": name, "description": "Название панели"})
-    await SystemConfig.update_or_create(key="brand_tagline", defaults={"value": tagline, "description": "Подзаголовок/слоган"})
-    await SystemConfig.update_or_create(key="brand_logo_url", defaults={"value": logo_url, "description": "URL логотипа"})
+    await settings.write({
+        "brand_name": (name, "Название панели"),
+        "brand_tagline": (tagline, "Подзаголовок/слоган"),
+        "brand_logo_url": (logo_url, "URL логотипа"),
+    })
     return {"ok": True}
 
 
 @router.post("/logo")
-async def upload_logo(file: UploadFile = File(...), user: AdminUser = Depends(get_current_user)):
+async def upload_logo(file: UploadFile = File(...), user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     content_type = (file.content_type or "").lower()
     ext = None
@@ -67,7 +67,7 @@ async def upload_logo(file: UploadFile = File(...), user: AdminUser = Depends(ge
     data = await file.read()
     out_path.write_bytes(data)
     url = f"/api/branding/logo/{out_path.name}"
-    await SystemConfig.update_or_create(key="brand_logo_url", defaults={"value": url, "description": "URL логотипа"})
+    await settings.write({"brand_logo_url": (url, "URL логотипа")})
     return {"ok": True, "logo_url": url}
 
 
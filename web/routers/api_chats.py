@@ -1,24 +1,92 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File, Form
-from fastapi.responses import Response
-from modules.database import Chat, Message, AdminUser
+from fastapi.responses import Response, FileResponse, StreamingResponse
+from modules.database import Chat, Message, ArchivedMessage, AdminUser, Database, message_display_text
+from modules.media_cache import CachedMedia
 from web.deps import get_current_user
 from modules.bot import SupportBot
+from telegram import InputFile
 from telegram.constants import ParseMode
 from tortoise.expressions import Q
+from tortoise.functions import Count
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import base64
+import csv
 import io
+import json
+import time
 
 router = APIRouter(prefix="/api/chats", tags=["chats"])
 
+def _encode_chat_cursor(chat: Chat) -> str:
+    if chat.last_message_at:
+        raw = f"t|{chat.last_message_at.isoformat()}|{chat.id}"
+    else:
+        raw = f"n||{chat.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_chat_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        kind, ts, cid = raw.split("|", 2)
+        return kind, (datetime.fromisoformat(ts) if kind == "t" else None), int(cid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _page_chats(qs, cursor: Optional[str], limit: int) -> List[Chat]:
+    """Страница чатов по (last_message_at DESC, id DESC); чаты без сообщений идут в конце"""
+    kind, ts, cid = _decode_chat_cursor(cursor) if cursor else ("t", None, None)
+    out: List[Chat] = []
+    if kind == "t":
+        dated = qs.filter(last_message_at__isnull=False)
+        if ts is not None:
+            dated = dated.filter(Q(last_message_at__lt=ts) | Q(last_message_at=ts, id__lt=cid))
+        out = list(await dated.order_by("-last_message_at", "-id").limit(limit + 1))
+        cid = None
+    if len(out) <= limit:
+        undated = qs.filter(last_message_at__isnull=True)
+        if cid is not None:
+            undated = undated.filter(id__lt=cid)
+        out += list(await undated.order_by("-id").limit(limit + 1 - len(out)))
+    return out
+
+
 @router.get("")
-async def list_chats(user: AdminUser = Depends(get_current_user), status: str = Query(None), q: str = Query(None)):
-    qs = Chat.all().order_by("-updated_at")
+async def list_chats(
+    request: Request,
+    user: AdminUser = Depends(get_current_user),
+    status: str = Query(None),
+    q: str = Query(None),
+    cursor: str = Query(None),
+    limit: int = Query(50),
+    paged: bool = Query(False),
+):
+    limit = max(1, min(limit, 200))
+    db: Database = request.app.state.db
+    qs = Chat.all().using_db(db.read_db)
+    if q and q.strip():
+        qv = q.strip()
+        hit = db.chat_search_filter(qv)
+        if hit is not None:
+            qs = qs.annotate(search_hit=hit).filter(search_hit=True)
+        else:
+            cond = Q(username__icontains=qv) | Q(first_name__icontains=qv) | Q(last_name__icontains=qv)
+            if qv.isdigit():
+                cond = cond | Q(user_id=int(qv))
+            qs = qs.filter(cond)
+    counts = {}
+    if paged:
+        rows = await qs.annotate(n=Count("id")).group_by("status").values("status", "n")
+        counts = {r["status"]: r["n"] for r in rows}
     if status:
         qs = qs.filter(status=status)
-    if q:
-        qv = q.strip()
-        qs = qs.filter(Q(username__icontains=qv) | Q(first_name__icontains=qv) | Q(last_name__icontains=qv))
-    chats = await qs.limit(50)
-    return [
+    chats = await _page_chats(qs, cursor, limit)
+    next_cursor = _encode_chat_cursor(chats[limit - 1]) if len(chats) > limit else None
+    chats = chats[:limit]
+    unread = await db.get_unread_counts(chats, user.id)
+    items = [
         {
             "id": c.id,
             "user_id": c.user_id,
@@ -30,10 +98,169 @@ async def list_chats(user: AdminUser = Depends(get_current_user), status: str =
             "manager_id": c.manager_id,
             "assigned_admin_id": c.assigned_admin_id,
             "last_message_at": c.last_message_at.isoformat() if c.last_message_at else None,
+            "last_message_preview": c.last_message_preview,
+            "unread_count": unread.get(c.id, 0),
             "updated_at": c.updated_at.isoformat(),
         }
         for c in chats
     ]
+    if not paged:
+        return items
+    # Конверт с курсором и сводкой по статусам (сводка учитывает поиск, но не фильтр статуса)
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "counts": {**counts, "all": sum(counts.values())},
+        "total": counts.get(status, 0) if status else sum(counts.values()),
+    }
+
+
+EXPORT_MESSAGE_FIELDS = (
+    "id", "chat_id", "user_id", "message_type", "source", "content", "media_type", "media_file_id",
+    "admin_user_id", "created_at",
+)
+EXPORT_CHAT_FIELDS = ("user_id", "username", "first_name", "last_name", "status")
+EXPORT_RECORD_COLUMNS = (
+    "id", "chat_id", "created_at", "source", "message_type", "user_id", "admin_user_id", "text",
+    "media_type", "media_file_id", "archived",
+)
+EXPORT_CSV_COLUMNS = EXPORT_RECORD_COLUMNS + tuple(f"chat_{k}" for k in EXPORT_CHAT_FIELDS)
+# С этих символов табличные редакторы начинают формулу
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _parse_export_date(value: Optional[str], name: str, end: bool = False) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be ISO date or datetime")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    # Дата без времени в date_to включает весь день
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+async def _export_batches(db: Database, filters: dict, after_id: int, batch_size: int):
+    """Сообщения (живые и архивные) по возрастанию id пачками по batch_size (keyset, память постоянна)"""
+    last_id = after_id
+    while True:
+        rows = []
+        for model, archived in ((Message, False), (ArchivedMessage, True)):
+            part = await (
+                model.filter(id__gt=last_id, **filters).using_db(db.read_db)
+                .order_by("id").limit(batch_size).values(*EXPORT_MESSAGE_FIELDS)
+            )
+            for row in part:
+                row["archived"] = archived
+            rows += part
+        if not rows:
+            return
+        # Из двух таблиц берем первые batch_size по id; остальное придет в следующей пачке
+        rows.sort(key=lambda r: r["id"])
+        rows = rows[:batch_size]
+        last_id = rows[-1]["id"]
+        chats = {
+            c["id"]: c
+            for c in await Chat.filter(id__in={r["chat_id"] for r in rows}).using_db(db.read_db).values("id", *EXPORT_CHAT_FIELDS)
+        }
+        yield rows, chats
+
+
+def _csv_cell(value):
+    """Текст клиента не должен выполниться формулой при открытии CSV в таблице"""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _export_record(row: dict, chat: Optional[dict]) -> dict:
+    return {
+        "id": row["id"],
+        "chat_id": row["chat_id"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+        "source": row["source"] or row["message_type"],
+        "message_type": row["message_type"],
+        "user_id": row["user_id"],
+        "admin_user_id": row["admin_user_id"],
+        "text": message_display_text(row["content"], row["media_type"]),
+        "media_type": row["media_type"],
+        "media_file_id": row["media_file_id"],
+        "archived": row["archived"],
+        "chat": {k: chat.get(k) for k in EXPORT_CHAT_FIELDS} if chat else None,
+    }
+
+
+@router.get("/export")
+async def export_chats(
+    request: Request,
+    user: AdminUser = Depends(get_current_user),
+    format: str = Query("ndjson"),
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    status: str = Query(None),
+    chat_id: int = Query(None),
+    after_id: int = Query(0),
+    batch_size: int = Query(1000),
+):
+    """Выгрузка переписок построчно (сообщение на строку) в NDJSON или CSV
+
+    Строки идут по возрастанию id сообщения; после обрыва выгрузку можно продолжить с after_id=<последний id>.
+    """
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    filters = {}
+    start = _parse_export_date(date_from, "date_from")
+    end = _parse_export_date(date_to, "date_to", end=True)
+    if start:
+        filters["created_at__gte"] = start
+    if end:
+        filters["created_at__lt"] = end
+    if status:
+        filters["chat__status"] = status
+    if chat_id:
+        filters["chat_id"] = chat_id
+    batch_size = max(1, min(batch_size, 5000))
+    db: Database = request.app.state.db
+
+    async def ndjson():
+        async for rows, chats in _export_batches(db, filters, after_id, batch_size):
+            yield "".join(
+                json.dumps(_export_record(r, chats.get(r["chat_id"])), ensure_ascii=False) + "\n" for r in rows
+            )
+
+    async def csv_rows():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        # Заголовок только в начале выгрузки, не при продолжении
+        if not after_id:
+            writer.writerow(EXPORT_CSV_COLUMNS)
+        async for rows, chats in _export_batches(db, filters, after_id, batch_size):
+            for r in rows:
+                rec = _export_record(r, chats.get(r["chat_id"]))
+                chat = rec.pop("chat") or {}
+                writer.writerow(
+                    [_csv_cell(rec[c]) for c in EXPORT_RECORD_COLUMNS]
+                    + [_csv_cell(chat.get(k)) for k in EXPORT_CHAT_FIELDS]
+                )
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+
+    stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return StreamingResponse(
+        ndjson() if format == "ndjson" else csv_rows(),
+        media_type="application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="chats-export-{stamp}.{format}"'},
+    )
+
 
 @router.get("/{chat_id}")
 async def chat_details(chat_id: int, user: AdminUser = Depends(get_current_user)):
@@ -76,6 +303,71 @@ async def chat_profile(chat_id: int, user: AdminUser = Depends(get_current_user)
     }
 
 
+# Ссылка на текущую аватарку пользователя: user_id -> (истекает_в, file_id, file_unique_id)
+AVATAR_REF_TTL = 600.0
+_avatar_refs: Dict[int, Tuple[float, str, str]] = {}
+
+MEDIA_CHUNK_SIZE = 256 * 1024
+
+
+def _iter_file_range(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        left = length
+        while left > 0:
+            chunk = f.read(min(MEDIA_CHUNK_SIZE, left))
+            if not chunk:
+                break
+            left -= len(chunk)
+            yield chunk
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # Поддерживается один диапазон: bytes=a-b, bytes=a-, bytes=-n
+    unit, _, spec = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            n = int(last)
+            if n <= 0:
+                return None
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _media_response(request: Request, entry: CachedMedia, headers: Optional[dict] = None):
+    """Отдать файл из кэша с ETag и поддержкой Range"""
+    headers = {
+        **(headers or {}),
+        "ETag": entry.etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=86400",
+    }
+    if entry.etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == entry.etag):
+        rng = _parse_range(range_header, entry.size)
+        if rng is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{entry.size}"})
+        start, end = rng
+        length = end - start + 1
+        headers.update({"Content-Range": f"bytes {start}-{end}/{entry.size}", "Content-Length": str(length)})
+        return StreamingResponse(
+            _iter_file_range(entry.path, start, length), status_code=206, media_type=entry.content_type, headers=headers
+        )
+    return FileResponse(entry.path, media_type=entry.content_type, headers=headers)
+
+
 @router.get("/{chat_id}/avatar")
 async def chat_avatar(request: Request, chat_id: int, user: AdminUser = Depends(get_current_user)):
     chat = await Chat.get_or_none(id=chat_id)
@@ -83,22 +375,19 @@ async def chat_avatar(request: Request, chat_id: int, user: AdminUser = Depends(
         raise HTTPException(status_code=404, detail="Chat not found")
     bot: SupportBot = request.app.state.bot
     try:
-        photos = await bot.application.bot.get_user_profile_photos(chat.user_id, limit=1)
-        if not photos or not getattr(photos, "photos", None) or not photos.photos:
-            raise HTTPException(status_code=404, detail="No avatar")
-        sizes = photos.photos[0]
-        photo = sizes[-1] if sizes else None
-        if not photo:
-            raise HTTPException(status_code=404, detail="No avatar")
-        file = await bot.application.bot.get_file(photo.file_id)
-        data = await file.download_as_bytearray()
-        ct = "image/jpeg"
-        path = (getattr(file, "file_path", "") or "").lower()
-        if path.endswith(".png"):
-            ct = "image/png"
-        elif path.endswith(".webp"):
-            ct = "image/webp"
-        return Response(content=bytes(data), media_type=ct)
+        ref = _avatar_refs.get(chat.user_id)
+        if not ref or ref[0] < time.monotonic():
+            photos = await bot.application.bot.get_user_profile_photos(chat.user_id, limit=1)
+            if not photos or not getattr(photos, "photos", None) or not photos.photos:
+                raise HTTPException(status_code=404, detail="No avatar")
+            sizes = photos.photos[0]
+            photo = sizes[-1] if sizes else None
+            if not photo:
+                raise HTTPException(status_code=404, detail="No avatar")
+            ref = (time.monotonic() + AVATAR_REF_TTL, photo.file_id, photo.file_unique_id)
+            _avatar_refs[chat.user_id] = ref
+        entry = await bot.media_cache.get(bot.application.bot, ref[1], media_type="photo", unique_id=ref[2])
+        return _media_response(request, entry)
     except HTTPException:
         raise
     except Exception:
@@ -106,20 +395,26 @@ async def chat_avatar(request: Request, chat_id: int, user: AdminUser = Depends(
 
 
 @router.get("/{chat_id}/messages")
-async def chat_messages(chat_id: int, before_id: int = Query(None), limit: int = Query(50), user: AdminUser = Depends(get_current_user)):
-    qs = Message.filter(chat_id=chat_id).order_by("-id")
-    if before_id:
-        qs = qs.filter(id__lt=before_id)
-    msgs = await qs.limit(limit)
+async def chat_messages(request: Request, chat_id: int, before_id: int = Query(None), limit: int = Query(50), user: AdminUser = Depends(get_current_user)):
+    db: Database = request.app.state.db
+    msgs = await db.get_chat_history(chat_id, before_id=before_id, limit=limit)
     out = []
-    for m in reversed(msgs):
+    for m in msgs:
         source = getattr(m, "source", None) or m.message_type
-        text = getattr(m, "text", None) or m.content
         created = m.created_at.isoformat() if m.created_at else None
-        out.append({"id": m.id, "source": source, "text": text, "created_at": created, "media_type": m.media_type, "media_file_id": m.media_file_id})
+        out.append({"id": m.id, "source": source, "text": m.display_text, "created_at": created, "media_type": m.media_type, "media_file_id": m.media_file_id})
     return out
 
 
+@router.post("/{chat_id}/read")
+async def mark_chat_read(request: Request, chat_id: int, user: AdminUser = Depends(get_current_user)):
+    chat = await Chat.get_or_none(id=chat_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    await request.app.state.db.mark_chat_read(chat, user.id)
+    return {"ok": True}
+
+
 @router.get("/messages/{message_id}/media")
 async def message_media(request: Request, message_id: int, user: AdminUser = Depends(get_current_user)):
     m = await Message.get_or_none(id=message_id)
@@ -129,48 +424,14 @@ async def message_media(request: Request, message_id: int, user: AdminUser = Dep
         raise HTTPException(status_code=404, detail="No media")
     bot: SupportBot = request.app.state.bot
     try:
-        file = await bot.application.bot.get_file(m.media_file_id)
-        data = await file.download_as_bytearray()
-        path = (getattr(file, "file_path", "") or "").lower()
-        ct = "application/octet-stream"
-        if m.media_type == "photo":
-            ct = "image/jpeg"
-            if path.endswith(".png"):
-                ct = "image/png"
-            elif path.endswith(".webp"):
-                ct = "image/webp"
-        elif m.media_type == "video":
-            ct = "video/mp4"
-        elif m.media_type in ["audio", "voice"]:
-            ct = "audio/ogg" if m.media_type == "voice" else "audio/mpeg"
-            if path.endswith(".ogg"):
-                ct = "audio/ogg"
-            elif path.endswith(".wav"):
-                ct = "audio/wav"
-            elif path.endswith(".webm"):
-                ct = "audio/webm"
-        if ct == "application/octet-stream":
-            if path.endswith(".png"):
-                ct = "image/png"
-            elif path.endswith(".jpg") or path.endswith(".jpeg"):
-                ct = "image/jpeg"
-            elif path.endswith(".webp"):
-                ct = "image/webp"
-            elif path.endswith(".gif"):
-                ct = "image/gif"
-            elif path.endswith(".mp4"):
-                ct = "video/mp4"
-            elif path.endswith(".webm"):
-                ct = "video/webm"
-            elif path.endswith(".pdf"):
-                ct = "application/pdf"
-        disposition = "inline"
-        if m.media_type == "document":
-            disposition = "attachment"
-        headers = {"Content-Disposition": f'{disposition}; filename="media_{message_id}"'}
-        return Response(content=bytes(data), media_type=ct, headers=headers)
+        entry = await bot.media_cache.get(bot.application.bot, m.media_file_id, media_type=m.media_type)
     except Exception:
         raise HTTPException(status_code=404, detail="Download failed")
+    disposition = "inline"
+    if m.media_type == "document":
+        disposition = "attachment"
+    headers = {"Content-Disposition": f'{disposition}; filename="media_{message_id}"'}
+    return _media_response(request, entry, headers)
 
 @router.post("/{chat_id}/send")
 async def send_api_message(request: Request, chat_id: int, user: AdminUser = Depends(get_current_user)):
@@ -182,14 +443,7 @@ async def send_api_message(request: Request, chat_id: int, user: AdminUser = Dep
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     sender_uid = chat.manager_id or user.id
-    try:
-        msg = await Message.create(chat_id=chat_id, user_id=sender_uid, message_type="manager", content=text, source="manager_web", text=text, admin_user_id=user.id)
-    except Exception:
-        msg = await Message.create(chat_id=chat_id, user_id=sender_uid, message_type="manager", content=text)
-    try:
-        await Chat.filter(id=chat_id).update(last_message_at=msg.created_at)
-    except Exception:
-        pass
+    msg = await request.app.state.db.add_message(chat_id, sender_uid, text, "manager", admin_user_id=user.id)
     # отправка через бота
     bot: SupportBot = request.app.state.bot
     header = await bot.application.bot.send_message(chat_id=chat.user_id, text="👨‍💼 Менеджер поддержки")
@@ -213,7 +467,7 @@ async def send_api_message(request: Request, chat_id: int, user: AdminUser = Dep
             "chat_id": chat_id,
             "message": {
                 "id": msg.id,
-                "text": getattr(msg, "text", None) or msg.content,
+                "text": msg.display_text,
                 "source": getattr(msg, "source", None) or msg.message_type,
                 "created_at": msg.created_at.isoformat() if msg.created_at else None,
                 "media_type": getattr(msg, "media_type", None),
@@ -245,154 +499,58 @@ async def send_api_media(
         media_type = "voice"
     elif content_type.startswith("audio/"):
         media_type = "audio"
-    stored_text = (f"[{media_type}] {caption}".strip() if caption else f"[{media_type}]")
     sender_uid = chat.manager_id or user.id
-    msg = await Message.create(
-        chat_id=chat_id,
-        user_id=sender_uid,
-        message_type="manager",
-        content=stored_text,
-        source="manager_web",
-        text=stored_text,
-        media_type=media_type,
-        admin_user_id=user.id,
-    )
-    try:
-        await Chat.filter(id=chat_id).update(last_message_at=msg.created_at)
-    except Exception:
-        pass
+    msg = await request.app.state.db.add_message(chat_id, sender_uid, caption, "manager", media_type=media_type, admin_user_id=user.id)
     bot: SupportBot = request.app.state.bot
-    raw_bytes = await file.read()
     filename = file.filename or "upload"
+    # UploadFile уже лежит во временном файле на диске — отправляем его без копии в памяти
+    upload = file.file
+    if hasattr(upload, "rollover"):
+        # Маленькие загрузки Starlette держит в памяти, а у такого объекта name=None и InputFile падает
+        upload.rollover()
     header = await bot.application.bot.send_message(chat_id=chat.user_id, text="👨‍💼 Менеджер поддержки")
-    sent_user = None
-    media_file_id_for_ws = None
-    if media_type == "photo":
-        sent_user = await bot.application.bot.send_photo(chat_id=chat.user_id, photo=io.BytesIO(raw_bytes), caption=caption or None, reply_to_message_id=header.message_id)
-        try:
-            file_id = sent_user.photo[-1].file_id if sent_user.photo else None
-            media_file_id_for_ws = file_id
-            await Message.filter(id=msg.id).update(tg_message_id_user=sent_user.message_id, media_file_id=file_id)
-        except Exception:
-            pass
-    elif media_type == "video":
-        sent_user = await bot.application.bot.send_video(chat_id=chat.user_id, video=io.BytesIO(raw_bytes), caption=caption or None, reply_to_message_id=header.message_id)
-        try:
-            file_id = getattr(sent_user.video, "file_id", None)
-            media_file_id_for_ws = file_id
-            await Message.filter(id=msg.id).update(tg_message_id_user=sent_user.message_id, media_file_id=file_id)
-        except Exception:
-            pass
-    elif media_type == "audio":
-        try:
-            sent_user = await bot.application.bot.send_audio(chat_id=chat.user_id, audio=io.BytesIO(raw_bytes), caption=caption or None, reply_to_message_id=header.message_id)
-            try:
-                file_id = getattr(sent_user.audio, "file_id", None)
-                media_file_id_for_ws = file_id
-                await Message.filter(id=msg.id).update(tg_message_id_user=sent_user.message_id, media_file_id=file_id)
-            except Exception:
-                pass
-        except Exception:
-            bio = io.BytesIO(raw_bytes)
-            try:
-                bio.name = filename
-            except Exception:
-                pass
-            sent_user = await bot.application.bot.send_document(chat_id=chat.user_id, document=bio, caption=caption or None, reply_to_message_id=header.message_id)
-            try:
-                file_id = getattr(sent_user.document, "file_id", None)
-                media_file_id_for_ws = file_id
-                await Message.filter(id=msg.id).update(tg_message_id_user=sent_user.message_id, media_file_id=file_id, media_type="document")
-                media_type = "document"
-                stored_text = (f"[{media_type}] {caption}".strip() if caption else f"[{media_type}]")
-                await Message.filter(id=msg.id).update(content=stored_text, text=stored_text)
-            except Exception:
-                pass
-    elif media_type == "voice":
-        try:
-            sent_user = await bot.application.bot.send_voice(chat_id=chat.user_id, voice=io.BytesIO(raw_bytes), caption=caption or None, reply_to_message_id=header.message_id)
-            try:
-                file_id = getattr(sent_user.voice, "file_id", None)
-                media_file_id_for_ws = file_id
-                await Message.filter(id=msg.id).update(tg_message_id_user=sent_user.message_id, media_file_id=file_id)
-            except Exception:
-                pass
-        except Exception:
-            bio = io.BytesIO(raw_bytes)
-            try:
-                bio.name = filename
-            except Exception:
-                pass
-            sent_user = await bot.application.bot.send_document(chat_id=chat.user_id, document=bio, caption=caption or None, reply_to_message_id=header.message_id)
-            try:
-                file_id = getattr(sent_user.document, "file_id", None)
-                media_file_id_for_ws = file_id
-                await Message.filter(id=msg.id).update(tg_message_id_user=sent_user.message_id, media_file_id=file_id, media_type="document")
-                media_type = "document"
-                stored_text = (f"[{media_type}] {caption}".strip() if caption else f"[{media_type}]")
-                await Message.filter(id=msg.id).update(content=stored_text, text=stored_text)
-            except Exception:
-                pass
-    else:
-        bio = io.BytesIO(raw_bytes)
+
+    def make_input():
+        upload.seek(0)
+        # read_file_handle=False: httpx читает файл потоком при отправке, без копии в памяти
+        return InputFile(upload, filename=filename, read_file_handle=False)
+
+    # Клиент получает загрузку, группа и менеджер в личке — тот же файл по file_id
+    destinations = [{"chat_id": chat.user_id, "reply_to_message_id": header.message_id}]
+    thread_id = None
+    if bot.config.telegram_group_mode and bot.config.telegram_support_group_id:
+        thread_id = await bot._ensure_group_topic(chat)
+        if thread_id:
+            destinations.append({"chat_id": bot.config.telegram_support_group_id, "message_thread_id": int(thread_id), "parse_mode": ParseMode.HTML})
+    elif chat.manager_id and chat.manager_id in bot.config.get_all_staff_ids():
+        destinations.append({"chat_id": chat.manager_id})
+    sent_media_type, media_file_id_for_ws, sent = await bot.send_media_once(media_type, make_input, destinations, caption=caption or None)
+    media_type = sent_media_type
+    update = {"media_type": media_type, "tg_message_id_user": sent[0].message_id, "media_file_id": media_file_id_for_ws}
+    if thread_id and sent[1] is not None:
+        update["tg_message_id_group"] = sent[1].message_id
+    elif not thread_id and len(sent) > 1 and sent[1] is not None:
+        # Ответ менеджера на копию в личке уйдет клиенту
         try:
-            bio.name = filename
+            bot._store_reply_map(chat.manager_id, sent[1].message_id, chat.user_id, sent[0].message_id, chat.id)
         except Exception:
             pass
-        sent_user = await bot.application.bot.send_document(chat_id=chat.user_id, document=bio, caption=caption or None, reply_to_message_id=header.message_id)
+    try:
+        await Message.filter(id=msg.id).update(**update)
+    except Exception:
+        pass
+    if thread_id:
         try:
-            file_id = getattr(sent_user.document, "file_id", None)
-            media_file_id_for_ws = file_id
-            await Message.filter(id=msg.id).update(tg_message_id_user=sent_user.message_id, media_file_id=file_id)
+            await bot._edit_group_topic_status(chat, role_hint="manager")
         except Exception:
             pass
-    if bot.config.telegram_group_mode and bot.config.telegram_support_group_id:
-        thread_id = await bot._ensure_group_topic(chat)
-        if thread_id:
-            try:
-                if media_type == "photo":
-                    sent_group = await bot.application.bot.send_photo(
-                        chat_id=bot.config.telegram_support_group_id,
-                        message_thread_id=int(thread_id),
-                        photo=io.BytesIO(raw_bytes),
-                        caption=caption or None,
-                        parse_mode=ParseMode.HTML,
-                    )
-                elif media_type == "video":
-                    sent_group = await bot.application.bot.send_video(
-                        chat_id=bot.config.telegram_support_group_id,
-                        message_thread_id=int(thread_id),
-                        video=io.BytesIO(raw_bytes),
-                        caption=caption or None,
-                        parse_mode=ParseMode.HTML,
-                    )
-                else:
-                    bio = io.BytesIO(raw_bytes)
-                    try:
-                        bio.name = filename
-                    except Exception:
-                        pass
-                    sent_group = await bot.application.bot.send_document(
-                        chat_id=bot.config.telegram_support_group_id,
-                        message_thread_id=int(thread_id),
-                        document=bio,
-                        caption=caption or None,
-                        parse_mode=ParseMode.HTML,
-                    )
-                try:
-                    await Message.filter(id=msg.id).update(tg_message_id_group=sent_group.message_id)
-                except Exception:
-                    pass
-                await bot._edit_group_topic_status(chat, role_hint="manager")
-            except Exception:
-                pass
     await request.app.state.ws_manager.broadcast(
         "new_message",
         {
             "chat_id": chat_id,
             "message": {
                 "id": msg.id,
-                "text": stored_text,
+                "text": message_display_text(caption, media_type),
                 "source": "manager_web",
                 "created_at": msg.created_at.isoformat() if msg.created_at else None,
                 "media_type": media_type,
@@ -409,15 +567,9 @@ async def join_chat(request: Request, chat_id: int, user: AdminUser = Depends(ge
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     await Chat.filter(id=chat_id).update(status="waiting_manager", assigned_admin_id=user.id)
-    try:
-        sysmsg = await Message.create(chat_id=chat_id, user_id=chat.user_id, message_type="manager", content="Менеджер подключился", source="system", text="Менеджер подключился")
-    except Exception:
-        sysmsg = await Message.create(chat_id=chat_id, user_id=chat.user_id, message_type="manager", content="Менеджер подключился")
-    try:
-        await Chat.filter(id=chat_id).update(last_message_at=sysmsg.created_at)
-    except Exception:
-        pass
+    sysmsg = await request.app.state.db.add_message(chat_id, chat.user_id, "Менеджер подключился", "manager", source="system")
     bot: SupportBot = request.app.state.bot
+    bot.ai_jobs.cancel_chat(chat_id)
     try:
         await bot.application.bot.send_message(chat_id=chat.user_id, text="👨‍💼 Менеджер подключился к вашему чату. Можете писать сообщение.")
     except Exception:
@@ -430,7 +582,7 @@ async def join_chat(request: Request, chat_id: int, user: AdminUser = Depends(ge
                 "chat_id": chat_id,
                 "message": {
                     "id": sysmsg.id,
-                    "text": getattr(sysmsg, "text", None) or sysmsg.content,
+                    "text": sysmsg.display_text,
                     "source": "system",
                     "created_at": sysmsg.created_at.isoformat() if sysmsg.created_at else None,
                 },
@@ -447,14 +599,7 @@ async def close_chat(request: Request, chat_id: int, user: AdminUser = Depends(g
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     await Chat.filter(id=chat_id).update(status="closed", assigned_admin_id=None, manager_id=None)
-    try:
-        sysmsg = await Message.create(chat_id=chat_id, user_id=chat.user_id, message_type="manager", content="Чат закрыт. AI активирован", source="system", text="Чат закрыт. AI активирован", admin_user_id=user.id)
-    except Exception:
-        sysmsg = await Message.create(chat_id=chat_id, user_id=chat.user_id, message_type="manager", content="Чат закрыт. AI активирован")
-    try:
-        await Chat.filter(id=chat_id).update(last_message_at=sysmsg.created_at)
-    except Exception:
-        pass
+    sysmsg = await request.app.state.db.add_message(chat_id, chat.user_id, "Чат закрыт. AI активирован", "manager", source="system", admin_user_id=user.id)
     bot: SupportBot = request.app.state.bot
     try:
         await bot.application.bot.send_message(chat_id=chat.user_id, text="✅ Чат с менеджером закрыт. Теперь вам помогает 🤖 AI-поддержка.")
@@ -468,7 +613,7 @@ async def close_chat(request: Request, chat_id: int, user: AdminUser = Depends(g
                 "chat_id": chat_id,
                 "message": {
                     "id": sysmsg.id,
-                    "text": getattr(sysmsg, "text", None) or sysmsg.content,
+                    "text": sysmsg.display_text,
                     "source": "system",
                     "created_at": sysmsg.created_at.isoformat() if sysmsg.created_at else None,
                 },
@@ -485,14 +630,7 @@ async def back_to_ai(request: Request, chat_id: int, user: AdminUser = Depends(g
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     await Chat.filter(id=chat_id).update(status="active", assigned_admin_id=None, manager_id=None)
-    try:
-        sysmsg = await Message.create(chat_id=chat_id, user_id=chat.user_id, message_type="manager", content="Менеджер завершил сессию. AI активирован", source="system", text="Менеджер завершил сессию. AI активирован", admin_user_id=user.id)
-    except Exception:
-        sysmsg = await Message.create(chat_id=chat_id, user_id=chat.user_id, message_type="manager", content="Менеджер завершил сессию. AI активирован")
-    try:
-        await Chat.filter(id=chat_id).update(last_message_at=sysmsg.created_at)
-    except Exception:
-        pass
+    sysmsg = await request.app.state.db.add_message(chat_id, chat.user_id, "Менеджер завершил сессию. AI активирован", "manager", source="system", admin_user_id=user.id)
     bot: SupportBot = request.app.state.bot
     try:
         await bot.application.bot.send_message(chat_id=chat.user_id, text="👨‍💼 Менеджер завершил сессию. Теперь вам помогает 🤖 AI-поддержка.")
@@ -506,7 +644,7 @@ async def back_to_ai(request: Request, chat_id: int, user: AdminUser = Depends(g
                 "chat_id": chat_id,
                 "message": {
                     "id": sysmsg.id,
-                    "text": getattr(sysmsg, "text", None) or sysmsg.content,
+                    "text": sysmsg.display_text,
                     "source": "system",
                     "created_at": sysmsg.created_at.isoformat() if sysmsg.created_at else None,
                 },
@@ -0,0 +1,68 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from modules.database import AdminUser
+from web.deps import get_current_user
+
+router = APIRouter(prefix="/api/metrics", tags=["metrics"])
+
+
+def _require_admin(user: AdminUser):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+
+
+@router.get("/outbound")
+async def outbound_metrics(request: Request, user: AdminUser = Depends(get_current_user)):
+    _require_admin(user)
+    bot = getattr(request.app.state, "bot", None)
+    limiter = getattr(bot, "outbound", None)
+    if limiter is None:
+        raise HTTPException(status_code=503, detail="Bot is not running")
+    return limiter.metrics()
+
+
+@router.get("/updates")
+async def update_metrics(request: Request, user: AdminUser = Depends(get_current_user)):
+    _require_admin(user)
+    bot = getattr(request.app.state, "bot", None)
+    processor = getattr(bot, "update_processor", None)
+    if processor is None:
+        raise HTTPException(status_code=503, detail="Bot is not running")
+    return processor.metrics()
+
+
+@router.get("/ai-jobs")
+async def ai_job_metrics(request: Request, user: AdminUser = Depends(get_current_user)):
+    _require_admin(user)
+    bot = getattr(request.app.state, "bot", None)
+    queue = getattr(bot, "ai_jobs", None)
+    if queue is None:
+        raise HTTPException(status_code=503, detail="Bot is not running")
+    return queue.metrics()
+
+
+@router.get("/write-buffer")
+async def write_buffer_metrics(request: Request, user: AdminUser = Depends(get_current_user)):
+    _require_admin(user)
+    db = getattr(request.app.state, "db", None)
+    buffer = getattr(db, "write_buffer", None)
+    if buffer is None:
+        return {"enabled": False}
+    return {"enabled": True, **buffer.metrics()}
+
+
+@router.get("/db")
+async def db_metrics(request: Request, user: AdminUser = Depends(get_current_user)):
+    _require_admin(user)
+    db = getattr(request.app.state, "db", None)
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database is not initialized")
+    return {"pools": db.pool_metrics(), "replica_reads": db.read_db is not None}
+
+
+@router.get("/archive")
+async def archive_metrics(request: Request, user: AdminUser = Depends(get_current_user)):
+    _require_admin(user)
+    worker = getattr(request.app.state, "message_archive", None)
+    if worker is None:
+        raise HTTPException(status_code=503, detail="Message archive is not initialized")
+    return await worker.status()
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, Query, Request
+from modules.database import AdminUser, Chat, Database, SNIPPET_START, SNIPPET_END
+from web.deps import get_current_user
+from datetime import datetime
+import html
+
+router = APIRouter(prefix="/api/search", tags=["search"])
+
+
+def _highlight(snippet: str) -> str:
+    # Сначала экранируем текст сообщения, затем превращаем маркеры совпадений в <mark>
+    escaped = html.escape(snippet or "")
+    return escaped.replace(SNIPPET_START, "<mark>").replace(SNIPPET_END, "</mark>")
+
+
+@router.get("")
+async def search_messages(
+    request: Request,
+    user: AdminUser = Depends(get_current_user),
+    q: str = Query(...),
+    chat_id: int = Query(None),
+    before_id: int = Query(None),
+    limit: int = Query(30),
+):
+    limit = max(1, min(limit, 100))
+    db: Database = request.app.state.db
+    rows = await db.search_messages(q, before_id=before_id, limit=limit + 1, chat_id=chat_id)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    chat_ids = {r["chat_id"] for r in rows}
+    chats = {c.id: c for c in await Chat.filter(id__in=chat_ids).using_db(db.read_db)} if chat_ids else {}
+    items = []
+    for r in rows:
+        chat = chats.get(r["chat_id"])
+        created = r["created_at"]
+        if isinstance(created, str):
+            # Сырые запросы SQLite возвращают дату строкой
+            try:
+                created = datetime.fromisoformat(created)
+            except ValueError:
+                pass
+        if isinstance(created, datetime):
+            created = created.isoformat()
+        items.append({
+            "id": r["id"],
+            "chat_id": r["chat_id"],
+            "source": r.get("source") or r.get("message_type"),
+            "created_at": created,
+            "snippet": _highlight(r.get("snippet")),
+            "chat": {
+                "username": chat.username,
+                "first_name": chat.first_name,
+                "last_name": chat.last_name,
+                "status": chat.status,
+            } if chat else None,
+        })
+    return {
+        "items": items,
+        "next_before_id": rows[-1]["id"] if has_more and rows else None,
+    }
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from modules.config import Config
 from modules.database import AdminUser, SystemConfig, ProjectDatabase
-from web.deps import get_current_user
+from modules.settings_service import SettingsService
+from web.deps import get_current_user, get_settings
 
 router = APIRouter(prefix="/api/settings", tags=["settings"])
 
@@ -19,21 +19,14 @@ async def list_system_settings(user: AdminUser = Depends(get_current_user)):
 
 
 @router.put("/system/{key}")
-async def put_system_setting(key: str, request: Request, user: AdminUser = Depends(get_current_user)):
+async def put_system_setting(key: str, request: Request, user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     body = await request.json()
     value = body.get("value")
     description = body.get("description")
     if value is None:
         raise HTTPException(status_code=400, detail="value required")
-    row = await SystemConfig.get_or_none(key=key)
-    if row:
-        row.value = str(value)
-        if description is not None:
-            row.description = description
-        await row.save()
-    else:
-        await SystemConfig.create(key=key, value=str(value), description=description)
+    await settings.write({key: (str(value), description)})
     return {"ok": True}
 
 
@@ -84,9 +77,9 @@ async def update_datasource(source_id: int, request: Request, user: AdminUser =
 
 
 @router.get("/ai-context")
-async def get_ai_context(user: AdminUser = Depends(get_current_user)):
+async def get_ai_context(user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
-    cfg = Config()
+    cfg = settings.config
     keys = [
         "service_faq",
         "service_tariffs",
@@ -94,8 +87,7 @@ async def get_ai_context(user: AdminUser = Depends(get_current_user)):
         "service_features",
         "service_support_hours",
     ]
-    rows = await SystemConfig.filter(key__in=keys).all()
-    values = {r.key: r.value for r in rows}
+    values = settings.overrides(keys)
     defaults = {
         "service_faq": cfg.service_faq or "",
         "service_tariffs": cfg.service_tariffs or "",
@@ -112,7 +104,7 @@ async def get_ai_context(user: AdminUser = Depends(get_current_user)):
 
 
 @router.put("/ai-context")
-async def put_ai_context(request: Request, user: AdminUser = Depends(get_current_user)):
+async def put_ai_context(request: Request, user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     body = await request.json()
     keys = [
@@ -122,14 +114,12 @@ async def put_ai_context(request: Request, user: AdminUser = Depends(get_current
         "service_features",
         "service_support_hours",
     ]
-    for k in keys:
-        if k in body:
-            await SystemConfig.update_or_create(key=k, defaults={"value": str(body.get(k) or ""), "description": f"AI контекст: {k}"})
+    await settings.write({k: (str(body.get(k) or ""), f"AI контекст: {k}") for k in keys if k in body})
     return {"ok": True}
 
 
 @router.post("/ai-context/reset")
-async def reset_ai_context(user: AdminUser = Depends(get_current_user)):
+async def reset_ai_context(user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     keys = [
         "service_faq",
@@ -138,31 +128,34 @@ async def reset_ai_context(user: AdminUser = Depends(get_current_user)):
         "service_features",
         "service_support_hours",
     ]
-    await SystemConfig.filter(key__in=keys).delete()
+    await settings.write({k: None for k in keys})
     return {"ok": True}
 
 
 @router.get("/media")
-async def get_media_settings(user: AdminUser = Depends(get_current_user)):
+async def get_media_settings(request: Request, user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
-    keys = ["media_keep_forever", "media_retention_days"]
-    rows = await SystemConfig.filter(key__in=keys).all()
-    values = {r.key: r.value for r in rows}
+    values = settings.overrides(["media_keep_forever", "media_retention_days"])
     keep_forever = (values.get("media_keep_forever") or "").lower() in ["1", "true", "yes", "y", "on"]
     days_raw = (values.get("media_retention_days") or "").strip()
     retention_days = int(days_raw) if days_raw.isdigit() else None
-    return {"keep_forever": keep_forever, "retention_days": retention_days}
+    worker = getattr(request.app.state, "media_retention", None)
+    return {
+        "keep_forever": keep_forever,
+        "retention_days": retention_days,
+        "retention_status": worker.status() if worker else None,
+    }
 
 
 @router.put("/media")
-async def put_media_settings(request: Request, user: AdminUser = Depends(get_current_user)):
+async def put_media_settings(request: Request, user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     body = await request.json()
     keep_forever = bool(body.get("keep_forever"))
     retention_days = body.get("retention_days")
-    await SystemConfig.update_or_create(key="media_keep_forever", defaults={"value": "true" if keep_forever else "false", "description": "Не удалять медиа"})
+    updates = {"media_keep_forever": ("true" if keep_forever else "false", "Не удалять медиа")}
     if retention_days is None or retention_days == "":
-        await SystemConfig.filter(key="media_retention_days").delete()
+        updates["media_retention_days"] = None
     else:
         try:
             days = int(retention_days)
@@ -170,14 +163,18 @@ async def put_media_settings(request: Request, user: AdminUser = Depends(get_cur
             raise HTTPException(status_code=400, detail="retention_days must be integer")
         if days < 1:
             raise HTTPException(status_code=400, detail="retention_days must be >= 1")
-        await SystemConfig.update_or_create(key="media_retention_days", defaults={"value": str(days), "description": "Удалять медиа через N дней"})
+        updates["media_retention_days"] = (str(days), "Удалять медиа через N дней")
+    await settings.write(updates)
+    worker = getattr(request.app.state, "media_retention", None)
+    if worker:
+        worker.trigger()
     return {"ok": True}
 
 
 @router.get("/telegram")
-async def get_telegram_settings(user: AdminUser = Depends(get_current_user)):
+async def get_telegram_settings(user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
-    cfg = Config()
+    cfg = settings.config
     keys = [
         "telegram_group_mode",
         "telegram_support_group_id",
@@ -190,8 +187,7 @@ async def get_telegram_settings(user: AdminUser = Depends(get_current_user)):
         "telegram_status_emoji_waiting_manager",
         "telegram_status_emoji_closed",
     ]
-    rows = await SystemConfig.filter(key__in=keys).all()
-    values = {r.key: r.value for r in rows}
+    values = settings.overrides(keys)
     defaults = {
         "telegram_group_mode": cfg.telegram_group_mode,
         "telegram_support_group_id": cfg.telegram_support_group_id,
@@ -218,7 +214,7 @@ async def get_telegram_settings(user: AdminUser = Depends(get_current_user)):
 
 
 @router.put("/telegram")
-async def put_telegram_settings(request: Request, user: AdminUser = Depends(get_current_user)):
+async def put_telegram_settings(request: Request, user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     body = await request.json()
     allowed = {
@@ -233,33 +229,32 @@ async def put_telegram_settings(request: Request, user: AdminUser = Depends(get_
         "telegram_status_emoji_waiting_manager": ("Эмодзи статуса waiting_manager", "str"),
         "telegram_status_emoji_closed": ("Эмодзи статуса closed", "str"),
     }
+    updates = {}
     for k, (desc, typ) in allowed.items():
         if k not in body:
             continue
         v = body.get(k)
         if typ == "bool":
-            await SystemConfig.update_or_create(key=k, defaults={"value": "true" if bool(v) else "false", "description": desc})
+            updates[k] = ("true" if bool(v) else "false", desc)
         elif typ == "int":
             if v is None or str(v).strip() == "":
-                await SystemConfig.filter(key=k).delete()
+                updates[k] = None
             else:
                 try:
                     n = int(v)
                 except Exception:
                     raise HTTPException(status_code=400, detail=f"{k} must be integer")
-                await SystemConfig.update_or_create(key=k, defaults={"value": str(n), "description": desc})
+                updates[k] = (str(n), desc)
         else:
-            if v is None:
-                await SystemConfig.filter(key=k).delete()
-            else:
-                await SystemConfig.update_or_create(key=k, defaults={"value": str(v), "description": desc})
+            updates[k] = None if v is None else (str(v), desc)
+    await settings.write(updates)
     return {"ok": True}
 
 
 @router.get("/bot")
-async def get_bot_settings(user: AdminUser = Depends(get_current_user)):
+async def get_bot_settings(user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
-    cfg = Config()
+    cfg = settings.config
     keys = [
         "project_name",
         "project_description",
@@ -274,8 +269,7 @@ async def get_bot_settings(user: AdminUser = Depends(get_current_user)):
         "ai_support_api_keys",
         "groq_models",
     ]
-    rows = await SystemConfig.filter(key__in=keys).all()
-    values = {r.key: r.value for r in rows}
+    values = settings.overrides(keys)
     defaults = {
         "project_name": cfg.project_name or "Support Desk",
         "project_description": cfg.project_description or "",
@@ -362,7 +356,7 @@ async def get_bot_settings(user: AdminUser = Depends(get_current_user)):
 
 
 @router.put("/bot")
-async def put_bot_settings(request: Request, user: AdminUser = Depends(get_current_user)):
+async def put_bot_settings(request: Request, user: AdminUser = Depends(get_current_user), settings: SettingsService = Depends(get_settings)):
     _require_admin(user)
     body = await request.json()
     allowed = {
@@ -377,36 +371,34 @@ async def put_bot_settings(request: Request, user: AdminUser = Depends(get_curre
         "ai_support_api_type": "AI: API type",
         "groq_models": "AI: модели Groq",
     }
+    updates = {}
     for k, desc in allowed.items():
         if k not in body:
             continue
         v = body.get(k)
         if v is None or (k in ["ai_system_prompt", "bot_welcome_message"] and str(v).strip() == ""):
-            await SystemConfig.filter(key=k).delete()
+            updates[k] = None
+        elif k == "ai_support_enabled":
+            updates[k] = ("true" if bool(v) else "false", desc)
         else:
-            if k == "ai_support_enabled":
-                await SystemConfig.update_or_create(key=k, defaults={"value": "true" if bool(v) else "false", "description": desc})
-            else:
-                await SystemConfig.update_or_create(key=k, defaults={"value": str(v), "description": desc})
+            updates[k] = (str(v), desc)
     if "ai_support_api_key" in body:
         v = body.get("ai_support_api_key")
         if v is None or str(v).strip() == "":
-            await SystemConfig.filter(key="ai_support_api_key").delete()
+            updates["ai_support_api_key"] = None
         else:
-            await SystemConfig.update_or_create(key="ai_support_api_key", defaults={"value": str(v), "description": "AI: API key"})
+            updates["ai_support_api_key"] = (str(v), "AI: API key")
     if "ai_support_api_keys" in body:
         v = body.get("ai_support_api_keys")
         if v is None or str(v).strip() == "":
-            await SystemConfig.filter(key="ai_support_api_keys").delete()
+            updates["ai_support_api_keys"] = None
         else:
             append = bool(body.get("ai_support_api_keys_append"))
             new_raw = str(v)
             if append:
-                cfg = Config()
-                existing = (await SystemConfig.get_or_none(key="ai_support_api_keys"))
-                existing_list = [p.strip() for p in ((existing.value if existing else "") or cfg.ai_support_api_keys or "").split(",") if p.strip()]
-                one = (await SystemConfig.get_or_none(key="ai_support_api_key"))
-                one_val = (one.value if one else "") or cfg.ai_support_api_key or ""
+                cfg = settings.config
+                existing_list = [p.strip() for p in ((settings.raw("ai_support_api_keys") or "") or cfg.ai_support_api_keys or "").split(",") if p.strip()]
+                one_val = (settings.raw("ai_support_api_key") or "") or cfg.ai_support_api_key or ""
                 one_val = one_val.strip()
                 combined = []
                 if one_val and one_val not in combined:
@@ -418,5 +410,6 @@ async def put_bot_settings(request: Request, user: AdminUser = Depends(get_curre
                     if k not in combined:
                         combined.append(k)
                 new_raw = ",".join(combined)
-            await SystemConfig.update_or_create(key="ai_support_api_keys", defaults={"value": new_raw, "description": "AI: API keys"})
+            updates["ai_support_api_keys"] = (new_raw, "AI: API keys")
+    await settings.write(updates)
     return {"ok": True}
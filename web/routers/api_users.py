@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from modules.database import AdminUser, Message
-from web.deps import get_current_user
-from web.utils import get_password_hash
+from modules.database import AdminUser, ArchivedMessage, Message
+from web.deps import get_current_user, invalidate_principal
+from web.utils import get_password_hash_async
 from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/api/users", tags=["users"])
@@ -45,7 +45,7 @@ async def create_user(request: Request, user: AdminUser = Depends(get_current_us
     exists = await AdminUser.get_or_none(username=username)
     if exists:
         raise HTTPException(status_code=409, detail="User exists")
-    created = await AdminUser.create(username=username, password_hash=get_password_hash(password), role=role, is_active=True)
+    created = await AdminUser.create(username=username, password_hash=await get_password_hash_async(password), role=role, is_active=True)
     return {"ok": True, "id": created.id}
 
 
@@ -87,6 +87,7 @@ async def update_user(user_id: int, request: Request, user: AdminUser = Depends(
             target.access_start_hour = None
             target.access_end_hour = None
             await target.save()
+            invalidate_principal(target.id)
             return {"ok": True}
         start = body.get("access_start_hour", None)
         end = body.get("access_end_hour", None)
@@ -111,6 +112,7 @@ async def update_user(user_id: int, request: Request, user: AdminUser = Depends(
         target.access_start_hour = start
         target.access_end_hour = end
     await target.save()
+    invalidate_principal(target.id)
     return {"ok": True}
 
 
@@ -124,8 +126,9 @@ async def reset_password(user_id: int, request: Request, user: AdminUser = Depen
     new_password = body.get("new_password") or ""
     if len(new_password) < 8:
         raise HTTPException(status_code=400, detail="Password too short")
-    target.password_hash = get_password_hash(new_password)
+    target.password_hash = await get_password_hash_async(new_password)
     await target.save()
+    invalidate_principal(target.id)
     return {"ok": True}
 
 
@@ -137,6 +140,7 @@ async def user_stats(user_id: int, user: AdminUser = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="User not found")
     since = datetime.utcnow() - timedelta(days=7)
     msgs = await Message.filter(admin_user_id=user_id, created_at__gte=since).all()
+    msgs += await ArchivedMessage.filter(admin_user_id=user_id, created_at__gte=since).all()
     by_hour = [0] * 24
     for m in msgs:
         try:
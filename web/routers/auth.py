@@ -2,7 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
 from fastapi.responses import RedirectResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
 from modules.database import AdminUser
-from web.utils import verify_password, create_access_token
+from web.utils import verify_password_async, create_access_token
+from web.deps import login_slot
 from pathlib import Path
 
 router = APIRouter()
@@ -16,8 +17,16 @@ async def login_page(request: Request):
 
 @router.post("/login")
 async def login(request: Request, username: str = Form(...), password: str = Form(...)):
-    user = await AdminUser.get_or_none(username=username)
-    if not user or not verify_password(password, user.password_hash):
+    try:
+        async with login_slot(request, username):
+            user = await AdminUser.get_or_none(username=username)
+            valid = bool(user) and await verify_password_async(password, user.password_hash)
+    except HTTPException:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": "Слишком много попыток входа, повторите позже"
+        }, status_code=status.HTTP_429_TOO_MANY_REQUESTS)
+    if not valid:
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Неверное имя пользователя или пароль"
@@ -19,7 +19,7 @@ async def chat_detail(request: Request, chat_id: int, user: AdminUser = Depends(
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     
-    messages = await Message.filter(chat_id=chat_id).order_by("created_at")
+    messages = await request.app.state.db.get_chat_history(chat_id, limit=None)
     
     return templates.TemplateResponse("chat_detail.html", {
         "request": request,
@@ -41,25 +41,8 @@ async def send_message(
     
     # Сохраняем сообщение в БД (используем ID назначенного менеджера, иначе ID пользователя админки)
     sender_uid = chat.manager_id or user.id
-    try:
-        msg = await Message.create(
-            chat_id=chat_id,
-            user_id=sender_uid,
-            message_type="manager",
-            content=text,
-            source="manager_web",
-            text=text,
-            admin_user_id=user.id
-        )
-    except Exception as e:
-        logger.warning(f"Extended fields not supported, fallback create: {e}")
-        msg = await Message.create(
-            chat_id=chat_id,
-            user_id=sender_uid,
-            message_type="manager",
-            content=text
-        )
-    
+    msg = await request.app.state.db.add_message(chat_id, sender_uid, text, "manager", admin_user_id=user.id)
+
     # Отправляем через бота
     bot: SupportBot = request.app.state.bot
     try:
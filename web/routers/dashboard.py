@@ -11,13 +11,14 @@ templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
 @router.get("/dashboard")
 async def dashboard(request: Request, user: AdminUser = Depends(get_current_user)):
+    read_db = request.app.state.db.read_db
     # Получаем статистику
-    total_chats = await Chat.all().count()
-    active_chats = await Chat.filter(status="active").count()
-    waiting_chats = await Chat.filter(status="waiting_manager").count()
+    total_chats = await Chat.all().using_db(read_db).count()
+    active_chats = await Chat.filter(status="active").using_db(read_db).count()
+    waiting_chats = await Chat.filter(status="waiting_manager").using_db(read_db).count()
     
     # Получаем последние чаты
-    recent_chats = await Chat.all().order_by("-updated_at").limit(10)
+    recent_chats = await Chat.all().using_db(read_db).order_by("-updated_at").limit(10)
     
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
@@ -0,0 +1,26 @@
+from fastapi import APIRouter, HTTPException, Request
+from loguru import logger
+from modules.bot import SupportBot, WEBHOOK_PATH
+import hmac
+
+router = APIRouter(tags=["telegram"])
+
+
+@router.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    bot: SupportBot = getattr(request.app.state, "bot", None)
+    if bot is None or not bot.webhook_enabled or bot.application is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    secret = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not hmac.compare_digest(secret.encode("utf-8"), bot.webhook_secret.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    try:
+        data = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Invalid update")
+    # Отвечаем сразу: обработка идет в очереди приложения, Telegram не ждет обработчиков
+    if not await bot.feed_webhook_update(data):
+        logger.debug(f"Duplicate update {data.get('update_id')} skipped")
+    return {"ok": True}
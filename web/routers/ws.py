@@ -1,7 +1,6 @@
 from fastapi import APIRouter, WebSocket
-from jose import jwt, JWTError
-from web.utils import SECRET_KEY, ALGORITHM
-from modules.database import AdminUser
+from jose import JWTError
+from web.deps import resolve_token_user
 
 router = APIRouter()
 
@@ -12,13 +11,7 @@ async def ws_endpoint(websocket: WebSocket):
         await websocket.close(code=1008)
         return
     try:
-        scheme, _, param = token.partition(" ")
-        payload = jwt.decode(param, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        if not username:
-            await websocket.close(code=1008)
-            return
-        user = await AdminUser.get_or_none(username=username)
+        user = await resolve_token_user(token)
         if not user:
             await websocket.close(code=1008)
             return